@@ -25,19 +25,36 @@ Matrix Routing:
 __version__ = '0.2.3'
 
 import serial
+import asyncio
 import logging
 import math
+import os
+import re
+import select
+import socket
 import time
 import warnings
 import time
 import string
+import threading
+import queue
+import itertools
 
-from functools import wraps
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
 
 testing = 0
 
 
 _LOGGER = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:  # optional, only used to speed up the *Array conversions
+    numpy = None
 if 0:
     import sys
     out_hdlr = logging.StreamHandler(sys.stdout)
@@ -54,6 +71,10 @@ XAP400Type = "XAP400"
 XAP800_LOCATION_PREFIX = "XAP800"
 XAP800_UNIT_TYPE = 1
 EOM = "\r"
+# prefixes probed by the connect handshake and the unit type answering each
+probePrefixes = {XAP800_CMD: XAP800Type, XAP400_CMD: XAP400Type}
+# command prefix of each unit type, so a mixed stack is addressed per unit
+unitPrefixes = {XAP800Type: XAP800_CMD, XAP400Type: XAP400_CMD}
 DEVICE_MAXMICS = "Max Number of Microphones"
 matrixGeo = {'XAP800': [{"c": 1, "og": "O", "ig": "I"},
                         {"c": 2, "og": "O", "ig": "I"},
@@ -112,6 +133,64 @@ matrixGeo = {'XAP800': [{"c": 1, "og": "O", "ig": "I"},
                         {"c": "C", "og": "P", "ig": "P"},
                         {"c": "D", "og": "P", "ig": "P"}]}
 nogainGroups = ('E')
+# I/O worker priorities, lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10
+# Number of leading arguments that address a command (channel, group, node...)
+# rather than carry a value. Responses echo these, so they are used to match
+# a response back to the request that caused it.
+addressArgs = {"MTRX": 4, "MTRXLVL": 4, "FILTER": 3, "LVL": 3,
+               "GAIN": 2, "MAX": 2, "MIN": 2, "MUTE": 2, "AGC": 2,
+               "AGCSET": 2, "NCSEL": 2, "NCD": 2, "LABEL": 2, "RAMP": 2,
+               "DECAY": 1, "AEC": 1, "AAMB": 1, "AMBLVL": 1, "CHAIRO": 1,
+               "PRESET": 1, "ERL": 1, "GMODE": 1, "GRPSEL": 1, "GOVER": 1,
+               "GHOLD": 1, "GRATIO": 1, "MLINE": 1, "NLP": 1, "NOM": 1,
+               "OFFA": 1, "PAA": 1, "PP": 1, "REFSEL": 1}
+# (command, group): address arguments where a group takes more than
+# addressArgs, expansion bus labels are kept per direction (inout)
+groupAddressArgs = {("LABEL", "E"): 3}
+
+
+def addressCount(command, args):
+    """Number of leading args of a command that are its address"""
+    if len(args) > 1:
+        count = groupAddressArgs.get((command, str(args[1]).upper()))
+        if count is not None:
+            return count
+    return addressArgs.get(command, 0)
+# Types of the values following the address, see CommandCodec. Commands
+# not listed send their arguments as str() and decode values as str.
+commandValues = {"GAIN": ("db", "str"),  # level, A(bsolute) or R(elative)
+                 "MTRXLVL": ("db", "str"),
+                 "MAX": ("db",),
+                 "MIN": ("db",),
+                 "LVL": ("float",),
+                 "AGCSET": ("db", "db", "float", "db"),  # threshold, target, attack, gain
+                 "FILTER": ("int", "float", "float", "float"),  # type, frequency, gain, bandwidth
+                 "MTRX": ("str",),
+                 "MUTE": ("str",),
+                 "AGC": ("str",),
+                 "DECAY": ("int",),
+                 "REFSEL": ("int",)}
+
+
+def _encodeDb(value):
+    """Levels go out with the unit's 0.01 dB resolution"""
+    return value if isinstance(value, str) else "%.2f" % value
+
+
+# value type: (encoder, decoder)
+fieldTypes = {"str": (str, str),
+              "int": (str, int),
+              "float": (str, float),
+              "db": (_encodeDb, float)}
+# Queries that report live values, never answered from the cache
+uncachedCommands = ("LVL", "GATE", "ERL", "PRESET", "SERECHO")
+# Setters whose response is not shaped like the query response
+invalidateOnlyCommands = ("FILTER",)
+# Setters where a value of 2 toggles the current state
+toggleCommands = ("MUTE", "MTRX", "LFP")
 
 def stereo(func):
     """
@@ -158,6 +237,20 @@ def stereo(func):
     return stereoFunc
 
 
+def interactive(func):
+    """
+    Mark a setter as interactive.
+    When the I/O worker is running, commands issued by the wrapped method
+    are queued at PRIORITY_INTERACTIVE so they go ahead of bulk scans.
+    """
+    @wraps(func)
+    def interactiveFunc(self, *args, **kwargs):
+        with self.priority(PRIORITY_INTERACTIVE):
+            return func(self, *args, **kwargs)
+    interactiveFunc.interactive = True
+    return interactiveFunc
+
+
 def db2linear(db, maxref=0):
     """Convert a db level to a linear level of 0-1.
     If maxref is provided, the return value is a proportion of maxref
@@ -175,14 +268,809 @@ def linear2db(gain, maxref=0):
     return min(max(maxref + dbdiff, -99), 99)
 
 
+def db2linearArray(levels, maxref=0):
+    """db2linear for a sequence of levels (numbers or numeric strings).
+    Returns a numpy array if numpy is installed, otherwise an array('d').
+    """
+    if numpy is not None:
+        return 10.0 ** ((numpy.asarray(levels, dtype=float) + 0.0000001 - maxref) / 20.0)
+    return array('d', [10.0 ** ((float(db) + 0.0000001 - maxref) / 20.0) for db in levels])
+
+
+def linear2dbArray(gains, maxref=0):
+    """linear2db for a sequence of gains, see db2linearArray"""
+    if numpy is not None:
+        dbdiff = 20.0 * numpy.log10(numpy.asarray(gains, dtype=float) + 0.000001)
+        return numpy.clip(maxref + dbdiff, -99, 99)
+    return array('d', [min(max(maxref + 20.0 * math.log10(float(gain) + 0.000001), -99), 99)
+                       for gain in gains])
+
+
+class MatrixReport(object):
+    """Square matrix of crosspoint values stored in a typed array.
+    Rows are inputs and columns outputs, both in channels order:
+        report[inChannel, outChannel]
+        report.row(inChannel), report.column(outChannel)
+    tolist() gives a list of lists, asarray() a 2-D numpy array.
+    """
+
+    def __init__(self, channels, typecode, missing):
+        self.channels = list(channels)
+        self.size = len(self.channels)
+        self.missing = missing
+        self.ordinal = dict((str(c).upper(), i) for i, c in enumerate(self.channels))
+        self.values = array(typecode, [missing]) * (self.size * self.size)
+
+    def __repr__(self):
+        return "MatrixReport: %dx%d %s" % (self.size, self.size, self.values.typecode)
+
+    def _index(self, key):
+        inChannel, outChannel = key
+        return self.ordinal[str(inChannel).upper()] * self.size + self.ordinal[str(outChannel).upper()]
+
+    def __getitem__(self, key):
+        return self.values[self._index(key)]
+
+    def __setitem__(self, key, value):
+        self.values[self._index(key)] = value
+
+    def row(self, inChannel):
+        start = self.ordinal[str(inChannel).upper()] * self.size
+        return self.values[start:start + self.size].tolist()
+
+    def column(self, outChannel):
+        return self.values[self.ordinal[str(outChannel).upper()]::self.size].tolist()
+
+    def tolist(self):
+        return [self.values[i:i + self.size].tolist() for i in range(0, len(self.values), self.size)]
+
+    def asarray(self):
+        """2-D numpy array of the values (needs numpy)"""
+        return numpy.asarray(self.values).reshape(self.size, self.size)
+
+
+class XAPRequest(object):
+    """A command written to a unit and the response it is waiting for."""
+    # per request values that are usually left at these
+    args = ()
+    query = True
+    deadline = None
+    expect = 1  # response lines expected, wildcard queries answer many
+    cacheable = True  # False to always ask the unit
+    response = None
+    error = None
+    done = False
+    codec = None
+
+    def __init__(self, xapstr, key, rtnCount=1):
+        self.xapstr = xapstr
+        self.key = key  # (unit, command, address args...) as echoed back
+        self.command = key[1] if len(key) > 1 else None
+        self.rtnCount = rtnCount
+        self.responses = []
+        self.callbacks = []
+
+    def __repr__(self):
+        return "XAPRequest: " + self.xapstr.strip()
+
+    def matches(self, items):
+        """True if response items echo this request's unit, command and address"""
+        if len(items) < len(self.key):
+            return False
+        for want, got in zip(self.key, items):
+            if want != '*' and want != got.upper():
+                return False
+        return True
+
+    def complete(self, response=None, error=None):
+        """Record the response items (or error line) for this request"""
+        self.response = response
+        self.error = error
+        self.done = True
+        for callback in self.callbacks:
+            callback(self)
+
+    def addDoneCallback(self, callback):
+        """Call callback(request) once the request is answered or times out"""
+        self.callbacks.append(callback)
+
+    def result(self):
+        """Return the response the same way readResponse does.
+        Raises an Exception if the unit answered with an ERROR,
+        returns None if no answer arrived.
+        """
+        if self.error is not None:
+            raise Exception(self.error)
+        if self.response is None:
+            return None
+        if self.rtnCount == 1:
+            return self.response[-1]
+        return self.response[-self.rtnCount:]
+
+    def values(self):
+        """Return the response values decoded by the command's codec,
+        as a tuple. Raises and returns None like result().
+        """
+        if self.error is not None:
+            raise Exception(self.error)
+        if self.response is None:
+            return None
+        return self.codec.decode(self.response)
+
+
+class CommandCodec(object):
+    """Encoder and decoder of one command, compiled from addressArgs,
+    groupAddressArgs and commandValues (see codecFor).
+    Arguments go out as str(), except values with a typed encoder; response
+    values after the echoed address are decoded by an unrolled decoder.
+    Frame headers are kept per unit.
+    """
+
+    def __init__(self, command, nAddress=None):
+        self.command = command
+        self.nAddress = addressArgs.get(command, 0) if nAddress is None else nAddress
+        self._groups = dict((group, count) for (c, group), count in groupAddressArgs.items()
+                            if c == command and nAddress is None)
+        self._variants = {}  # address count: CommandCodec
+        types = commandValues.get(command, ())
+        self.encoders = tuple((self.nAddress + i, fieldTypes[t][0]) for i, t in enumerate(types)
+                              if fieldTypes[t][0] is not str)
+        self.decode = _compileDecoder(tuple(fieldTypes[t][1] for t in types), 2 + self.nAddress)
+        self._headers = {}  # (prefix, unitCode): (frame start, unit key)
+
+    def __repr__(self):
+        return "CommandCodec: " + self.command
+
+    def forArgs(self, args):
+        """The codec for these arguments, one with a longer address for
+        the groups in groupAddressArgs"""
+        if not self._groups or len(args) < 2:
+            return self
+        count = self._groups.get(str(args[1]).upper())
+        if count is None:
+            return self
+        codec = self._variants.get(count)
+        if codec is None:
+            codec = self._variants[count] = CommandCodec(self.command, count)
+        return codec
+
+    def request(self, prefix, unitCode, args, rtnCount=1):
+        """Encode a command into an XAPRequest"""
+        if self._groups:
+            codec = self.forArgs(args)
+            if codec is not self:
+                return codec.request(prefix, unitCode, args, rtnCount)
+        header = self._headers.get((prefix, unitCode))
+        if header is None:
+            header = ("%s%s %s " % (prefix, unitCode, self.command), (prefix[1:] + str(unitCode)).upper())
+            self._headers[(prefix, unitCode)] = header
+        sent = list(map(str, args))
+        for position, encode in self.encoders:
+            if position < len(args):
+                sent[position] = encode(args[position])
+        nAddress = self.nAddress
+        req = XAPRequest(header[0] + " ".join(sent) + " " + EOM,
+                         (header[1], self.command, *map(str.upper, sent[:nAddress])), rtnCount)
+        req.args = sent
+        if len(sent) > nAddress:
+            req.query = False
+        req.codec = self
+        return req
+
+
+def _compileDecoder(decoders, start):
+    """Decoder of the typed values at items[start:], as a tuple.
+    Unrolled for up to four values, responses of another length (fewer
+    values, or more than the table knows) take the general path.
+    """
+    count = len(decoders)
+
+    def decode(items):
+        values = items[start:]
+        decoded = [d(v) for d, v in zip(decoders, values)]
+        return tuple(decoded + values[count:]) if len(values) > count else tuple(decoded)
+    end = start + count
+    if count == 1:
+        (a,) = decoders
+        return lambda items: (a(items[start]),) if len(items) == end else decode(items)
+    if count == 2:
+        a, b = decoders
+        return lambda items: (a(items[start]), b(items[start + 1])) if len(items) == end else decode(items)
+    if count == 3:
+        a, b, c = decoders
+        return lambda items: (a(items[start]), b(items[start + 1]), c(items[start + 2])) \
+            if len(items) == end else decode(items)
+    if count == 4:
+        a, b, c, d = decoders
+        return lambda items: (a(items[start]), b(items[start + 1]), c(items[start + 2]), d(items[start + 3])) \
+            if len(items) == end else decode(items)
+    return decode
+
+
+_codecs = {}
+
+
+def codecFor(command):
+    """The CommandCodec of a command, compiled on first use"""
+    codec = _codecs.get(command)
+    if codec is None:
+        codec = _codecs[command] = CommandCodec(command.upper())
+    return codec
+
+
+class XAPCache(object):
+    """Write-through cache of unit responses.
+    Entries are keyed like XAPRequest.key: (unit, command, address args...).
+    Queries are answered from the cache while the entry is younger than ttl
+    seconds, setters store their response as the new value, and any PRESET
+    command drops everything cached for that unit. A ttl of 0 disables it.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, req):
+        """Return cached response items for a query, or None"""
+        if not self.ttl or not req.query or not req.cacheable or req.command in uncachedCommands:
+            return None
+        with self._lock:
+            entry = self._entries.get(req.key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+        return None
+
+    def store(self, req):
+        """Update the cache from an answered request"""
+        if not self.ttl:
+            return
+        unit = req.key[0]
+        if req.command == "PRESET":
+            self.invalidate(unit)
+            return
+        if req.command in uncachedCommands:
+            return
+        if req.error is not None or req.response is None:
+            with self._lock:
+                self._entries.pop(req.key, None)
+            return
+        if "*" in req.key:
+            if not req.query:
+                self.invalidate(unit, req.command)
+                return
+            # wildcard queries answer one line per channel, cache each
+            now = time.time()
+            with self._lock:
+                for items in req.responses or [req.response]:
+                    key = tuple(x.upper() for x in items[:len(req.key)])
+                    self._entries[key] = (now, items)
+            return
+        if not req.query and (req.command in invalidateOnlyCommands or
+                              req.args[-1].upper() == "R"):
+            with self._lock:
+                self._entries.pop(req.key, None)
+            return
+        with self._lock:
+            self._entries[req.key] = (time.time(), list(req.response))
+
+    def storeEvent(self, items):
+        """Update the cache from an unsolicited report"""
+        if not self.ttl:
+            return
+        command = items[1].upper()
+        if command == "PRESET":
+            self.invalidate(items[0])
+            return
+        if command in uncachedCommands:
+            return
+        key = tuple(x.upper() for x in items[:2 + addressCount(command, items[2:])])
+        with self._lock:
+            if command in invalidateOnlyCommands:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = (time.time(), items)
+
+    def invalidate(self, unit=None, command=None):
+        """Drop cached entries, optionally only for one unit and command.
+        unit is as in the request key, e.g. "50" for XAP800 unit 0
+        """
+        with self._lock:
+            if unit is None and command is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if (unit is None or key[0] == unit) and (command is None or key[1] == command):
+                    del self._entries[key]
+
+
+class ResponseGate(object):
+    """Tracks whether the link is waiting on a response.
+    Whoever writes a command takes the gate, the response reader releases it
+    once the answer (or a timeout) has been read. Waiters block on a
+    condition and are woken as soon as the gate is released.
+    The owner holds the gate until its deadline, which it pushes out with
+    extend as it writes more commands; only an owner past its deadline
+    (a response that never arrived) has the gate taken over.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._deadline = 0
+
+    @property
+    def busy(self):
+        return self._busy
+
+    def acquire(self, timeout):
+        """Wait for the gate, then take it for timeout seconds.
+        Returns False if it had to be taken over from an owner past its
+        deadline.
+        """
+        with self._cond:
+            while self._busy:
+                remaining = self._deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            free = not self._busy
+            self._busy = True
+            self._deadline = time.time() + timeout
+            return free
+
+    def tryAcquire(self, timeout):
+        """Take the gate for timeout seconds only if it is free right now"""
+        with self._cond:
+            if self._busy:
+                return False
+            self._busy = True
+            self._deadline = time.time() + timeout
+            return True
+
+    def extend(self, deadline):
+        """Keep the gate at least until deadline"""
+        with self._cond:
+            self._deadline = max(self._deadline, deadline)
+
+    def release(self):
+        """Mark the line free and wake anyone waiting for it"""
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+
+class XAPJob(object):
+    """Work item for the I/O worker.
+    Either a single XAPRequest, which the worker pipelines together with
+    other queued requests, or a method call run on the worker thread.
+    """
+
+    def __init__(self, request=None, func=None, args=(), kwargs=None):
+        self.request = request
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.future = Future()
+
+    def __repr__(self):
+        if self.request is not None:
+            return "XAPJob: " + repr(self.request)
+        return "XAPJob: " + self.func.__name__
+
+
+class ResponseReader(object):
+    """Framing of the bytes coming from a port.
+    Whatever the port has waiting is taken in one read and added to a
+    reusable bytearray, which is cut into lines at \\r and \\n. Lines are
+    tested and tokenized straight from the buffer and queued in lines as
+    (items, error) for a dispatcher: error is the line of an ERROR
+    response, otherwise items are the tokens after the '#'. Lines with
+    neither are dropped.
+    """
+    eol = re.compile(b'[\r\n]')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.lines = deque()
+
+    def clear(self):
+        del self.buffer[:]
+        self.lines.clear()
+
+    def pump(self, port, wait=True):
+        """Read everything the port has waiting. With wait set, keep
+        reading until a complete line has been framed, each read waiting
+        up to the port's timeout.
+        Returns:
+            number of bytes read, 0 if nothing came
+        """
+        count = 0
+        lines = self.lines
+        while 1:
+            data = port.readAvailable(wait)
+            if not data:
+                return count
+            count += len(data)
+            self.feed(data)
+            if lines or not wait:
+                return count
+
+    def feed(self, data):
+        """Add received bytes and queue the lines they complete"""
+        buffer = self.buffer
+        scanned = len(buffer)  # the rest holds no line ending
+        buffer += data
+        start = 0
+        with memoryview(buffer) as view:
+            for match in self.eol.finditer(buffer, scanned):
+                end = match.start()
+                if end > start:
+                    line = self._parse(buffer, view, start, end)
+                    if line is not None:
+                        self.lines.append(line)
+                start = end + 1
+        if start:
+            del buffer[:start]
+
+    @staticmethod
+    def _parse(buffer, view, start, end):
+        if buffer.startswith(b'ERROR', start, end):
+            return None, str(view[start:end], 'utf-8', 'replace')
+        pos = buffer.find(b'#', start, end)
+        if pos < 0:
+            return None
+        return str(view[pos + 1:end], 'utf-8', 'replace').split(), None
+
+
+class Transport(object):
+    """Byte link to a stack of units.
+    XAPX00 only uses this pyserial-like subset of a port: read, readline,
+    write, in_waiting, timeout, reset_input_buffer, fileno and close, plus
+    readAvailable.
+    Backends provide _receive and _send; received bytes are buffered here.
+    timeout - seconds read and readline wait, None to block, 0 to poll
+    writeBatch - bytes to collect before writing, 0 to write every call
+                 at once. Collected bytes also go out when a read starts
+                 or on flush.
+    readSize - most bytes taken from the backend in one read
+    """
+
+    def __init__(self, timeout=1, writeBatch=0, readSize=4096):
+        self.timeout = timeout
+        self.writeBatch = writeBatch
+        self.readSize = readSize
+        self._rx = bytearray()
+        self._tx = bytearray()
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+    def open(self):
+        return self
+
+    def close(self):
+        self.flush()
+
+    def fileno(self):
+        raise Exception(self.__class__.__name__ + " has no file descriptor")
+
+    def _receive(self, timeout):
+        """Return the bytes that arrive within timeout, b'' if none"""
+        raise NotImplementedError
+
+    def _send(self, data):
+        raise NotImplementedError
+
+    def write(self, data):
+        if not self.writeBatch:
+            self._send(data)
+            return len(data)
+        self._tx += data
+        if len(self._tx) >= self.writeBatch:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._tx:
+            data = bytes(self._tx)
+            del self._tx[:]
+            self._send(data)
+
+    @property
+    def in_waiting(self):
+        self.flush()
+        self._rx += self._receive(0)
+        return len(self._rx)
+
+    def reset_input_buffer(self):
+        while self._receive(0):
+            pass
+        del self._rx[:]
+
+    def _fill(self, done):
+        """Receive until done() or the timeout passes"""
+        self.flush()
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while not done():
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            data = self._receive(remaining)
+            if data:
+                self._rx += data
+            elif remaining is not None and time.time() >= deadline:
+                return
+
+    def readAvailable(self, wait=True):
+        """Return everything received so far, if nothing and wait is set
+        whatever arrives within the timeout"""
+        self.flush()
+        if not self._rx:
+            return self._receive(self.timeout if wait else 0)
+        data = bytes(self._rx)
+        del self._rx[:]
+        return data
+
+    def read(self, size=1):
+        self._fill(lambda: len(self._rx) >= size)
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def readline(self):
+        self._fill(lambda: b'\n' in self._rx)
+        end = self._rx.find(b'\n') + 1 or len(self._rx)
+        line = bytes(self._rx[:end])
+        del self._rx[:end]
+        return line
+
+
+class SerialTransport(Transport):
+    """Local serial port, reads are left to pyserial.
+    rxBufferSize, txBufferSize - driver buffer sizes, where pyserial can
+                                 set them (Windows)
+    """
+
+    def __init__(self, comPort, baudRate=38400, timeout=1, writeBatch=0,
+                 rxBufferSize=None, txBufferSize=None):
+        Transport.__init__(self, timeout, writeBatch)
+        self.comPort = comPort
+        self.baudRate = baudRate
+        self.rxBufferSize = rxBufferSize
+        self.txBufferSize = txBufferSize
+        self.port = None
+
+    def __repr__(self):
+        return "SerialTransport: " + self.comPort
+
+    def open(self):
+        self.port = serial.Serial(self.comPort, self.baudRate, timeout=self._timeout)
+        if (self.rxBufferSize or self.txBufferSize) and hasattr(self.port, 'set_buffer_size'):
+            self.port.set_buffer_size(rx_size=self.rxBufferSize or 4096,
+                                      tx_size=self.txBufferSize)
+        return self
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+        if getattr(self, 'port', None) is not None:
+            self.port.timeout = timeout
+
+    def close(self):
+        self.flush()
+        self.port.close()
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def _send(self, data):
+        self.port.write(data)
+
+    @property
+    def in_waiting(self):
+        self.flush()
+        return self.port.in_waiting
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+
+    def read(self, size=1):
+        self.flush()
+        return self.port.read(size)
+
+    def readAvailable(self, wait=True):
+        self.flush()
+        port = self.port
+        waiting = port.in_waiting
+        if waiting or not wait:
+            return port.read(waiting) if waiting else b''
+        data = port.read(1)
+        waiting = port.in_waiting if data else 0
+        return data + port.read(waiting) if waiting else data
+
+    def readline(self):
+        self.flush()
+        return self.port.readline()
+
+
+class _SelectTransport(Transport):
+    """Transport over a file descriptor that select() can wait on"""
+
+    def _wait(self, timeout):
+        return bool(select.select([self.fileno()], [], [], timeout)[0])
+
+
+class TCPTransport(_SelectTransport):
+    """Raw TCP connection, e.g. to a serial-over-IP terminal server.
+    noDelay - send small writes at once (TCP_NODELAY), pair with
+              writeBatch to control how commands are packed into segments
+    sendBuffer, recvBuffer - socket buffer sizes, None for the default
+    """
+
+    def __init__(self, host, port, timeout=1, writeBatch=0, readSize=4096,
+                 noDelay=True, sendBuffer=None, recvBuffer=None, connectTimeout=5):
+        Transport.__init__(self, timeout, writeBatch, readSize)
+        self.address = (host, int(port))
+        self.noDelay = noDelay
+        self.sendBuffer = sendBuffer
+        self.recvBuffer = recvBuffer
+        self.connectTimeout = connectTimeout
+        self.sock = None
+
+    def __repr__(self):
+        return "TCPTransport: %s:%d" % self.address
+
+    def open(self):
+        self.sock = socket.create_connection(self.address, self.connectTimeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(bool(self.noDelay)))
+        if self.sendBuffer:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sendBuffer)
+        if self.recvBuffer:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recvBuffer)
+        self.sock.setblocking(False)
+        return self
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _receive(self, timeout):
+        if not self._wait(timeout):
+            return b''
+        data = self.sock.recv(self.readSize)
+        if not data:
+            raise ConnectionError("Connection to %s:%d closed" % self.address)
+        return data
+
+    def _send(self, data):
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.sock.setblocking(False)
+
+
+class PtyTransport(_SelectTransport):
+    """Pseudo terminal, e.g. a simulator (xapsim) or a serial port bridged
+    by socat. Opened raw, without any baud rate or line settings."""
+
+    def __init__(self, path, timeout=1, writeBatch=0, readSize=4096):
+        Transport.__init__(self, timeout, writeBatch, readSize)
+        self.path = path
+        self.fd = None
+
+    def __repr__(self):
+        return "PtyTransport: " + self.path
+
+    def open(self):
+        import tty
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        return self
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+    def fileno(self):
+        return self.fd
+
+    def _receive(self, timeout):
+        if not self._wait(timeout):
+            return b''
+        return os.read(self.fd, self.readSize)
+
+    def _send(self, data):
+        while data:
+            if not select.select([], [self.fd], [], self.timeout)[1]:
+                raise TimeoutError("Write to %s timed out" % self.path)
+            data = data[os.write(self.fd, data):]
+
+
+class LoopbackTransport(Transport):
+    """In-memory link answered by a function, with no I/O at all, e.g.
+    LoopbackTransport(xapsim.XAPSimulator(...).handleLine) to time the
+    Python side on its own.
+    handler - handler(command line) returns the response lines
+    """
+
+    def __init__(self, handler, timeout=0, writeBatch=0):
+        Transport.__init__(self, timeout, writeBatch)
+        self.handler = handler
+        self._partial = b''
+
+    def _receive(self, timeout):
+        return b''  # answers are put in the buffer as commands are written
+
+    def _fill(self, done):
+        self.flush()  # nothing more can arrive, do not wait for it
+
+    def _send(self, data):
+        lines = (self._partial + data).split(b'\r')
+        self._partial = lines.pop()
+        for line in lines:
+            for response in self.handler(line.decode(errors="replace")):
+                self._rx += (response + "\r\n").encode()
+
+    def reset_input_buffer(self):
+        del self._rx[:]
+
+
+def openTransport(comPort, baudRate=38400, timeout=1):
+    """Open the Transport for a port name:
+    tcp://host:port or socket://host:port - TCPTransport
+    /dev/pts/N - PtyTransport
+    anything else - SerialTransport
+    A Transport instance is opened and returned as it is.
+    """
+    if isinstance(comPort, Transport):
+        transport = comPort
+    elif comPort.startswith(("tcp://", "socket://")):
+        host, port = comPort.split("://", 1)[1].rsplit(":", 1)
+        transport = TCPTransport(host, port, timeout=timeout)
+    elif comPort.startswith("/dev/pts/"):
+        transport = PtyTransport(comPort, timeout=timeout)
+    else:
+        transport = SerialTransport(comPort, baudRate, timeout=timeout)
+    return transport.open()
+
+
 class XAPX00(object):
     """XAPX000 Module."""
 
     def __init__(self, comPort="/dev/ttyUSB0", baudRate=38400,
-                 stereo=0, XAPType=XAP800Type):
-        """init: no parameters required."""
+                 stereo=0, XAPType=XAP800Type, threaded=0, cacheTTL=0,
+                 coalesce=0, units=None, transport=None):
+        """init: no parameters required.
+        threaded: 1 to own the serial port from a single I/O worker thread
+                  so methods may be called from any thread.
+        cacheTTL: seconds queries may be answered from the XAPCache,
+                  0 to always ask the unit.
+        coalesce: 1 to collapse setters for the same unit, parameter,
+                  channel and group that are waiting for the link into one
+                  write of the latest value, see _coalesceRequest. Without
+                  threaded only commands flushed together are coalesced.
+        units: known topology, {unitCode: "XAP800" or "XAP400"}. connect
+               then trusts it and sends no probes, so the units must
+               already have serial echo (SERECHO) on. Each unit is
+               addressed with the prefix of its type, see unitType.
+        transport: Transport to talk to instead of opening comPort (see
+                   openTransport), e.g. a TCPTransport with its own
+                   buffering settings or a LoopbackTransport.
+        """
         _LOGGER.debug("XAPX00 version: {}".format(__version__))
-        self.comPort      = comPort
+        self.comPort      = comPort if transport is None else repr(transport)
+        self.transport    = transport
         self.baudRate     = baudRate
         self.byteLength   = 8
         self.stopBits     = 1
@@ -192,92 +1080,600 @@ class XAPX00(object):
         self.XAPType      = XAPType
         self.XAPCMD       = XAP800_CMD if XAPType == XAP800Type else XAP400_CMD
         self.connected    = 0
+        self.units        = dict(units) if units is not None else None
+        self.knownUnits   = units is not None
+        self.discoveryWindow = 0.2  # seconds to wait for SERECHO answers
+        self.identities   = {}  # unitCode: identity, see getIdentity
         self.input_range  = range(1, 13)
         self.output_range = range(1, 13)
         self.convertDb    = 1  # translate levels between linear(0-1) and db
         self._lastcall    = time.time()
         self._maxtime     = 60 * 60 * 1  # 1 hour
         self._maxrespdelay = 5
-        self._sleeptime = 0.25
-        self._waiting_response = 0
+        self._gate = ResponseGate()
+        self.pipelineWindow = 8  # max commands in flight when pipelining
+        self._inflight = deque()
+        self._reader = ResponseReader()
+        self._local = threading.local()
+        self.threaded = threaded
+        self._jobs = queue.PriorityQueue()
+        self._jobseq = itertools.count()
+        self._worker = None
+        self.wildcardMatrix = {}  # unitCode: whether MTRX wildcards work
+        self.cache = XAPCache(cacheTTL)
+        self.coalesce = coalesce
+        self._pendingWrites = {}  # key: [request holding the queue slot, latest request]
+        self._pendingLock = threading.Lock()
+        self.eventListeners = []
+        self.listening = False
+        self.listenInterval = 0.1  # seconds between checks for unsolicited reports
+        self._listener = None
         self.ExpansionChannels = string.ascii_uppercase[string.ascii_uppercase.find('O'):]
         self.ProcessingChannels = string.ascii_uppercase[:string.ascii_uppercase.find('H')]
 
     def connect(self):
-        """Open serial port and check connection."""
+        """Open the port (see openTransport) and check connection."""
         _LOGGER.info("Connecting to XAPX00 at " + str(self.baudRate) +
                      " baud...")
-        self.serial = serial.Serial(self.comPort, self.baudRate,
+        self.serial = openTransport(self.transport or self.comPort, self.baudRate,
                                     timeout=self.timeout)
-        # Ensure connectivity by requesting the UID of the first unit
-        for id in range(0,8):
-            self.serial.reset_input_buffer()
-            self.serial.write(("#5%s SERECHO 1 %s" % (str(id), EOM)).encode())
-            self.serial.readlines(3) #clear response
-            self.serial.write(("#7%s SERECHO 1 %s" % (str(id), EOM)).encode())
-            self.serial.readlines(3) #clear response
-        # uid = self.getUniqueId(0) # We cannot assume the unit we have is at ID 0
-        # _LOGGER.info("Connected, got uniqueID %s", str(uid))
+        if not self.knownUnits:
+            self.units = self.discoverUnits()
+            _LOGGER.info("Found units %s", self.units)
+        self.identities = {}
+        self.cache.invalidate()
         self.connected = 1
+        if self.threaded:
+            self.startWorker()
+
+    def discoverUnits(self, window=None):
+        """Switch on serial echo at every unit id and see who answers.
+        All probes are written back to back and the answers collected
+        within one window (the time the probes take to send plus
+        discoveryWindow), instead of waiting out a timeout per id.
+        Returns:
+            {unitCode: unit type} of the units that answered
+        """
+        if window is None:
+            window = self.discoveryWindow
+        probes = "".join("%s%d SERECHO 1 %s" % (prefix, id, EOM)
+                         for id in range(0, 8) for prefix in probePrefixes)
+        self.serial.reset_input_buffer()
+        self.serial.write(probes.encode())
+        deadline = time.time() + window + len(probes) * 10.0 / self.baudRate
+        timeout = self.serial.timeout
+        units = {}
+        buffer = b''
+        try:
+            while len(units) < 8:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.serial.timeout = remaining
+                data = self.serial.read(max(1, self.serial.in_waiting))
+                if not data:
+                    break  # the window is over
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    items = line.decode(errors="replace").split()
+                    if len(items) >= 2 and items[1] == "SERECHO" and items[0][:2] in probePrefixes \
+                            and items[0][2:].isdigit():
+                        units[int(items[0][2:])] = probePrefixes[items[0][:2]]
+        finally:
+            self.serial.timeout = timeout
+        self.units = units
+        return units
+
+    def rediscoverUnits(self):
+        """Forget the units and their identities and probe for them again,
+        e.g. after units were added, swapped or renumbered.
+        Returns:
+            {unitCode: unit type}, see discoverUnits
+        """
+        self.identities = {}
+        self.cache.invalidate()
+        self.knownUnits = False
+        if self._onWorker():
+            return self.discoverUnits()
+        return self.submit(self.discoverUnits).result()
+
+    def getIdentity(self, unitCode=0):
+        """Identity of a unit: its type, unique ID and firmware version.
+        Read from the unit the first time it is asked for and kept for the
+        rest of the connection (see rediscoverUnits), so every layer can
+        ask for it without sending anything.
+        Returns:
+            dict with type, UID and version, or None if no unit answers
+        """
+        identity = self.identities.get(unitCode)
+        if identity is None:
+            uid = self.getUniqueId(unitCode)
+            if uid is None:
+                return None
+            identity = {'type': self.getUnitType(unitCode), 'UID': uid,
+                        'version': self.getVersion(unitCode)}
+            self.identities[unitCode] = identity
+        return identity
 
     def disconnect(self):
         """Disconnect from serial port"""
+        self.stopListener()
+        self.stopWorker()
         self.serial.close()
         self.connected = 0
 
-    def send(self, data):
-        """Send the specified data string to the XAP800
+    def startWorker(self):
+        """Start the I/O worker thread.
+        From then on all commands are queued to the worker, which is the
+        only thread touching the serial port. Commands waiting in the queue
+        are pipelined together and sent in priority order.
+        """
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._ioWorker,
+                                        name="XAPX00 I/O " + self.comPort)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def addEventListener(self, callback):
+        """Call callback(event) for every unsolicited report from a unit.
+        event is a dict with unitCode, prefix, command, args (the rest
+        of the line, e.g. ['1', 'I', '-3.00', 'A'] for GAIN) and values,
+        the values after the address decoded like XAPValues does
+        (e.g. (-3.0, 'A')).
+        Callbacks run on the thread reading the port and must not send
+        commands themselves.
+        """
+        self.eventListeners.append(callback)
+
+    def removeEventListener(self, callback):
+        self.eventListeners.remove(callback)
+
+    def startListener(self):
+        """Read unsolicited reports (front panel changes, presets...)
+        while the link is otherwise idle. With the I/O worker running the
+        worker does this between jobs, otherwise a listener thread does.
+        """
+        self.listening = True
+        if self._worker is not None:
+            self.submit(self._pollEvents)  # wake an idle worker so it starts polling
+        elif self._listener is None:
+            self._listener = threading.Thread(target=self._listen,
+                                              name="XAPX00 listener " + self.comPort)
+            self._listener.daemon = True
+            self._listener.start()
+
+    def stopListener(self):
+        self.listening = False
+        if self._listener is not None and threading.current_thread() is not self._listener:
+            self._listener.join()
+        self._listener = None
+
+    def _listen(self):
+        """Listener thread: poll for reports whenever nobody holds the line,
+        until the I/O worker is started and takes over"""
+        while self.listening and self._worker is None:
+            if self._gate.tryAcquire(self._maxrespdelay):
+                try:
+                    self._pollEvents()
+                finally:
+                    self._gate.release()
+            time.sleep(self.listenInterval)
+
+    def _pollEvents(self):
+        """Dispatch any complete lines waiting on the port"""
+        while self._reader.pump(self.serial, wait=False):
+            pass
+        self._dispatchPending()
+
+    def _handleEvent(self, items):
+        """Turn an unmatched response line into an event for the listeners,
+        lines that are not a unit report are dropped"""
+        command = items[1].upper()
+        try:
+            if not items[0][1:].isdigit():
+                raise ValueError("no unit header")
+            values = codecFor(command).forArgs(items[2:]).decode(items)
+        except ValueError:
+            _LOGGER.debug("Dropping malformed report %s" % items)
+            return
+        event = {"unitCode": int(items[0][1:]), "prefix": "#" + items[0][0],
+                 "command": command, "args": items[2:], "values": values}
+        _LOGGER.debug("Event %s" % event)
+        self.cache.storeEvent(items)
+        for callback in list(self.eventListeners):
+            try:
+                callback(event)
+            except Exception:
+                _LOGGER.exception("Event listener failed for %s" % event)
+
+    def stopWorker(self):
+        """Stop the I/O worker once the jobs already queued are done"""
+        if self._worker is None:
+            return
+        self._submitJob(XAPJob(), PRIORITY_BULK + 1)  # stop marker
+        if threading.current_thread() is not self._worker:
+            self._worker.join()
+        self._worker = None
+
+    @contextmanager
+    def priority(self, level):
+        """Queue commands issued by this thread inside the block at level:
+            with xap.priority(PRIORITY_BULK):
+                xap.getMatrixRoutingReport()
+        """
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def submit(self, method, *args, **kwargs):
+        """Run a method on the I/O worker without waiting for it.
+        method - method name or bound method of this object
         Returns:
-            number of bytes sent
+            concurrent.futures.Future for the method's return value
         """
-        starttime = time.time()
+        func = getattr(self, method) if isinstance(method, str) else method
+        if getattr(func, 'interactive', False):
+            level = PRIORITY_INTERACTIVE
+        else:
+            level = self._currentPriority()
+        job = XAPJob(func=func, args=args, kwargs=kwargs)
+        if self._worker is None:
+            self._runJob(job)
+        else:
+            self._submitJob(job, level)
+        return job.future
+
+    def _currentPriority(self):
+        level = getattr(self._local, 'priority', None)
+        return PRIORITY_NORMAL if level is None else level
+
+    def _onWorker(self):
+        """True if commands can be run directly by the calling thread"""
+        return (self._worker is None or
+                threading.current_thread() is self._worker)
+
+    def _submitJob(self, job, level):
+        self._jobs.put((level, next(self._jobseq), job))
+        return job.future
+
+    def _runJob(self, job):
+        """Run a method call job and set its future"""
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.func(*job.args, **job.kwargs))
+        except Exception as e:
+            job.future.set_exception(e)
+
+    def _ioWorker(self):
+        """I/O worker thread: the only user of the serial port"""
         while 1:
-            if self._waiting_response==1:
-                if time.time() - starttime > self._maxrespdelay:
+            try:
+                level, seq, job = self._jobs.get(
+                    timeout=self.listenInterval if self.listening else None)
+            except queue.Empty:
+                self._pollEvents()
+                continue
+            if job.request is None and job.func is None:
+                break
+            if job.func is not None:
+                self._runJob(job)
+                continue
+            # pipeline this request with the other requests waiting
+            batch = [job]
+            # a wildcard query may get fewer lines than it expects, the next
+            # request's answer is what ends it, so do not end a batch on one
+            while len(batch) < self.pipelineWindow or batch[-1].request.expect > 1:
+                try:
+                    item = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if item[2].request is None:
+                    self._jobs.put(item)
                     break
-                _LOGGER.debug("Send going to sleep\n")
-                time.sleep(self._sleeptime)
+                batch.append(item[2])
+            claimed = [self._claimRequest(j.request) for j in batch]
+            try:
+                self._runPipeline(claimed, self.pipelineWindow)
+            except Exception as e:
+                self._failRequests(claimed, e)
+                for j in batch:
+                    j.future.set_exception(e)
             else:
-                break
+                for j in batch:
+                    j.future.set_result(j.request)
+
+    def _failRequests(self, requests, error):
+        """Complete requests a failed pipeline left unanswered with its
+        error, so coalesced followers and waiting queries see it too"""
+        for req in requests:
+            if req.done:
+                continue
+            if req in self._inflight:
+                self._inflight.remove(req)
+            req.complete(error=str(error))
 
-        currtime = time.time()
-        if currtime - self._lastcall > self._maxtime:
-            self.reset()
-        self._lastcall = currtime
-        _LOGGER.debug("Sending: %s", data)
-        if not testing:
-            self.serial.reset_input_buffer()
-            bytessent = self.serial.write(data.encode())
-            return bytessent
-        else:
-            self._waiting_response = 1
-            return len(data)
+    def send(self, data):
+        """Send the specified data string to the XAP800.
+        Waits for the commands in flight to be answered but does not hold
+        the line afterwards, read any answer with readResponse.
+        Returns:
+            number of bytes sent
+        """
+        if not self._gate.acquire(self._maxrespdelay):
+            _LOGGER.debug("No response to previous command by its deadline, sending anyway")
+        try:
+            currtime = time.time()
+            if currtime - self._lastcall > self._maxtime:
+                self.reset()
+            self._lastcall = currtime
+            _LOGGER.debug("Sending: %s", data)
+            if not testing:
+                self._resetInput()
+                bytessent = self.serial.write(data.encode())
+                return bytessent
+            else:
+                return len(data)
+        finally:
+            self._gate.release()
 
     def XAPCommand(self, command, *args, **kwargs):
+        return self._execute(command, args, kwargs).result()
+
+    def XAPValues(self, command, *args, **kwargs):
+        """Like XAPCommand, but returns the response values decoded by the
+        command's codec (see commandValues) as a tuple"""
+        return self._execute(command, args, kwargs).values()
+
+    def _execute(self, command, args, kwargs):
+        """Send a command and wait for its answer, returns the XAPRequest"""
         unitCode=kwargs.get('unitCode',0)
         rtnCount = kwargs.get('rtnCount',1)
-        args = [str(x) for x in args]
-        xapstr = "%s%s %s %s %s" % ( self.XAPCMD, unitCode, command, " ".join(args),  EOM)
-        _LOGGER.debug("Sending %s" % xapstr)
-        starttime = time.time()
-        while 1:
-            if self._waiting_response==1:
-                if time.time() - starttime > self._maxrespdelay:
-                    break
-                _LOGGER.debug("Send going to sleep\n")
-                time.sleep(self._sleeptime)
+        req = self._buildRequest(command, args, unitCode, rtnCount,
+                                 kwargs.get('prefix'))
+        if self._onWorker():
+            self._runPipeline([req], 1)
+        else:
+            waiter = self._coalesceRequest(req)
+            if waiter is None:
+                waiter = self._submitJob(XAPJob(request=req), self._currentPriority())
+            waiter.result()
+        return req
+
+    def queueCommand(self, command, *args, **kwargs):
+        """Queue a command to be sent by flushCommands.
+        Takes the same arguments as XAPCommand.
+        Returns:
+            XAPRequest that will hold the response once flushed
+        """
+        unitCode = kwargs.get('unitCode', 0)
+        rtnCount = kwargs.get('rtnCount', 1)
+        req = self._buildRequest(command, args, unitCode, rtnCount,
+                                 kwargs.get('prefix'))
+        self._queuedRequests().append(req)
+        return req
+
+    def flushCommands(self, window=None):
+        """Send all queued commands, keeping up to window commands in flight.
+        Responses are matched back to their request by unit, command and
+        address (channel, group...), so the link is kept busy instead of
+        waiting a full round trip per command.
+        Returns:
+            list of XAPRequest in the order they were queued
+        """
+        queued = self._queuedRequests()
+        self._local.queued = []
+        requests = self._coalesceQueued(queued) if self.coalesce else queued
+        if self._onWorker():
+            self._runPipeline(requests, window or self.pipelineWindow)
+        else:
+            level = self._currentPriority()
+            for future in [self._submitJob(XAPJob(request=req), level)
+                           for req in requests]:
+                future.result()
+        return queued
+
+    def _queuedRequests(self):
+        """Requests queued by the calling thread"""
+        if not hasattr(self._local, 'queued'):
+            self._local.queued = []
+        return self._local.queued
+
+    def _buildRequest(self, command, args, unitCode, rtnCount, prefix=None):
+        """Build the XAPRequest for a command, addressed with the prefix of
+        the unit's type if it is known (see units)"""
+        if prefix is None:
+            prefix = unitPrefixes.get(self.unitType(unitCode), self.XAPCMD)
+        return codecFor(command).request(prefix, unitCode, args, rtnCount)
+
+    def unitType(self, unitCode):
+        """Type of a unit as discovered (or given in units), XAPType if
+        it is not known"""
+        if self.units and unitCode in self.units:
+            return self.units[unitCode]
+        return self.XAPType
+
+    def _coalesceRequest(self, req):
+        """In coalesce mode, fold req into a setter for the same parameter
+        that is still waiting for the link.
+        The first setter keeps its place in the queue and whatever value is
+        latest when it reaches the link is written (see _claimRequest), so a
+        burst of fader moves costs one round trip. A query waits for the
+        pending setter and is answered with its response.
+        Returns:
+            Future that is done when req is answered, or None if req was not
+            folded and has to be sent (a new setter then holds the slot).
+        """
+        if not self.coalesce or not self._canCoalesce(req):
+            return None
+        with self._pendingLock:
+            slot = self._pendingWrites.get(req.key)
+            if slot is None:
+                if not req.query:
+                    self._pendingWrites[req.key] = [req, req]
+                return None
+            if req.query:
+                leader, follower = slot[1], req
             else:
-                break
+                leader, follower = req, slot[1]
+                slot[1] = req
+            leader.addDoneCallback(lambda r: follower.complete(r.response, r.error))
+            waiter = Future()
+            req.addDoneCallback(waiter.set_result)
+        return waiter
+
+    def _canCoalesce(self, req):
+        """True if req may be folded into or answered by another setter of
+        the same parameter: a known setter or query of one address, whose
+        value is not a toggle (2) or relative change (R)."""
+        if req.command not in addressArgs or "*" in req.key or \
+                req.command in uncachedCommands or req.command in invalidateOnlyCommands:
+            return False
+        return req.query or str(req.args[-1]).upper() not in ("2", "R")
+
+    def _coalesceQueued(self, queued):
+        """Coalesce the setters of a flushCommands batch like
+        _coalesceRequest: the first setter of a parameter keeps its place
+        and writes the latest value, later setters and queries of it are
+        answered with that response.
+        Returns:
+            the requests to send
+        """
+        requests = []
+        slots = {}  # key: index in requests of its latest setter
+        for req in queued:
+            index = slots.get(req.key) if self._canCoalesce(req) else None
+            if index is None:
+                if not req.query and self._canCoalesce(req):
+                    slots[req.key] = len(requests)
+                requests.append(req)
+                continue
+            if req.query:
+                leader, follower = requests[index], req
+            else:
+                leader, follower = req, requests[index]
+                requests[index] = req
+            leader.addDoneCallback(lambda r, f=follower: f.complete(r.response, r.error))
+        return requests
+
+    def _claimRequest(self, req):
+        """Return the request to write in place of req, the latest setter
+        coalesced into req's slot or req itself."""
+        if not self._pendingWrites:
+            return req
+        with self._pendingLock:
+            slot = self._pendingWrites.get(req.key)
+            if slot is None or slot[0] is not req:
+                return req
+            del self._pendingWrites[req.key]
+        return slot[1]
+
+    def _checkCache(self, req):
+        """Complete req from the cache if possible.
+        Returns True if it was, otherwise arranges for the response
+        to be cached and returns False.
+        """
+        items = self.cache.lookup(req)
+        if items is not None:
+            req.complete(items)
+            return True
+        req.addDoneCallback(self.cache.store)
+        return False
+
+    def _runPipeline(self, requests, window):
+        """Write requests keeping up to window in flight and read until all
+        of them are answered or timed out.
+        """
+        if not self._gate.acquire(self._maxrespdelay):
+            _LOGGER.debug("No response to previous command by its deadline, sending anyway")
+        try:
+            pending = deque(req for req in requests if not self._checkCache(req))
+            inflight = self._inflight
+            while pending or inflight:
+                while pending and len(inflight) < window:
+                    req = pending.popleft()
+                    self._writeRequest(req)
+                    inflight.append(req)
+                if not self._reader.lines and not self._reader.pump(self.serial):
+                    # nothing coming, oldest command will not be answered
+                    self._giveUp(inflight.popleft())
+                else:
+                    self._dispatchPending()
+                self._expireRequests()
+        finally:
+            self._gate.release()
+
+    def _expireRequests(self):
+        """Give up on in flight requests that are past their deadline"""
+        now = time.time()
+        for req in [r for r in self._inflight if r.deadline < now]:
+            _LOGGER.debug("No response for %s" % req)
+            self._inflight.remove(req)
+            self._giveUp(req)
+
+    def _giveUp(self, req):
+        """Complete a request that will get no more responses"""
+        req.complete(req.responses[-1] if req.responses else None)
+
+    def _writeRequest(self, req):
+        """Write a single request to the serial port"""
         currtime = time.time()
         if currtime - self._lastcall > self._maxtime:
             self.reset()
         self._lastcall = currtime
-        _LOGGER.debug("Sending: %s", xapstr)
+        _LOGGER.debug("Sending: %s", req.xapstr)
+        if not self._inflight:
+            if self.listening:
+                self._pollEvents()  # do not lose reports waiting on the port
+            else:
+                self._resetInput()
+        self.serial.write(req.xapstr.encode())
+        req.deadline = currtime + self._maxrespdelay
+        self._gate.extend(req.deadline)
+
+    def _resetInput(self):
+        """Drop everything received and not yet dispatched"""
         self.serial.reset_input_buffer()
-        self.serial.write(xapstr.encode())
-        self._waiting_response = 1
-        res = self.readResponse(numElements = rtnCount)
-        return res
+        self._reader.clear()
+
+    def _dispatchPending(self):
+        """Dispatch the lines the ResponseReader has framed"""
+        lines = self._reader.lines
+        while lines:
+            self._dispatchItems(*lines.popleft())
+
+    def _dispatchItems(self, items, error=None):
+        """Hand the items of a response line, or an ERROR line, to the in
+        flight request it answers; unmatched lines are events"""
+        _LOGGER.debug("Response %s %s", items, error)
+        inflight = self._inflight
+        if error is not None:
+            # errors do not echo the command, they belong to the oldest one
+            if inflight:
+                inflight.popleft().complete(error=error)
+            return
+        for req in inflight:
+            if req.matches(items):
+                # the unit answers in order, so multi line requests ahead
+                # of this one have had all the lines they are getting
+                for earlier in list(itertools.takewhile(lambda r: r is not req, inflight)):
+                    if earlier.responses:
+                        inflight.remove(earlier)
+                        self._giveUp(earlier)
+                if req.expect > 1:
+                    req.responses.append(items)
+                    if len(req.responses) < req.expect:
+                        return
+                inflight.remove(req)
+                req.complete(items)
+                return
+        if len(items) > 1 and len(items[0]) > 1:
+            self._handleEvent(items)
 
     def readResponse(self, numElements=1):
         """Get response from unit.
@@ -287,19 +1683,18 @@ class XAPX00(object):
         Returns:
             response string from unit
         """
+        reader = self._reader
         while 1:
-            resp = self.serial.readline().decode()
-            if len(resp) > 5 and resp[0:5] == "ERROR":
-                self._waiting_response = 0
-                raise Exception(resp)
-            _LOGGER.debug("Response %s" % resp)
-            if resp.find('#') > -1:
-                self._waiting_response = 0
-                break
-            if resp == '':
+            if not reader.lines and not reader.pump(self.serial):
                 # nothing coming, have read too many lines
                 return None
-        respitems = resp.split("#",maxsplit=1)[1].split()
+            if not reader.lines:
+                continue  # part of a line so far
+            respitems, error = reader.lines.popleft()
+            _LOGGER.debug("Response %s %s", respitems, error)
+            if error is not None:
+                raise Exception(error)
+            break
         if numElements == 1:
             return respitems[-1]
         else:
@@ -317,21 +1712,20 @@ class XAPX00(object):
     def reset(self):
         """Reset connection."""
         warnings.warn("Clearing Serial Connection")
-        self.serial.reset_input_buffer()
+        self._resetInput()
 
     def getUnitType(self, id):
-        """Get unit type based on responses"""
-        self.send("#5" + str(id) + " SERECHO 1 \r")
-        if self.readResponse() == "1":
+        """Get unit type based on responses, unless the connect probes
+        already found it"""
+        if self.units and id in self.units:
+            return self.units[id]
+        if self.XAPCommand("SERECHO", 1, unitCode=id, prefix="#5") == "1":
             return "XAP800"
-        self.send("#7" + str(id) + " SERECHO 1 \r")
-        if self.readResponse() == "1":
+        if self.XAPCommand("SERECHO", 1, unitCode=id, prefix="#7") == "1":
             return "XAP400"
-        self.send("#4" + str(id) + " SERECHO 1 \r")
-        if self.readResponse() == "1":
+        if self.XAPCommand("SERECHO", 1, unitCode=id, prefix="#4") == "1":
             return "PSR1212"
-        self.send("#6" + str(id) + " SERECHO 1 \r")
-        if self.readResponse() == "1":
+        if self.XAPCommand("SERECHO", 1, unitCode=id, prefix="#6") == "1":
             return "XAPTH2"
         return "No Device Found"
 
@@ -426,6 +1820,7 @@ class XAPX00(object):
         resp = db2linear(resp[0], maxdb)
         return resp
 
+    @interactive
     @stereo
     def setPropGain(self, channel, gain, isAbsolute=1, group="I", unitCode=0):
         """Set gain level for a channel relative to that channel's maxgain setting.
@@ -446,10 +1841,10 @@ class XAPX00(object):
         if group == 'E': #E is expansion, GAIN is set on source unit, so return max
             raise Exception('Gain not available on Expansion Bus')
         else:
-            resp = self.XAPCommand("GAIN", channel, group, unitCode = unitCode,
-                                   rtnCount=2)[0]
-        return db2linear(resp) if self.convertDb else resp
+            level = self.XAPValues("GAIN", channel, group, unitCode=unitCode)[0]
+        return db2linear(level) if self.convertDb else level
 
+    @interactive
     @stereo
     def setGain(self, channel, gain, isAbsolute=1, group="I", unitCode=0):
         """Sets the gain on the specified channel for the specified XAP800.
@@ -466,9 +1861,9 @@ class XAPX00(object):
         gain = linear2db(gain) if self.convertDb else gain
         if group in ('E'):  # can't set GAIN on expansion bus
             resp = 20.0 # or raise error?????
-        resp = self.XAPCommand("GAIN", channel, group, gain, "A" if isAbsolute == 1 else "R",
-                               unitCode=unitCode, rtnCount=2)[0]
-        return db2linear(resp) if self.convertDb else resp
+        level = self.XAPValues("GAIN", channel, group, gain, "A" if isAbsolute == 1 else "R",
+                               unitCode=unitCode)[0]
+        return db2linear(level) if self.convertDb else level
 
     @stereo
     def getLevel(self, channel, group="I", stage="I", unitCode=0):
@@ -479,9 +1874,7 @@ class XAPX00(object):
         group - the target channel type
         stage - See documentation
         """
-        self.send(XAP800_CMD + str(unitCode) + " LVL " + str(channel) + " " +
-                  group + " " + stage + " " + EOM)
-        return float(self.readResponse())
+        return self.XAPValues("LVL", channel, group, stage, unitCode=unitCode)[0]
 
     def getLabel(self, channel, group, inout=None, unitCode=0):
         """Retrieve the text label assigned to an inpout or ouput
@@ -504,6 +1897,7 @@ class XAPX00(object):
           resp = self.XAPCommand("LABEL", channel, group, label, unitCode=unitCode)
         return resp
 
+    @interactive
     @stereo
     def setMatrixRouting(self, inChannel, outChannel, state=1, inGroup="I",
                          outGroup="O", unitCode=0):
@@ -543,18 +1937,150 @@ class XAPX00(object):
         return resp
 
     def getMatrixRoutingReport(self, unitCode=0):
-        """Returns a matrix of levels as a list of lists"""
-        routingMatrix = []
-        for y in matrixGeo[self.XAPType]:
-            row = []
-            for x in matrixGeo[self.XAPType]:
-                if y['c'] == x['c'] and (y['ig'] == "E" or y['ig'] == "P"):
-                    row.append("X")
-                else:
-                    row.append(self.getMatrixRouting(y['c'], x['c'], inGroup=y['ig'], outGroup=x['og'], unitCode=unitCode))
-            routingMatrix.append(row)
-        return routingMatrix
-
+        """Returns a matrix of routing states as a list of lists"""
+        return self.getMatrixSnapshot(unitCode=unitCode, levels=False)[0]
+
+    def getMatrixSnapshot(self, unitCode=0, levels=True):
+        """Read the whole routing (and level) matrix of a unit in one pass.
+        Uses wildcard queries (MTRX <in> <group> * <group>) where the
+        firmware accepts them, and pipelined per crosspoint queries for
+        anything they did not answer.
+        Returns:
+            (routing, levels) as lists of lists in matrixGeo order, the
+            crosspoint of an expansion/processing channel with itself is "X".
+            Values are those getMatrixRouting/getMatrixLevel would return.
+            levels is None if not requested.
+        """
+        geo, cells = self._readMatrix(unitCode, levels)
+        routing = []
+        levelMatrix = [] if levels else None
+        for y in geo:
+            routingRow = []
+            levelRow = []
+            for x in geo:
+                if y['c'] == x['c'] and y['ig'] in ("E", "P"):
+                    routingRow.append("X")
+                    levelRow.append("X")
+                    continue
+                items = cells[("MTRX", str(y['c']), str(x['c']))]
+                routingRow.append(items[-1] if items else None)
+                if levels:
+                    items = cells[("MTRXLVL", str(y['c']), str(x['c']))]
+                    levelRow.append(None if items is None else items[-2])
+            routing.append(routingRow)
+            if levels:
+                levelMatrix.append(levelRow)
+        if levels and self.convertDb:
+            self._levelsToLinear(levelMatrix)
+        return routing, levelMatrix
+
+    def getMatrixReport(self, unitCode=0):
+        """Read the routing and level matrix of a unit in one sweep.
+        Returns:
+            (routing, levels) MatrixReports in matrixGeo order. routing holds
+            the MTRX states, levels the MTRXLVL levels (linear if convertDb).
+            Crosspoints that do not exist or were not answered are -1 in
+            routing and nan in levels.
+        """
+        geo, cells = self._readMatrix(unitCode, True)
+        channels = [y['c'] for y in geo]
+        routing = MatrixReport(channels, 'b', -1)
+        levels = MatrixReport(channels, 'd', float('nan'))
+        for i, y in enumerate(geo):
+            for j, x in enumerate(geo):
+                if y['c'] == x['c'] and y['ig'] in ("E", "P"):
+                    continue
+                items = cells[("MTRX", str(y['c']), str(x['c']))]
+                if items:
+                    routing.values[i * routing.size + j] = int(items[-1])
+                items = cells[("MTRXLVL", str(y['c']), str(x['c']))]
+                if items:
+                    levels.values[i * levels.size + j] = float(items[-2])
+        if self.convertDb:
+            levels.values = array('d', db2linearArray(levels.values))
+        return routing, levels
+
+    def _readMatrix(self, unitCode, levels):
+        """Collect the MTRX (and MTRXLVL) response of every crosspoint.
+        Uses wildcard queries where the firmware accepts them, and
+        pipelined per crosspoint queries for anything they did not answer.
+        Returns:
+            (matrixGeo list, dict of (command, inChannel, outChannel): items)
+        """
+        geo = matrixGeo[self.unitType(unitCode)]
+        commands = ("MTRX", "MTRXLVL") if levels else ("MTRX",)
+        cells = {}
+        if self.wildcardMatrix.get(unitCode, True):
+            cells = self._readMatrixWildcard(geo, commands, unitCode)
+        fallback = {}
+        for command in commands:
+            for y in geo:
+                for x in geo:
+                    key = (command, str(y['c']), str(x['c']))
+                    if key in cells or (y['c'] == x['c'] and y['ig'] in ("E", "P")):
+                        continue
+                    fallback[key] = self.queueCommand(command, y['c'], y['ig'], x['c'], x['og'],
+                                                      unitCode=unitCode)
+        if fallback:
+            _LOGGER.debug("Reading %d crosspoints one by one" % len(fallback))
+            self.flushCommands()
+            for key, req in fallback.items():
+                if req.error is not None:
+                    raise Exception(req.error)
+                cells[key] = req.response
+        return geo, cells
+
+    def _levelsToLinear(self, levelMatrix):
+        """Convert the dB levels of a level matrix in place in one pass,
+        leaving "X" and None cells alone."""
+        cells = [(row, x) for row in levelMatrix for x, level in enumerate(row)
+                 if level is not None and level != "X"]
+        converted = db2linearArray([row[x] for row, x in cells])
+        for (row, x), level in zip(cells, converted):
+            row[x] = float(level)
+
+    def _readMatrixWildcard(self, geo, commands, unitCode):
+        """Query whole matrix rows with wildcard output channels.
+        Returns:
+            dict of (command, inChannel, outChannel): response items
+            for every crosspoint answered
+        """
+        outGroups = []
+        for x in geo:
+            if x['og'] not in outGroups:
+                outGroups.append(x['og'])
+        size = dict((og, len([x for x in geo if x['og'] == og])) for og in outGroups)
+        # find out whether this firmware answers wildcards at all
+        probe = self.queueCommand(commands[0], geo[0]['c'], geo[0]['ig'], "*", outGroups[0],
+                                  unitCode=unitCode)
+        probe.expect = size[outGroups[0]]
+        # marks the end of the answer, so it has to reach the unit
+        self.queueCommand("UID", unitCode=unitCode).cacheable = False
+        self.flushCommands()
+        if probe.error is not None or not probe.responses:
+            _LOGGER.debug("Unit %s does not accept matrix wildcards" % unitCode)
+            self.wildcardMatrix[unitCode] = False
+            return {}
+        self.wildcardMatrix[unitCode] = True
+        requests = [probe]
+        for command in commands:
+            for y in geo:
+                for og in outGroups:
+                    if command == commands[0] and y is geo[0] and og == outGroups[0]:
+                        continue
+                    req = self.queueCommand(command, y['c'], y['ig'], "*", og,
+                                            unitCode=unitCode)
+                    req.expect = size[og]
+                    requests.append(req)
+        self.queueCommand("UID", unitCode=unitCode).cacheable = False
+        self.flushCommands()
+        cells = {}
+        for req in requests:
+            for items in req.responses:
+                cells[(items[1].upper(), items[2].upper(), items[4].upper())] = items
+        return cells
+
+    @interactive
     @stereo
     def setMatrixLevel(self, inChannel, outChannel, level=0,
                        isAbsolute=1, inGroup="I", outGroup="O", unitCode=0):
@@ -571,11 +2097,11 @@ class XAPX00(object):
         level:    0 - 1
         """
         level = linear2db(level) if self.convertDb else level
-        resp = self.XAPCommand("MTRXLVL", inChannel, inGroup,
+        level = self.XAPValues("MTRXLVL", inChannel, inGroup,
                    outChannel, outGroup, level, "A" if isAbsolute == 1
-                               else "R", unitCode=unitCode, rtnCount=2)[0]
+                               else "R", unitCode=unitCode)[0]
 
-        return db2linear(resp) if self.convertDb else resp
+        return db2linear(level) if self.convertDb else level
 
     @stereo
     def getMatrixLevel(self, inChannel, outChannel, inGroup="I",
@@ -590,21 +2116,16 @@ class XAPX00(object):
         inGroup - input group (I-inlts, M=mics, L=line, ...
         outGroup - otput group (O=all Outputs 1-12, P=processing A-H, ...
         """
-        resp = self.XAPCommand("MTRXLVL", inChannel, inGroup,
-                   outChannel, outGroup, unitCode=unitCode, rtnCount=2)[0]
+        level = self.XAPValues("MTRXLVL", inChannel, inGroup,
+                   outChannel, outGroup, unitCode=unitCode)[0]
 
-        return db2linear(resp) if self.convertDb else resp
+        return db2linear(level) if self.convertDb else level
 
     def getMatrixLevelReport(self, unitCode=0):
-        """Returns a matrix of levels as a list of lists"""
-        levelMatrix = []
-        for x in range(0, matrixGeo[self.XAPType]):
-            levelMatrix.append([])
-            for y in range(0, matrixGeo[self.XAPType]):
-                levelMatrix[x].append(self.getMatrixLevel(
-                    x + 1, y + 1, unitCode=unitCode, stereo=0))
-        return levelMatrix
+        """Returns the level matrix as a MatrixReport, see getMatrixReport"""
+        return self.getMatrixReport(unitCode=unitCode)[1]
 
+    @interactive
     @stereo
     def setMute(self, channel, isMuted=1, group="I", unitCode=0):
         """Mutes the target channel on the specified XAP800.
@@ -705,14 +2226,14 @@ class XAPX00(object):
         unitCode - the unit code of the target XAP800
         baudRate - the baud rate (9600, 19200, or 38400)
         """
-        if self.XAPType == XAP400Type:
+        if self.unitType(unitCode) == XAP400Type:
             baudRateCode = {9600: 1, 19200: 2, 38400: 3, " ": " ", "":" "}
             rateBaudCode = {v: k for k, v in baudRateCode.items()}
             baud = baudRateCode.get(baudRate,3)
         else:
             baud = baudRate
         res = self.XAPCommand("BAUD", baud, unitCode=unitCode)
-        if self.XAPType == XAP400Type:
+        if self.unitType(unitCode) == XAP400Type:
             res = rateBaudCode.get(res, 0)
         return res
 
@@ -1334,11 +2855,13 @@ class XAPX00(object):
         attack    - 0.10-10.00s in .1 intervals
         gain      - 0.00-18.00dB
         """
-        resp = self.XAPCommand('AGCSET', channel, group, unitCode=unitCode, rtnCount=4)
-        return {"threshold": db2linear(resp[0]) if self.convertDb else float(resp[0]),
-                "target": db2linear(resp[1]) if self.convertDb else float(resp[1]),
-                "attack": float(resp[2]),
-                "gain": db2linear(resp[3]) if self.convertDb else float(resp[3]),
+        threshold, target, attack, gain = self.XAPValues('AGCSET', channel, group, unitCode=unitCode)
+        if self.convertDb:
+            threshold, target, gain = db2linearArray((threshold, target, gain))
+        return {"threshold": float(threshold),
+                "target": float(target),
+                "attack": attack,
+                "gain": float(gain),
                 }
 
     def setAutoGainControlLevel(self, channel, group, threshold, target, attack, gain, unitCode=0):
@@ -1354,11 +2877,12 @@ class XAPX00(object):
         threshold = linear2db(threshold) if self.convertDb else threshold
         target = linear2db(target) if self.convertDb else target
         gain = linear2db(gain) if self.convertDb else gain
-        resp = self.XAPCommand('AGCSET', channel, group, threshold, target, attack, gain, unitCode=unitCode, rtnCount=4)
-        return {"threshold": db2linear(resp[0]) if self.convertDb else float(resp[0]),
-                "target": db2linear(resp[1]) if self.convertDb else float(resp[1]),
-                "attack": float(resp[2]),
-                "gain": db2linear(resp[3]) if self.convertDb else float(resp[3]),
+        threshold, target, attack, gain = self.XAPValues('AGCSET', channel, group, threshold, target, attack, gain,
+                                                         unitCode=unitCode)
+        return {"threshold": db2linear(threshold) if self.convertDb else threshold,
+                "target": db2linear(target) if self.convertDb else target,
+                "attack": attack,
+                "gain": db2linear(gain) if self.convertDb else gain,
                 }
 
     def setFilter(self, channel, group, node, type, frequency, gain, bandwidth, unitCode=0):
@@ -1400,25 +2924,19 @@ class XAPX00(object):
                     .05 to 5.00 (Type 6, 11)
                     2 = Low Pass, 3 = High Pass (Type 8-10)
         """
-        resp = self.XAPCommand('FILTER', channel, group, node, unitCode=unitCode, rtnCount=9)
+        values = self.XAPValues('FILTER', channel, group, node, unitCode=unitCode)
         type = None
         freq = None
         gain = None
         bandwidth = None
-        if int(resp[5]) is not 0:
-            type = int(resp[5])
-            freq = float(resp[6])
-            if type is 4 or type is 5:
-                gain = float(resp[7])
-            elif type is 6:
-                gain = float(resp[7])
-                bandwidth = float(resp[8])
-            elif type is 8 or type is 9 or type is 10:
-                gain = int(resp[7])
-                bandwidth = int(resp[8])
-            elif type is 11:
-                gain = float(resp[7])
-                bandwidth = float(resp[8])
+        if values[0] != 0:
+            type, freq = values[0], values[1]
+            if type == 4 or type == 5:
+                gain = values[2]
+            elif type == 6 or type == 11:
+                gain, bandwidth = values[2], values[3]
+            elif type == 8 or type == 9 or type == 10:
+                gain, bandwidth = int(values[2]), int(values[3])
         return {"type": type,
                 "frequency": freq,
                 "gain": gain,
@@ -1439,3 +2957,475 @@ class XAPX00(object):
         """Translates ERROR replies from the XAP800 into a human-readable description of the problem."""
         return errorDefs.get(errorMsg, "Unknown Error")
 
+
+class _AsyncBridge(XAPX00):
+    """XAPX00 whose commands are carried out on an AsyncXAPX00 event loop.
+    Methods of the bridge run in executor threads, so they may block
+    waiting for the loop without stalling it.
+    """
+
+    def __init__(self, client, **kwargs):
+        XAPX00.__init__(self, **kwargs)
+        self._client = client
+
+    def _execute(self, command, args, kwargs):
+        future = asyncio.run_coroutine_threadsafe(
+            self._client._execute(command, args, kwargs),
+            self._client._loop)
+        return future.result()
+
+    def flushCommands(self, window=None):
+        """Send the calling thread's queued commands through the client's
+        loop, pipelined up to its window"""
+        queued = self._queuedRequests()
+        self._local.queued = []
+        asyncio.run_coroutine_threadsafe(self._client._submitAll(queued),
+                                         self._client._loop).result()
+        return queued
+
+
+class AsyncXAPX00(object):
+    """asyncio client for XAPX00 units.
+    Has the same get/set methods as XAPX00, as coroutines:
+        xap = AsyncXAPX00("/dev/ttyUSB0")
+        await xap.connect()
+        gains = await asyncio.gather(*[xap.getGain(c) for c in range(1, 9)])
+    The serial port is read by a reader task that hands each response to
+    the future of the command it answers, so concurrent calls are pipelined
+    (up to pipelineWindow in flight) and the loop is never blocked.
+    XAPCommand and XAPValues are native coroutines. The get/set methods are
+    executor backed: each runs the XAPX00 method in one of maxWorkers
+    threads, which blocks until the loop has written its commands and
+    the reader task has their answers.
+    Public attributes (convertDb, stereo, ...) are those of the XAPX00
+    doing the parsing.
+    """
+
+    def __init__(self, comPort="/dev/ttyUSB0", baudRate=38400,
+                 stereo=0, XAPType=XAP800Type, maxWorkers=16, coalesce=0, units=None,
+                 transport=None):
+        self._bridge = _AsyncBridge(self, comPort=comPort, baudRate=baudRate,
+                                    stereo=stereo, XAPType=XAPType, coalesce=coalesce,
+                                    units=units, transport=transport)
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self._loop = None
+        self._serial = None
+        self._reader = None
+        self._readable = None
+        self._window = None
+
+    def __repr__(self):
+        return "AsyncXAPX00: " + self._bridge.comPort
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._bridge, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self._loop.run_in_executor(
+                self._executor, partial(attr, *args, **kwargs))
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._bridge, name, value)
+
+    async def connect(self):
+        """Open the port without blocking and start the reader task.
+        The transport must have a file descriptor (not LoopbackTransport)."""
+        bridge = self._bridge
+        _LOGGER.info("Connecting to XAPX00 at " + str(bridge.baudRate) +
+                     " baud (asyncio)...")
+        self._loop = asyncio.get_running_loop()
+        self._serial = openTransport(bridge.transport or bridge.comPort, bridge.baudRate, timeout=0)
+        self._window = asyncio.Semaphore(bridge.pipelineWindow)
+        self._readable = asyncio.Event()
+        self._loop.add_reader(self._serial.fileno(), self._readable.set)
+        self._reader = self._loop.create_task(self._readResponses())
+        self._serial.reset_input_buffer()
+        if not bridge.knownUnits:
+            bridge.units = await self._discoverUnits(bridge.discoveryWindow)
+            _LOGGER.info("Found units %s", bridge.units)
+        bridge.connected = 1
+
+    async def _discoverUnits(self, window):
+        """Write the SERECHO probes of XAPX00.discoverUnits and collect the
+        answers the reader task reports as events within window seconds"""
+        units = {}
+
+        def answered(event):
+            if event['command'] == "SERECHO" and event['prefix'] in probePrefixes:
+                units[event['unitCode']] = probePrefixes[event['prefix']]
+        probes = "".join("%s%d SERECHO 1 %s" % (prefix, id, EOM)
+                         for id in range(0, 8) for prefix in probePrefixes)
+        self._bridge.addEventListener(answered)
+        try:
+            self._serial.write(probes.encode())
+            await asyncio.sleep(window + len(probes) * 10.0 / self._bridge.baudRate)
+        finally:
+            self._bridge.removeEventListener(answered)
+        return units
+
+    async def disconnect(self):
+        """Stop the reader task and close the serial port"""
+        self._loop.remove_reader(self._serial.fileno())
+        self._reader.cancel()
+        self._serial.close()
+        self._executor.shutdown(wait=False)
+        self._bridge.connected = 0
+
+    async def XAPCommand(self, command, *args, **kwargs):
+        """Send a command and await its response, see XAPX00.XAPCommand"""
+        return (await self._execute(command, args, kwargs)).result()
+
+    async def XAPValues(self, command, *args, **kwargs):
+        """Send a command and await its decoded values, see XAPX00.XAPValues"""
+        return (await self._execute(command, args, kwargs)).values()
+
+    async def _execute(self, command, args, kwargs):
+        req = self._bridge._buildRequest(command, args,
+                                         kwargs.get('unitCode', 0),
+                                         kwargs.get('rtnCount', 1),
+                                         kwargs.get('prefix'))
+        await self._submit(req)
+        return req
+
+    async def _submitAll(self, requests):
+        """Submit requests in order and wait for all of them"""
+        await asyncio.gather(*[self._submit(req) for req in requests])
+
+    async def _submit(self, req):
+        """Write a request and wait until the reader task completes it"""
+        if self._bridge._checkCache(req):
+            return req
+        waiter = self._bridge._coalesceRequest(req)
+        if waiter is not None:
+            await asyncio.wrap_future(waiter)
+            return req
+        async with self._window:
+            req = self._bridge._claimRequest(req)
+            future = self._loop.create_future()
+            req.addDoneCallback(lambda r: future.done() or future.set_result(r))
+            inflight = self._bridge._inflight
+            inflight.append(req)
+            _LOGGER.debug("Sending: %s", req.xapstr)
+            self._serial.write(req.xapstr.encode())
+            try:
+                await asyncio.wait_for(future, self._bridge._maxrespdelay)
+            except asyncio.TimeoutError:
+                if req in inflight:
+                    inflight.remove(req)
+                req.complete()
+        return req
+
+    async def _readResponses(self):
+        """Reader task: split incoming bytes into lines and dispatch them"""
+        while 1:
+            await self._readable.wait()
+            self._readable.clear()
+            if self._bridge._reader.pump(self._serial, wait=False):
+                self._bridge._dispatchPending()
+
+
+class RoundRobinPolicy(object):
+    """LevelMeter schedule reading every subscription in turn.
+    A policy picks the subscriptions to read next (schedule), is told each
+    reading (update, level None if the read failed) and, if contextInterval is set, the mute and gate
+    state of each subscription every contextInterval seconds (setContext).
+    """
+    contextInterval = None
+
+    def __init__(self):
+        self._next = 0
+
+    def schedule(self, subscriptions, count, now):
+        if not subscriptions:
+            return []
+        count = min(count, len(subscriptions))
+        self._next %= len(subscriptions)
+        batch = [subscriptions[(self._next + i) % len(subscriptions)] for i in range(count)]
+        self._next = (self._next + count) % len(subscriptions)
+        return batch
+
+    def update(self, sub, level, now):
+        pass
+
+    def setContext(self, sub, muted=None, gated=None):
+        pass
+
+
+class AdaptivePolicy(object):
+    """LevelMeter schedule that reads active channels more often.
+    Each subscription has its own read interval: a level change of at least
+    changeDb or a gated open mic drops it to minInterval, a steady channel
+    relaxes towards normalInterval and a silent (below silenceDb) or muted
+    channel backs off exponentially up to maxInterval. Due subscriptions are
+    read most overdue first. state holds the interval, due time, last level
+    and mute/gate flags of every subscription for inspection.
+    """
+    contextInterval = 1.0
+
+    def __init__(self, minInterval=0.05, normalInterval=0.5, maxInterval=5.0,
+                 changeDb=3.0, silenceDb=-60.0):
+        self.minInterval = minInterval
+        self.normalInterval = normalInterval
+        self.maxInterval = maxInterval
+        self.changeDb = changeDb
+        self.silenceDb = silenceDb
+        self.state = {}
+
+    def _state(self, sub):
+        if sub not in self.state:
+            self.state[sub] = {"interval": self.minInterval, "due": 0, "level": None,
+                               "muted": False, "gated": False}
+        return self.state[sub]
+
+    def schedule(self, subscriptions, count, now):
+        due = [sub for sub in subscriptions if self._state(sub)["due"] <= now]
+        due.sort(key=lambda sub: self.state[sub]["due"])
+        return due[:count]
+
+    def update(self, sub, level, now):
+        state = self._state(sub)
+        if level is None:  # read failed, try again later
+            state["interval"] = min(state["interval"] * 2, self.maxInterval)
+            state["due"] = now + state["interval"]
+            return
+        changed = state["level"] is None or abs(level - state["level"]) >= self.changeDb
+        if changed or state["gated"]:
+            interval = self.minInterval
+        elif state["muted"] or level <= self.silenceDb:
+            interval = min(state["interval"] * 2, self.maxInterval)
+        else:
+            interval = min(state["interval"] * 1.5, self.normalInterval)
+        state["interval"] = interval
+        state["level"] = level
+        state["due"] = now + interval
+
+    def setContext(self, sub, muted=None, gated=None):
+        state = self._state(sub)
+        if muted is not None:
+            state["muted"] = bool(muted)
+        if gated is not None:
+            state["gated"] = bool(gated)
+            if gated:
+                state["due"] = min(state["due"], time.time() + self.minInterval)
+
+
+class MeterStream(object):
+    """Iterator of LevelMeter readings, see LevelMeter.stream.
+    Readings are collected from when the stream is created; iteration ends
+    if none arrives within timeout. close (or leaving a with block) stops
+    collecting.
+    """
+
+    def __init__(self, meter, timeout=None):
+        self.meter = meter
+        self.timeout = timeout
+        self.readings = queue.Queue(meter.backlog)
+        meter._streams.append(self.readings)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.readings not in self.meter._streams:
+            raise StopIteration
+        try:
+            return self.readings.get(timeout=self.timeout)
+        except queue.Empty:
+            self.close()
+            raise StopIteration
+
+    def close(self):
+        if self.readings in self.meter._streams:
+            self.meter._streams.remove(self.readings)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LevelMeter(object):
+    """Streams LVL readings for a set of subscribed channels.
+        meter = LevelMeter(xap)
+        meter.subscribe(1, group="M", stage="I", unitCode=0)
+        meter.start()
+        with meter.stream() as readings:
+            for reading in readings:
+                print(reading['channel'], reading['level'])
+    Readings are dicts with time, unitCode, channel, group, stage and level
+    (dB). Reads are pipelined at PRIORITY_BULK and paced to use at most
+    budget (0-1) of the link's bandwidth, so control traffic is not held up;
+    with more subscriptions each one is simply refreshed less often.
+    Which subscriptions are read when is up to the policy, RoundRobinPolicy
+    by default, see AdaptivePolicy.
+    """
+
+    def __init__(self, xap, budget=0.5, backlog=256, policy=None):
+        self.xap = xap
+        self.budget = budget
+        self.backlog = backlog  # readings kept per stream before dropping the oldest
+        self.policy = policy or RoundRobinPolicy()
+        self.subscriptions = []
+        self.listeners = []
+        self.sent = 0  # bytes written and read for meter reads
+        self.reads = {}  # subscription: number of readings
+        self._streams = []
+        self._contextTime = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel, group="I", stage="I", unitCode=0):
+        with self._lock:
+            sub = (unitCode, str(channel), group, stage)
+            if sub not in self.subscriptions:
+                self.subscriptions.append(sub)
+
+    def unsubscribe(self, channel, group="I", stage="I", unitCode=0):
+        with self._lock:
+            sub = (unitCode, str(channel), group, stage)
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+
+    def addListener(self, callback):
+        """Call callback(reading) for every reading, from the meter thread"""
+        self.listeners.append(callback)
+
+    def removeListener(self, callback):
+        self.listeners.remove(callback)
+
+    def stream(self, timeout=None):
+        """MeterStream of the readings from now on, ends if none arrives
+        within timeout"""
+        return MeterStream(self, timeout)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="XAPX00 meter " + self.xap.comPort)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._thread = None
+
+    @property
+    def bytesPerSecond(self):
+        """Link bandwidth the meter may use, 10 bits per byte on the wire"""
+        return self.xap.baudRate / 10.0 * self.budget
+
+    def poll(self):
+        """Read the next batch of subscriptions and publish the readings.
+        Returns:
+            number of bytes the batch used on the link
+        """
+        now = time.time()
+        used = 0
+        interval = self.policy.contextInterval
+        if interval is not None and now - self._contextTime >= interval:
+            self._contextTime = now
+            used += self._readContext()
+        with self._lock:
+            batch = self.policy.schedule(list(self.subscriptions), self.xap.pipelineWindow, now)
+        if not batch:
+            self.sent += used
+            return used
+        with self.xap.priority(PRIORITY_BULK):
+            for unitCode, channel, group, stage in batch:
+                self.xap.queueCommand("LVL", channel, group, stage, unitCode=unitCode)
+            requests = self.xap.flushCommands()
+        now = time.time()
+        for sub, req in zip(batch, requests):
+            used += self._linkBytes(req)
+            try:
+                level = float(req.result())
+            except Exception:
+                self.policy.update(sub, None, now)  # no reading
+                continue
+            self.reads[sub] = self.reads.get(sub, 0) + 1
+            self.policy.update(sub, level, now)
+            self._publish({"time": now, "unitCode": sub[0], "channel": sub[1],
+                           "group": sub[2], "stage": sub[3], "level": level})
+        self.sent += used
+        return used
+
+    def _linkBytes(self, req):
+        """Bytes a request and its response took on the link"""
+        used = len(req.xapstr)
+        if req.response is not None:
+            used += len(" ".join(req.response)) + 2
+        return used
+
+    def _readContext(self):
+        """Tell the policy the gate and mute state of the subscriptions"""
+        with self._lock:
+            subs = list(self.subscriptions)
+        units = sorted(set(sub[0] for sub in subs))
+        with self.xap.priority(PRIORITY_BULK):
+            for unitCode in units:
+                self.xap.queueCommand("GATE", unitCode=unitCode)
+            for unitCode, channel, group, stage in subs:
+                self.xap.queueCommand("MUTE", channel, group, unitCode=unitCode)
+            requests = self.xap.flushCommands()
+        gates = {}
+        for unitCode, req in zip(units, requests):
+            try:
+                gates[unitCode] = int(req.result())
+            except Exception:
+                pass
+        for sub, req in zip(subs, requests[len(units):]):
+            try:
+                muted = int(req.result())
+            except Exception:
+                muted = None
+            gated = None
+            if sub[0] in gates and sub[1].isdigit() and sub[2] in ("M", "I"):
+                gated = gates[sub[0]] & (1 << (int(sub[1]) - 1))
+            self.policy.setContext(sub, muted=muted, gated=gated)
+        return sum(self._linkBytes(req) for req in requests)
+
+    def _publish(self, reading):
+        for callback in list(self.listeners):
+            try:
+                callback(reading)
+            except Exception:
+                _LOGGER.exception("Meter listener failed for %s" % reading)
+        for readings in list(self._streams):
+            try:
+                readings.put_nowait(reading)
+            except queue.Full:  # slow consumer, keep the newest readings
+                try:
+                    readings.get_nowait()
+                except queue.Empty:
+                    pass
+                readings.put_nowait(reading)
+
+    def _run(self):
+        """Meter thread: poll batches, pacing them to the bandwidth budget"""
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                used = self.poll()
+            except Exception:
+                _LOGGER.exception("Meter poll failed")
+                used = 0
+            if not used:
+                self._stop.wait(0.02)  # nothing due yet
+                continue
+            self._stop.wait(max(0, used / self.bytesPerSecond - (time.time() - started)))
@@ -0,0 +1,70 @@
+import asyncio
+import time
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class AsyncReportTest(unittest.TestCase):
+    """AsyncXAPX00 against a simulated stack on a pty"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"}, baudRate=None, latency=0)
+        self.port = self.sim.startPty()
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def run_client(self, body, **kwargs):
+        async def main():
+            xap = XAPX00.AsyncXAPX00(self.port, **kwargs)
+            await xap.connect()
+            try:
+                return await body(xap)
+            finally:
+                await xap.disconnect()
+        return asyncio.run(main())
+
+    def test_matrix_reports(self):
+        self.sim.units[0].values[("MTRX", "1", "I", "3", "O")] = ["1"]
+
+        async def body(xap):
+            routing = await xap.getMatrixRoutingReport()
+            self.assertLess(self.sim.commands, 200)  # whole rows, not cell by cell
+            report = await xap.getMatrixReport()
+            levels = await xap.getMatrixLevelReport()
+            return routing, report, levels
+        routing, report, levels = self.run_client(body, units={0: "XAP800"})
+        self.assertEqual(routing[0][2], "1")
+        self.assertEqual(report[0][1, 3], 1)
+        self.assertEqual(report[0].size, len(routing))
+        self.assertEqual(levels.size, len(routing))
+
+    def test_connect_discovers_units(self):
+        self.sim.units[2] = xapsim.XAPUnitSim(2, "XAP400")
+
+        async def body(xap):
+            return xap.units, await xap.getUnitType(2)
+        units, unitType = self.run_client(body)
+        self.assertEqual(units, {0: "XAP800", 2: "XAP400"})
+        self.assertEqual(unitType, "XAP400")
+
+    def test_concurrent_calls_are_pipelined(self):
+        self.sim.latency = 0.05
+        for channel in range(1, 9):
+            self.sim.units[0].values[("MUTE", str(channel), "I")] = [str(channel % 2)]
+
+        async def body(xap):
+            start = time.time()
+            direct = await asyncio.gather(*[xap.XAPCommand("MUTE", c, "I") for c in range(1, 9)])
+            coroutines = time.time() - start
+            start = time.time()
+            bridged = await asyncio.gather(*[xap.getMute(c) for c in range(1, 9)])
+            return direct, coroutines, bridged, time.time() - start
+        direct, coroutines, bridged, executor = self.run_client(body, units={0: "XAP800"})
+        self.assertEqual(direct, [str(c % 2) for c in range(1, 9)])
+        self.assertEqual(bridged, [c % 2 for c in range(1, 9)])
+        # one after the other would take 8 x latency
+        self.assertLess(coroutines, 0.2)
+        self.assertLess(executor, 0.2)
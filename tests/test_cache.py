@@ -0,0 +1,73 @@
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class CacheTest(unittest.TestCase):
+    """XAPX00 with a response cache over an in-memory link"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.sent = []
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(self.handler),
+                                 units={0: "XAP800"}, cacheTTL=60)
+        self.xap.connect()
+        self.addCleanup(self.xap.disconnect)
+
+    def handler(self, line):
+        self.sent.append(line.split()[1])
+        return self.sim.handleLine(line)
+
+    def test_queries_are_cached(self):
+        self.assertEqual(self.xap.getMute(1), 0)
+        self.assertEqual(self.xap.getMute(1), 0)
+        self.assertEqual(self.sent, ["MUTE"])
+        self.assertEqual(self.xap.cache.hits, 1)
+
+    def test_setters_write_through(self):
+        self.xap.convertDb = 0
+        self.xap.setMute(1, 1)
+        self.assertEqual(self.xap.getMute(1), 1)
+        self.xap.setGain(1, -3.0, group="M")
+        self.xap.setGain(1, 1.0, isAbsolute=0, group="M")  # relative, the result is not known
+        self.assertEqual(self.xap.getGain(1, group="M"), -2.0)
+        self.assertEqual(self.sent, ["MUTE", "GAIN", "GAIN", "GAIN"])
+
+    def test_expansion_bus_label_directions(self):
+        self.xap.setLabel("O", "E", "BUS-OUT", inout=0)
+        self.assertEqual(self.xap.getLabel("O", "E", inout=1), "LABEL")
+        self.assertEqual(self.xap.getLabel("O", "E", inout=0), "BUS-OUT")
+        self.assertEqual(self.xap.getLabel("O", "E", inout=1), "LABEL")
+        self.assertEqual(self.sent, ["LABEL", "LABEL"])
+        self.xap._reader.feed(b"#50 LABEL O E 1 BUS-IN\r\n")
+        self.xap._dispatchPending()
+        self.assertEqual(self.xap.getLabel("O", "E", inout=1), "BUS-IN")
+        self.assertEqual(self.xap.getLabel("O", "E", inout=0), "BUS-OUT")
+        self.assertEqual(self.sent, ["LABEL", "LABEL"])
+
+    def test_preset_invalidates(self):
+        self.xap.getMute(1)
+        self.xap.setPreset(1)
+        self.xap.getMute(1)
+        self.assertEqual(self.sent, ["MUTE", "PRESET", "MUTE"])
+
+    def test_reports_update_the_cache(self):
+        self.xap.getMute(1)
+        self.sim.units[0].values[("MUTE", "1", "I")] = ["1"]
+        self.xap._reader.feed(b"#50 MUTE 1 I 1\r\n")
+        self.xap._dispatchPending()
+        self.assertEqual(self.xap.getMute(1), 1)
+        self.assertEqual(self.sent, ["MUTE"])
+
+    def test_wildcard_rows_fill_crosspoints(self):
+        self.sim.units[0].values[("MTRX", "1", "I", "3", "O")] = ["1"]
+        self.xap.getMatrixRoutingReport()
+        rows = self.sent.count("MTRX")
+        self.assertEqual(self.xap.getMatrixRouting(1, 3), "1")
+        self.assertEqual(self.sent.count("MTRX"), rows)
+
+    def test_wildcard_end_marker_is_sent(self):
+        self.xap.getUniqueId(0)
+        self.xap.getMatrixRoutingReport()
+        self.assertEqual(self.sent.count("UID"), 3)
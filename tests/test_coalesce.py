@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class BrokenLink(XAPX00.LoopbackTransport):
+    """Loopback whose writes fail"""
+
+    def _send(self, data):
+        raise IOError("link down")
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def open(self, transport, threaded=1):
+        xap = XAPX00.XAPX00(transport=transport, threaded=threaded, coalesce=1,
+                            units={0: "XAP800"})
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        return xap
+
+    def run_threads(self, xap, calls):
+        """Run each call in its own thread while the worker is busy"""
+        results = [None] * len(calls)
+        release = threading.Event()
+        xap.submit(release.wait)  # hold the worker so the calls queue up
+
+        def run(i, call):
+            try:
+                results[i] = call()
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=run, args=(i, call), daemon=True)
+                   for i, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertFalse([t for t in threads if t.is_alive()])
+        return results
+
+    def test_setters_coalesce(self):
+        sim = xapsim.XAPSimulator({0: "XAP800"})
+        sent = []
+
+        def handler(line):
+            sent.append(line)
+            return sim.handleLine(line)
+        xap = self.open(XAPX00.LoopbackTransport(handler))
+        xap.convertDb = 0
+        results = self.run_threads(xap, [lambda g=g: xap.setGain(1, g) for g in range(-5, 0)])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(xap.getGain(1), -1.0)
+        self.assertLess(len([line for line in sent if "GAIN" in line]), 5)
+
+    def simulated(self, threaded=1):
+        """Open a coalescing link to a simulated unit, returns (xap, sim, sent)"""
+        sim = xapsim.XAPSimulator({0: "XAP800"})
+        sent = []
+
+        def handler(line):
+            sent.append(line.split()[1])
+            return sim.handleLine(line)
+        return self.open(XAPX00.LoopbackTransport(handler), threaded), sim, sent
+
+    def test_expansion_bus_label_directions_are_kept_apart(self):
+        xap, sim, sent = self.simulated()
+        self.run_threads(xap, [lambda: xap.setLabel("O", "E", "BUS-OUT", inout=0),
+                               lambda: xap.setLabel("O", "E", "BUS-IN", inout=1)])
+        self.assertEqual(sent.count("LABEL"), 2)
+        self.assertEqual(sim.units[0].values[("LABEL", "O", "E", "0")], ["BUS-OUT"])
+        self.assertEqual(sim.units[0].values[("LABEL", "O", "E", "1")], ["BUS-IN"])
+
+    def test_toggles_and_relative_changes_are_all_sent(self):
+        xap, sim, sent = self.simulated()
+        xap.convertDb = 0
+        self.run_threads(xap, [xap.toggleFrontPanelLock, xap.toggleFrontPanelLock,
+                               lambda: xap.setMute(1, 2), lambda: xap.setMute(1, 2),
+                               lambda: xap.setGain(1, 1.0, isAbsolute=0),
+                               lambda: xap.setGain(1, 1.0, isAbsolute=0)])
+        self.assertEqual([sent.count(c) for c in ("LFP", "MUTE", "GAIN")], [2, 2, 2])
+        self.assertEqual(xap.getFrontPanelLock(0), 0)
+        self.assertEqual(xap.getMute(1), 0)
+        self.assertEqual(xap.getGain(1), 2.0)
+
+    def test_flushed_setters_coalesce_without_worker(self):
+        xap, sim, sent = self.simulated(threaded=0)
+        setters = [xap.queueCommand("MUTE", 1, "I", state) for state in (1, 0, 1)]
+        query = xap.queueCommand("MUTE", 1, "I")
+        toggles = [xap.queueCommand("MUTE", 2, "I", 2) for _ in range(2)]
+        xap.flushCommands()
+        self.assertEqual(sent, ["MUTE", "MUTE", "MUTE"])
+        self.assertEqual([req.result() for req in setters + [query]], ["1"] * 4)
+        self.assertEqual([req.result() for req in toggles], ["1", "0"])
+        self.assertEqual(sim.units[0].values[("MUTE", "1", "I")], ["1"])
+
+    def test_failed_link_reaches_every_waiter(self):
+        xap = self.open(BrokenLink(None))
+        calls = [lambda g=g: xap.setGain(1, g) for g in range(5)]
+        calls.append(lambda: xap.getGain(1))
+        results = self.run_threads(xap, calls)
+        for result in results:
+            self.assertIsInstance(result, Exception)
+        self.assertEqual(xap._pendingWrites, {})
+        self.assertEqual(len(xap._inflight), 0)
@@ -0,0 +1,69 @@
+import unittest
+
+import XAPX00
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_request_encoding(self):
+        req = XAPX00.codecFor("GAIN").request("#5", 1, (2, "I", -3.5, "A"))
+        self.assertEqual(req.xapstr, "#51 GAIN 2 I -3.50 A \r")
+        self.assertEqual(req.key, ("51", "GAIN", "2", "I"))
+        self.assertFalse(req.query)
+        query = XAPX00.codecFor("GAIN").request("#7", 0, ("a", "o"))
+        self.assertEqual(query.key, ("70", "GAIN", "A", "O"))
+        self.assertTrue(query.query)
+
+    def test_decode(self):
+        codec = XAPX00.codecFor("FILTER")
+        self.assertEqual(codec.decode(["50", "FILTER", "1", "I", "2", "3", "1000", "-2.5", "1"]),
+                         (3, 1000.0, -2.5, 1.0))
+        # short answers take the general path
+        self.assertEqual(codec.decode(["50", "FILTER", "1", "I", "2", "3"]), (3,))
+        self.assertEqual(XAPX00.codecFor("GAIN").decode(["50", "GAIN", "1", "I", "-3.00", "A"]),
+                         (-3.0, "A"))
+
+    def test_unrolled_lengths_agree(self):
+        decoders = (int, float, str, float)
+        for count in range(1, 5):
+            decode = XAPX00._compileDecoder(decoders[:count], 2)
+            items = ["50", "X", "1", "2.5", "s", "4"]
+            self.assertEqual(decode(items[:2 + count]), tuple(d(v) for d, v in zip(decoders, items[2:2 + count])))
+            self.assertEqual(decode(items[:2 + count] + ["extra"])[-1], "extra")
+
+    def test_each_arity(self):
+        self.assertEqual(XAPX00.codecFor("LVL").decode(["50", "LVL", "1", "I", "I", "-20.5"]), (-20.5,))
+        self.assertEqual(XAPX00.codecFor("MTRXLVL").decode(["50", "MTRXLVL", "1", "I", "2", "O", "-6.00", "A"]),
+                         (-6.0, "A"))
+        decode3 = XAPX00._compileDecoder((int, str, float), 1)
+        self.assertEqual(decode3(["50", "7", "x", "1.5"]), (7, "x", 1.5))
+        self.assertEqual(XAPX00.codecFor("AGCSET").decode(["50", "AGCSET", "1", "M", "-20", "0", "1", "6"]),
+                         (-20.0, 0.0, 1.0, 6.0))
+
+    def test_general_path(self):
+        decode = XAPX00._compileDecoder((int, int, int, int, float), 0)
+        self.assertEqual(decode(["1", "2", "3", "4", "5"]), (1, 2, 3, 4, 5.0))
+        self.assertEqual(decode(["1", "2"]), (1, 2))
+        self.assertEqual(decode(["1", "2", "3", "4", "5", "x"]), (1, 2, 3, 4, 5.0, "x"))
+        # commands without a value table decode every value as str
+        self.assertEqual(XAPX00.codecFor("VER").decode(["50", "VER", "4.1.0"]), ("4.1.0",))
+
+    def test_malformed_numbers(self):
+        for codec, items in ((XAPX00.codecFor("GAIN"), ["50", "GAIN", "1", "I", "-3.0x", "A"]),
+                             (XAPX00.codecFor("FILTER"), ["50", "FILTER", "1", "I", "2", "x", "1000", "0", "1"]),
+                             (XAPX00.codecFor("DECAY"), ["50", "DECAY", "1", "1.5"])):
+            self.assertRaises(ValueError, codec.decode, items)
+
+    def test_malformed_answer_and_report(self):
+        answers = {"GAIN": "#50 GAIN 1 I loud A"}
+        xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(lambda line: [answers[line.split()[1]]]),
+                            units={0: "XAP800"})
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        self.assertEqual(xap.XAPCommand("GAIN", 1, "I"), "A")  # raw items are still available
+        self.assertRaises(ValueError, xap.XAPValues, "GAIN", 1, "I")
+        events = []
+        xap.addEventListener(events.append)
+        xap._reader.feed(b"#50 GAIN 2 I loud A\r\n#50 GAIN 3 I -6.00 A\r\n")
+        xap._dispatchPending()
+        self.assertEqual([(e['args'][0], e['values']) for e in events], [("3", (-6.0, "A"))])
@@ -0,0 +1,101 @@
+import time
+import unittest
+
+import XAPX00
+import xapman
+import xapsim
+
+
+class DiscoveryTest(unittest.TestCase):
+    """Connect handshake against a mixed simulated stack"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 3: "XAP400", 5: "XAP800"})
+        self.lines = []
+
+        def handler(line):
+            self.lines.append(line)
+            return self.sim.handleLine(line)
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(handler))
+        self.xap._maxrespdelay = 0.2
+        self.xap.connect()
+        self.addCleanup(self.xap.disconnect)
+
+    def test_one_probe_per_id_and_type(self):
+        self.assertEqual(self.xap.units, {0: "XAP800", 3: "XAP400", 5: "XAP800"})
+        self.assertEqual(len(self.lines), 16)
+        self.assertEqual(sorted(set(line.split()[1] for line in self.lines)), ["SERECHO"])
+
+    def test_missing_unit(self):
+        del self.sim.units[5]
+        start = time.time()
+        self.assertEqual(self.xap.discoverUnits(), {0: "XAP800", 3: "XAP400"})
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.xap.units, {0: "XAP800", 3: "XAP400"})
+
+    def test_known_units_send_no_probes(self):
+        lines = []
+
+        def handler(line):
+            lines.append(line)
+            return self.sim.handleLine(line)
+        xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(handler), units={3: "XAP400"})
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        self.assertEqual(xap.units, {3: "XAP400"})
+        self.assertEqual(lines, [])
+
+
+class IdentityTest(unittest.TestCase):
+    """Unit identities and rescans of a mixed stack"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 3: "XAP400"})
+        self.lines = []
+
+        def handler(line):
+            self.lines.append(line)
+            return self.sim.handleLine(line)
+        self.transport = XAPX00.LoopbackTransport(handler)
+
+    def test_identity_is_read_once_per_unit(self):
+        xap = XAPX00.XAPX00(transport=self.transport)
+        xap._maxrespdelay = 0.2
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        del self.lines[:]
+        self.assertEqual(xap.getIdentity(3), {'type': "XAP400", 'UID': "#0x70001003", 'version': "4.1.0"})
+        self.assertEqual(xap.getIdentity(0)['UID'], "#0x50001000")
+        self.assertEqual(sorted(set(line.split()[0] for line in self.lines)), ["#50", "#73"])
+        sent = len(self.lines)
+        xap.getIdentity(3)
+        xap.getIdentity(0)
+        self.assertEqual(len(self.lines), sent)
+        self.assertIsNone(xap.getIdentity(6))
+        self.assertNotIn(6, xap.identities)
+
+    def test_rediscover_units(self):
+        xap = XAPX00.XAPX00(transport=self.transport, threaded=1)
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        xap.getIdentity(3)
+        del self.sim.units[3]
+        self.sim.units[4] = xapsim.XAPUnitSim(4, "XAP400")
+        self.assertEqual(xap.rediscoverUnits(), {0: "XAP800", 4: "XAP400"})
+        self.assertEqual(xap.identities, {})
+        self.assertEqual(xap.getIdentity(4)['UID'], "#0x70001004")
+
+    def test_scan_devices(self):
+        conn = xapman.connect(transport=self.transport)
+        self.addCleanup(conn.comms.disconnect)
+        units = conn.units
+        self.assertEqual(sorted(units), [0, 3])
+        self.assertEqual((units[0].device_type, units[3].device_type), ("XAP800", "XAP400"))
+        self.assertEqual(units[3].serial_number, "#0x70001003")
+        self.assertEqual(units[3].matrix.keys(), list(xapman.channel_data["XAP400"]))
+        self.assertEqual(units[3].input_channels[1].label, "LABEL")
+        del self.sim.units[3]
+        conn.comms._maxrespdelay = 0.2
+        self.assertEqual(sorted(conn.rediscover()), [0])
+        self.assertEqual(conn.comms.units, {0: "XAP800"})
+        self.assertEqual(conn.expansion_bus.units, conn.units)
@@ -0,0 +1,49 @@
+from array import array
+import unittest
+from unittest import mock
+
+import XAPX00
+
+
+class LevelArrayTests(object):
+    """db2linearArray/linear2dbArray against the scalar conversions"""
+    levels = [-99.0, -65.0, -20.5, -6.0, 0.0, 6.0, 12.0]
+
+    def test_matches_scalar(self):
+        gains = XAPX00.db2linearArray(self.levels)
+        self.assertIsInstance(gains, self.arrayType)
+        for level, gain in zip(self.levels, gains):
+            self.assertAlmostEqual(gain, XAPX00.db2linear(level))
+        for gain, level in zip(gains, XAPX00.linear2dbArray(gains)):
+            self.assertAlmostEqual(level, XAPX00.linear2db(gain))
+
+    def test_round_trip(self):
+        audible = self.levels[2:]  # linear2db adds 1e-6 to the gain, skewing the quietest
+        for maxref in (0, 12):
+            levels = XAPX00.linear2dbArray(XAPX00.db2linearArray(audible, maxref), maxref)
+            for want, got in zip(audible, levels):
+                self.assertAlmostEqual(want, got, delta=0.001)
+
+    def test_strings_and_limits(self):
+        gains = XAPX00.db2linearArray(["-6.00", "0.00"])
+        self.assertAlmostEqual(gains[1], 1.0)
+        self.assertEqual(list(XAPX00.linear2dbArray([0.0, 1e9])), [-99.0, 99.0])
+        self.assertEqual(len(XAPX00.db2linearArray([])), 0)
+        self.assertRaises(ValueError, XAPX00.db2linearArray, ["-6.00", "bad"])
+
+
+@unittest.skipIf(XAPX00.numpy is None, "numpy is not installed")
+class NumpyLevelArrayTest(LevelArrayTests, unittest.TestCase):
+
+    @property
+    def arrayType(self):
+        return XAPX00.numpy.ndarray
+
+
+class FallbackLevelArrayTest(LevelArrayTests, unittest.TestCase):
+    arrayType = array
+
+    def setUp(self):
+        patcher = mock.patch.object(XAPX00, "numpy", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
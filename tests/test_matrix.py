@@ -0,0 +1,162 @@
+import math
+import time
+import unittest
+
+import XAPX00
+import xapman
+import xapsim
+
+
+class MatrixReadTest(unittest.TestCase):
+    """Whole matrix reads against a simulated unit on a pty"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"}, baudRate=None, latency=0)
+        self.port = self.sim.startPty()
+        self.addCleanup(self.sim.stop)
+
+    def open(self, **kwargs):
+        xap = XAPX00.XAPX00(comPort=self.port, units={0: "XAP800"}, **kwargs)
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        return xap
+
+    def read(self, xap):
+        self.sim.units[0].values[("MTRX", "2", "I", "5", "O")] = ["1"]
+        start = time.time()
+        routing = xap.getMatrixRoutingReport()
+        self.assertEqual(routing[1][4], "1")
+        self.assertLess(self.sim.commands, 200)  # whole rows, not cell by cell
+        return time.time() - start
+
+    def test_wildcard_read(self):
+        self.assertLess(self.read(self.open()), 1)
+
+    def test_wildcard_read_on_worker(self):
+        # rows short of their expected lines must not wait out a timeout
+        self.assertLess(self.read(self.open(threaded=1)), 1)
+
+    def test_wildcard_read_with_cache(self):
+        xap = self.open(cacheTTL=60)
+        xap.getUniqueId(0)  # the end marker of every row read is now cached
+        self.assertLess(self.read(xap), 1)
+        self.assertLess(self.read(xap), 1)
+
+
+class UnitMatrixTest(unittest.TestCase):
+    """xapman.UnitMatrix and its MatrixRow/MatrixLink views"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.sim.units[0].values[("MTRX", "1", "I", "3", "O")] = ["4"]  # matrix reports address inputs as I
+        self.sim.units[0].values[("MTRXLVL", "9", "I", "2", "O")] = ["-6.00", "A"]
+        self.conn = xapman.connect(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                   units={0: "XAP800"})
+        self.addCleanup(self.conn.comms.disconnect)
+        self.matrix = self.conn.units[0].matrix
+
+    def test_flat_arrays(self):
+        matrix = self.matrix
+        cell = matrix.index(1, 3)
+        self.assertEqual(cell, matrix.ordinal[1] * matrix.size + matrix.ordinal[3])
+        self.assertEqual((matrix.states[cell], matrix.enabled[cell]), (4, 1))
+        self.assertEqual(matrix.levels[matrix.index(9, 2)], -6.0)
+        self.assertEqual(matrix.routesFrom(1), [3])
+        self.assertEqual(matrix.routesInto(3), [1])
+        link = matrix[9][2]
+        link.state = "1"
+        link.enabled = True
+        link.attenuation = None
+        cell = matrix.index(9, 2)
+        self.assertEqual((matrix.states[cell], matrix.enabled[cell]), (1, 1))
+        self.assertTrue(math.isnan(matrix.levels[cell]))
+        self.assertIsNone(link.attenuation)
+        self.assertEqual(matrix.routesInto(2), [9])
+
+    def test_rows(self):
+        matrix = self.matrix
+        self.assertIsNone(matrix["O"]["O"])  # a bus does not feed itself
+        self.assertEqual(matrix.states[matrix.index("O", "O")], xapman.UnitMatrix.NO_LINK)
+        self.assertRaises(KeyError, lambda: matrix[13])
+        self.assertRaises(KeyError, lambda: matrix[1][13])
+        self.assertIsNone(matrix.get(13))
+        self.assertEqual(matrix[1].get(13, "none"), "none")
+        self.assertEqual(matrix.keys(), list(xapman.channel_data["XAP800"]))
+        self.assertEqual(dict(matrix[1].items())[3], matrix[1][3])
+        self.assertEqual(len([l for i, o, l in matrix.links()]),
+                         len([l for row in matrix.values() for l in row.values() if l is not None]))
+
+    def test_link_identity(self):
+        link = self.matrix[1][3]
+        self.assertEqual(link, self.matrix[1][3])
+        self.assertNotEqual(link, self.matrix[1][4])
+        self.assertEqual(len({link, self.matrix[1][3], self.matrix[1][4]}), 2)
+        other = xapman.UnitMatrix(self.conn.units[0])
+        other.setLink(1, 3, state="4", attenuation=0.0)
+        self.assertNotEqual(link, other[1][3])
+
+    def test_link_state(self):
+        mic, line = self.matrix[1][3], self.matrix[9][3]
+        self.assertEqual(line.linkState(), "1")
+        self.assertTrue(mic.gatemode is False)
+        self.assertEqual(mic.linkState(), "3")
+        mic.gatemode = True
+        self.assertEqual(mic.linkState(), "4")
+        self.assertIn(mic.cell, self.matrix.gated)
+
+    def test_change(self):
+        link = self.matrix[9][4]
+        unitCode, command, args, update = link.change("1")
+        self.assertEqual((unitCode, command, args), (0, "MTRX", (9, "I", 4, "O", "1")))
+        self.assertFalse(link.enabled)
+        xapman.applyChanges(self.conn.comms, [(unitCode, command, args, update)])
+        self.assertEqual((link.state, link.enabled), ("1", True))
+        self.assertEqual(self.sim.units[0].values[("MTRX", "9", "I", "4", "O")], ["1"])
+        link.change("0")[3]()
+        self.assertEqual((link.state, link.enabled), ("0", False))
+        self.assertEqual(self.matrix.routesInto(4), [])
+
+
+class MatrixReportTest(unittest.TestCase):
+    """XAPX00.MatrixReport and the reads that return one"""
+
+    def test_indexing(self):
+        report = XAPX00.MatrixReport([1, 2, "O"], 'b', -1)
+        self.assertEqual(repr(report), "MatrixReport: 3x3 b")
+        report[1, "o"] = 4
+        report["O", 2] = 1
+        self.assertEqual(report[1, "O"], 4)
+        self.assertEqual(report.row(1), [-1, -1, 4])
+        self.assertEqual(report.column(2), [-1, -1, 1])
+        self.assertEqual(report.tolist(), [[-1, -1, 4], [-1, -1, -1], [-1, 1, -1]])
+        self.assertRaises(KeyError, lambda: report[3, 1])
+        if XAPX00.numpy is not None:
+            self.assertEqual(report.asarray().shape, (3, 3))
+            self.assertEqual(report.asarray().tolist(), report.tolist())
+
+    def test_reads(self):
+        sim = xapsim.XAPSimulator({0: "XAP800"})
+        sim.units[0].values[("MTRX", "1", "I", "3", "O")] = ["1"]
+        sim.units[0].values[("MTRXLVL", "1", "I", "3", "O")] = ["-6.00", "A"]
+        xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(sim.handleLine), units={0: "XAP800"})
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        routing, levels = xap.getMatrixReport()
+        self.assertEqual((routing.values.typecode, levels.values.typecode), ('b', 'd'))
+        self.assertEqual((routing[1, 3], routing[1, 4], routing["O", "O"]), (1, 0, -1))
+        self.assertAlmostEqual(levels[1, 3], XAPX00.db2linear(-6.0))
+        self.assertTrue(math.isnan(levels["O", "O"]))
+        report = xap.getMatrixLevelReport()
+        self.assertIsInstance(report, XAPX00.MatrixReport)
+        self.assertEqual(report.values.typecode, 'd')
+        self.assertAlmostEqual(XAPX00.linear2dbArray([report[1, 3]])[0], -6.0, places=3)
+        xap.convertDb = 0
+        report = xap.getMatrixLevelReport()
+        snapshot = xap.getMatrixSnapshot()[1]
+        self.assertEqual(report[1, 3], -6.0)
+        for i, row in enumerate(snapshot):
+            for j, level in enumerate(row):
+                if level in ("X", None):
+                    self.assertTrue(math.isnan(report.values[i * report.size + j]))
+                else:
+                    self.assertEqual(report.values[i * report.size + j], float(level))
@@ -0,0 +1,119 @@
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class MeterTest(unittest.TestCase):
+    """LevelMeter polling a simulated unit"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.sim.units[0].level = lambda channel, group, stage: -int(channel)
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                 units={0: "XAP800"})
+        self.xap.connect()
+        self.addCleanup(self.xap.disconnect)
+        self.meter = XAPX00.LevelMeter(self.xap, backlog=2)
+        for channel in (1, 2, 3):
+            self.meter.subscribe(channel)
+
+    def test_stream_collects_from_creation(self):
+        readings = self.meter.stream(timeout=0.05)
+        self.assertEqual(len(self.meter._streams), 1)
+        self.meter.poll()
+        self.assertEqual([r['level'] for r in readings], [-2.0, -3.0])  # backlog keeps the newest
+        self.assertEqual(self.meter._streams, [])
+
+    def test_close(self):
+        with self.meter.stream(timeout=0.05) as readings:
+            self.meter.poll()
+            self.assertEqual(next(readings)['channel'], "2")
+        self.assertEqual(self.meter._streams, [])
+        self.assertEqual(list(readings), [])
+
+    def test_listeners_and_counts(self):
+        got = []
+        self.meter.addListener(got.append)
+        self.meter.poll()
+        self.meter.unsubscribe(2)
+        self.meter.poll()
+        self.assertEqual([r['channel'] for r in got], ["1", "2", "3", "1", "3"])
+        self.assertEqual(self.meter.reads[(0, "1", "I", "I")], 2)
+        self.assertGreater(self.meter.sent, 0)
+
+    def test_failed_read_is_not_published(self):
+        got = []
+        self.meter.addListener(got.append)
+        self.meter.subscribe(1, unitCode=5)  # no such unit
+        self.xap._maxrespdelay = 0.1
+        self.meter.poll()
+        self.assertEqual(len(got), 3)
+        self.assertNotIn((5, "1", "I", "I"), self.meter.reads)
+
+
+class RoundRobinPolicyTest(unittest.TestCase):
+
+    def test_every_subscription_in_turn(self):
+        policy = XAPX00.RoundRobinPolicy()
+        subs = ["a", "b", "c"]
+        self.assertEqual(policy.schedule(subs, 2, 0), ["a", "b"])
+        self.assertEqual(policy.schedule(subs, 2, 0), ["c", "a"])
+        self.assertEqual(policy.schedule(subs, 5, 0), ["b", "c", "a"])
+        self.assertEqual(policy.schedule(subs[:1], 2, 0), ["a"])
+        self.assertEqual(policy.schedule([], 2, 0), [])
+
+
+class AdaptivePolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = XAPX00.AdaptivePolicy(minInterval=0.1, normalInterval=0.4, maxInterval=1.0,
+                                            changeDb=3.0, silenceDb=-60.0)
+
+    def interval(self, sub):
+        return self.policy.state[sub]["interval"]
+
+    def test_steady_channel_relaxes_to_normal(self):
+        policy = self.policy
+        policy.update("a", -20.0, 0)
+        self.assertEqual(self.interval("a"), 0.1)
+        for now in range(1, 6):
+            policy.update("a", -21.0, now)
+        self.assertEqual(self.interval("a"), 0.4)
+        policy.update("a", -10.0, 10)
+        self.assertEqual(self.interval("a"), 0.1)
+        self.assertEqual(policy.state["a"]["due"], 10.1)
+
+    def test_silent_and_muted_back_off(self):
+        policy = self.policy
+        policy.update("silent", -80.0, 0)
+        policy.update("muted", -20.0, 0)
+        policy.setContext("muted", muted=1)
+        for now in range(1, 6):
+            policy.update("silent", -80.0, now)
+            policy.update("muted", -20.0, now)
+        self.assertEqual(self.interval("silent"), 1.0)
+        self.assertEqual(self.interval("muted"), 1.0)
+
+    def test_gated_mic_is_read_fast(self):
+        policy = self.policy
+        policy.update("a", -80.0, 0)
+        policy.update("a", -80.0, 1)
+        self.assertEqual(self.interval("a"), 0.2)
+        policy.setContext("a", gated=1)
+        policy.update("a", -80.0, 2)
+        self.assertEqual(self.interval("a"), 0.1)
+
+    def test_failed_read_backs_off(self):
+        self.policy.update("a", None, 0)
+        self.policy.update("a", None, 1)
+        self.assertEqual(self.interval("a"), 0.4)
+        self.assertEqual(self.policy.state["a"]["level"], None)
+
+    def test_most_overdue_first(self):
+        policy = self.policy
+        policy.update("a", -20.0, 1.0)
+        policy.update("b", -20.0, 0.5)
+        self.assertEqual(policy.schedule(["a", "b", "c"], 8, 0.9), ["c", "b"])
+        self.assertEqual(policy.schedule(["a", "b", "c"], 2, 2.0), ["c", "b"])
+        self.assertEqual(policy.schedule(["a", "b", "c"], 8, 2.0), ["c", "b", "a"])
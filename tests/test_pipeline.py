@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class PipelineTest(unittest.TestCase):
+    """Pipelined requests matched back to their responses"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP400"})
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                 units={0: "XAP800", 1: "XAP400"})
+        self.xap.connect()
+        self.addCleanup(self.xap.disconnect)
+
+    def test_responses_match_by_key(self):
+        xap = self.xap
+        self.sim.units[0].values[("GAIN", "1", "I")] = ["-3.00", "A"]
+        self.sim.units[1].values[("GAIN", "1", "I")] = ["-7.00", "A"]
+        self.sim.units[0].values[("MUTE", "2", "O")] = ["1"]
+        gain0 = xap.queueCommand("GAIN", 1, "I", unitCode=0)
+        gain1 = xap.queueCommand("GAIN", 1, "I", unitCode=1, prefix="#7")
+        mute = xap.queueCommand("MUTE", 2, "O", unitCode=0)
+        xap.flushCommands()
+        self.assertEqual(gain0.values(), (-3.0, "A"))
+        self.assertEqual(gain1.values(), (-7.0, "A"))
+        self.assertEqual(mute.result(), "1")
+
+    def test_expansion_bus_label_directions(self):
+        xap = self.xap
+        xap.setLabel("O", "E", "OUTLBL", inout=0)
+        xap.setLabel("O", "E", "INLBL", inout=1)
+        output = xap.queueCommand("LABEL", "O", "E", 0)
+        input = xap.queueCommand("LABEL", "O", "E", 1)
+        xap.flushCommands()
+        self.assertTrue(output.query and input.query)
+        self.assertNotEqual(output.key, input.key)
+        self.assertEqual((output.result(), input.result()), ("OUTLBL", "INLBL"))
+        self.assertEqual(xap.getLabel("O", "E", inout=0), "OUTLBL")
+
+    def test_error_belongs_to_oldest(self):
+        xap = self.xap
+        bad = xap.queueCommand("BOGUS", 1, unitCode=0)
+        good = xap.queueCommand("MUTE", 1, "I", unitCode=0)
+        xap.flushCommands()
+        self.assertRaises(Exception, bad.result)
+        self.assertEqual(good.result(), "0")
+
+    def test_unmatched_line_is_event(self):
+        events = []
+        self.xap.addEventListener(events.append)
+        self.xap._reader.feed(b"#50 MUTE 3 I 1\r\n")
+        self.xap._dispatchPending()
+        self.assertEqual(events, [{"unitCode": 0, "prefix": "#5", "command": "MUTE",
+                                   "args": ["3", "I", "1"], "values": ("1",)}])
+
+    def test_malformed_lines_are_dropped(self):
+        events = []
+        sim = self.sim
+
+        def noisy(line):
+            return ["#5X MUTE 3 I 1", "#50 GAIN 3 I loud A"] + sim.handleLine(line)
+        self.xap.serial.handler = noisy
+        self.xap.addEventListener(events.append)
+        sim.units[0].values[("MUTE", "1", "I")] = ["1"]
+        self.assertEqual(self.xap.getMute(1), 1)
+        self.assertEqual(events, [])
+
+
+class GateTest(unittest.TestCase):
+    """Two threads sharing an unthreaded XAPX00"""
+
+    def test_long_pipeline_is_not_interleaved(self):
+        sim = xapsim.XAPSimulator({0: "XAP800"}, baudRate=None, latency=0.002)
+        xap = XAPX00.XAPX00(comPort=sim.startPty(), units={0: "XAP800"})
+        self.addCleanup(sim.stop)
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        xap._maxrespdelay = 0.1  # the pipeline below takes longer than this
+        for channel in range(1, 9):
+            sim.units[0].values[("MUTE", str(channel), "I")] = [str(channel % 2)]
+        requests = []
+
+        def run():
+            for i in range(20):
+                requests.extend(xap.queueCommand("MUTE", c, "I") for c in range(1, 9))
+            xap.flushCommands(1)
+        batch = threading.Thread(target=run)
+        batch.start()
+        mutes = []
+        while batch.is_alive() or not mutes:
+            mutes.append(xap.getMute(1, group="O"))
+        batch.join()
+        self.assertEqual(set(mutes), {0})
+        self.assertEqual([req.result() for req in requests],
+                         [str(c % 2) for c in range(1, 9)] * 20)
+
+
+    def test_bare_send_does_not_hold_the_line(self):
+        sim = xapsim.XAPSimulator({0: "XAP800"})
+        xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(sim.handleLine), units={0: "XAP800"})
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        xap.send("#50 MUTE 1 I 1 \r")  # answer never read
+        start = time.time()
+        self.assertEqual(xap.getMute(1), 1)
+        self.assertLess(time.time() - start, 0.5)
+        xap.send("#50 MUTE 1 I \r")
+        self.assertEqual(xap.readResponse(), "1")
@@ -0,0 +1,78 @@
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class ResponseReaderTest(unittest.TestCase):
+    """Framing of received bytes into response lines"""
+
+    def test_lines_split_across_chunks(self):
+        reader = XAPX00.ResponseReader()
+        reader.feed(b"#50 GAIN 1 I -3.")
+        self.assertEqual(len(reader.lines), 0)
+        reader.feed(b"00 A\r\n#50 MU")
+        reader.feed(b"TE 1 I 0\r\nERROR 3\r\n")
+        self.assertEqual(list(reader.lines), [(["50", "GAIN", "1", "I", "-3.00", "A"], None),
+                                              (["50", "MUTE", "1", "I", "0"], None),
+                                              (None, "ERROR 3")])
+        self.assertEqual(len(reader.buffer), 0)
+
+    def test_noise_is_dropped(self):
+        reader = XAPX00.ResponseReader()
+        reader.feed(b"\r\n\x00garbage\r\n> #51 UID #0x51001\r")
+        self.assertEqual(list(reader.lines), [(["51", "UID", "#0x51001"], None)])
+
+    def test_pump(self):
+        link = XAPX00.LoopbackTransport(xapsim.XAPSimulator().handleLine)
+        reader = XAPX00.ResponseReader()
+        self.assertEqual(reader.pump(link), 0)
+        link.write(b"#50 MUTE 2 O \r#50 GAIN 2 O \r")
+        self.assertTrue(reader.pump(link))
+        self.assertEqual([items[1] for items, error in reader.lines], ["MUTE", "GAIN"])
+
+
+class TransportTest(unittest.TestCase):
+    """Transports carrying commands to a simulated stack"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP400"}, baudRate=None, latency=0)
+        self.addCleanup(self.sim.stop)
+
+    def check(self, transport):
+        xap = XAPX00.XAPX00(transport=transport)
+        xap.connect()
+        self.addCleanup(xap.disconnect)
+        self.assertEqual(xap.units, {0: "XAP800", 1: "XAP400"})
+        xap.setMute(3, 1, group="O")
+        self.assertEqual(xap.getMute(3, group="O"), 1)
+        self.assertEqual(self.sim.units[0].values[("MUTE", "3", "O")], ["1"])
+
+    def test_open_transport(self):
+        pty = XAPX00.openTransport(self.sim.startPty())
+        self.addCleanup(pty.close)
+        self.assertIsInstance(pty, XAPX00.PtyTransport)
+        link = XAPX00.LoopbackTransport(self.sim.handleLine)
+        self.assertIs(XAPX00.openTransport(link), link)
+
+    def test_loopback(self):
+        self.check(XAPX00.LoopbackTransport(self.sim.handleLine))
+
+    def test_loopback_partial_writes(self):
+        link = XAPX00.LoopbackTransport(self.sim.handleLine)
+        link.write(b"#50 MUTE 1")
+        self.assertEqual(link.readline(), b"")
+        link.write(b" I\r")
+        self.assertEqual(link.readline(), b"#50 MUTE 1 I 0\r\n")
+
+    def test_pty(self):
+        self.check(XAPX00.PtyTransport(self.sim.startPty()))
+
+    def test_tcp(self):
+        url = self.sim.startSocket()
+        transport = XAPX00.openTransport(url.replace("socket://", "tcp://"))
+        self.assertIsInstance(transport, XAPX00.TCPTransport)
+        self.check(transport)
+
+    def test_write_batch(self):
+        self.check(XAPX00.PtyTransport(self.sim.startPty(), writeBatch=256))
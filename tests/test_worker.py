@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class WorkerTest(unittest.TestCase):
+    """Priority queue in front of the I/O worker"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.sent = []
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(self.handler),
+                                 units={0: "XAP800"}, threaded=1)
+        self.xap.connect()
+        self.xap.convertDb = 0
+        self.addCleanup(self.xap.disconnect)
+
+    def handler(self, line):
+        self.sent.append(line.strip())
+        return self.sim.handleLine(line)
+
+    def start(self, func):
+        thread = threading.Thread(target=func)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        time.sleep(0.1)  # let it queue its commands
+        return thread
+
+    def test_interactive_overtakes_bulk(self):
+        xap = self.xap
+        release = threading.Event()
+        held = xap.submit(release.wait)
+
+        def scan():
+            with xap.priority(XAPX00.PRIORITY_BULK):
+                for channel in range(1, 9):
+                    xap.queueCommand("MUTE", channel, "I")
+                xap.flushCommands()
+        scanner = self.start(scan)
+        reader = self.start(lambda: xap.getGain(2))
+        fader = self.start(lambda: xap.setMute(3, 1, group="O"))
+        release.set()
+        for thread in (scanner, reader, fader):
+            thread.join(5)
+        held.result(5)
+        self.assertEqual(self.sent[:2], ["#50 MUTE 3 O 1", "#50 GAIN 2 I"])
+        self.assertEqual(len(self.sent), 10)
+
+    def test_submit_returns_future(self):
+        self.sim.units[0].values[("MUTE", "4", "I")] = ["1"]
+        future = self.xap.submit("getMute", 4)
+        self.assertEqual(future.result(5), 1)
+        self.assertEqual(self.xap.submit(self.xap.getMute, 5).result(5), 0)
+
+    def test_priority_context_nests(self):
+        xap = self.xap
+        self.assertEqual(xap._currentPriority(), XAPX00.PRIORITY_NORMAL)
+        with xap.priority(XAPX00.PRIORITY_BULK):
+            with xap.priority(XAPX00.PRIORITY_INTERACTIVE):
+                self.assertEqual(xap._currentPriority(), XAPX00.PRIORITY_INTERACTIVE)
+            self.assertEqual(xap._currentPriority(), XAPX00.PRIORITY_BULK)
+        self.assertEqual(xap._currentPriority(), XAPX00.PRIORITY_NORMAL)
+
+    def test_commands_from_many_threads(self):
+        results = {}
+
+        def read(channel):
+            results[channel] = self.xap.getMute(channel)
+        threads = [threading.Thread(target=read, args=(c,)) for c in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, dict((c, 0) for c in range(1, 9)))
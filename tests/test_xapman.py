@@ -0,0 +1,333 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import XAPX00
+import xapman
+import xapsim
+
+
+class ConnectTest(unittest.TestCase):
+    """xapman.connect over an in-memory link to a simulated stack"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP800"}, baudRate=None, latency=0.001)
+        self.port = self.sim.startPty()
+        self.addCleanup(self.sim.stop)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def connect(self, **kwargs):
+        conn = xapman.connect(self.port, units={0: "XAP800", 1: "XAP800"}, **kwargs)
+        self.addCleanup(conn.comms.disconnect)
+        return conn
+
+    def test_snapshot_round_trip(self):
+        snapshot = os.path.join(self.dir, "state.json")
+        first = self.connect(snapshot_file=snapshot, eager=True)
+        state = json.loads(json.dumps(first.units[0].exportState()))
+        self.sim.handleLine("#50 LABEL 1 O NEWNAME")
+        conn = self.connect(snapshot_file=snapshot)
+        self.assertEqual(len(conn.restored_units), 2)
+        self.assertIsNone(conn.revalidation)
+        self.assertIsNone(conn.comms._worker)
+        self.assertEqual(conn.units[0].exportState(), state)
+        self.assertEqual(conn.units[0].output_channels[1].label, "LABEL")
+        conn.revalidate()
+        self.assertEqual(conn.units[0].output_channels[1].label, "NEWNAME")
+        self.assertEqual(conn.restored_units, [])
+
+    def test_snapshot_of_other_units_is_not_restored(self):
+        snapshot = os.path.join(self.dir, "state.json")
+        self.connect(snapshot_file=snapshot)
+        with open(snapshot) as f:
+            saved = json.load(f)
+        saved['units'] = dict((uid + "0", state) for uid, state in saved['units'].items())
+        with open(snapshot, "w") as f:
+            json.dump(saved, f)
+        conn = self.connect(snapshot_file=snapshot)
+        self.assertEqual(conn.restored_units, [])
+        with open(snapshot) as f:
+            self.assertEqual(sorted(json.load(f)['units']), sorted(u.serial_number for u in conn.units.values()))
+
+    def test_background_work_needs_threaded(self):
+        conn = self.connect()
+        self.assertRaises(Exception, conn.startBackground, conn.revalidate, "revalidation")
+
+    def test_revalidation_shares_the_link(self):
+        snapshot = os.path.join(self.dir, "state.json")
+        self.connect(snapshot_file=snapshot)
+        conn = self.connect(snapshot_file=snapshot, threaded=True)
+        self.assertEqual(len(conn.restored_units), 2)
+        while conn.revalidation.is_alive():
+            self.assertEqual(conn.comms.getMute(1, unitCode=1), 0)
+        self.assertTrue(os.path.exists(snapshot))
+        self.assertEqual(conn.restored_units, [])
+
+    def test_preset_marks_matrix_stale(self):
+        conn = self.connect()
+        link = conn.units[0].matrix[1][3]
+        link.state = "1"
+        conn.startMirror()
+        self.addCleanup(conn.stopMirror)
+        self.sim.report(0, "PRESET", 1)
+        deadline = time.time() + 5
+        while not conn.stale_units and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(conn.stale_units, {conn.units[0]})
+        self.assertEqual(link.state, "1")
+        conn.refreshStale()
+        self.assertEqual(link.state, "0")
+
+    def test_preset_refresh_shares_the_link(self):
+        conn = self.connect(threaded=True)
+        link = conn.units[0].matrix[1][3]
+        link.state = "1"
+        conn.startMirror()
+        self.addCleanup(conn.stopMirror)
+        self.sim.report(0, "PRESET", 1)
+        deadline = time.time() + 5
+        while link.state != "0" and time.time() < deadline:
+            self.assertEqual(conn.comms.getMute(1, unitCode=1), 0)
+        self.assertEqual(link.state, "0")
+
+
+class ReconcileTest(unittest.TestCase):
+    """XapUnit.planState/reconcile against a simulated unit"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.conn = xapman.connect(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                   units={0: "XAP800"})
+        self.addCleanup(self.conn.comms.disconnect)
+        self.unit = self.conn.units[0]
+
+    def test_only_differences_are_planned(self):
+        unit = self.unit
+        unit.output_channels[1].mute
+        plan = unit.planState({"outputs": {"1": {"mute": 0, "gain_max": 6.0}},
+                               "matrix": [["1", "3", "1"]]})
+        self.assertEqual([(c[1], list(c[2])) for c in plan],
+                         [("MAX", [1, "O", 6.0]), ("MTRX", [1, "M", 3, "O", "1"])])
+
+    def test_mutes_wrap_the_rest(self):
+        plan = self.unit.planState({"inputs": {"1": {"mute": 1, "gain": 0.5}},
+                                    "outputs": {"2": {"mute": 0}}})
+        self.assertEqual([c[1] for c in plan], ["MUTE", "GAIN", "MUTE"])
+        self.assertEqual(plan[0][2], [1, "M", 1])
+
+    def test_expansion_bus_label(self):
+        plan = self.unit.planState({"outputs": {"O": {"label": "BUS-O", "gain": 0.5}},
+                                    "inputs": {"O": {"label": "BUS-I"}}})
+        self.assertEqual([(c[1], c[2]) for c in plan],
+                         [("LABEL", ["O", "E", 0, "BUS-O"]), ("LABEL", ["O", "E", 1, "BUS-I"])])
+
+    def test_reconcile_expansion_bus_labels(self):
+        desired = {0: {"outputs": {"O": {"label": "BUS-O"}, "1": {"mute": 1}},
+                       "inputs": {"O": {"label": "BUS-I"}}}}
+        self.assertEqual(len(self.conn.reconcile(desired)), 3)
+        values = self.sim.units[0].values
+        self.assertEqual(values[("LABEL", "O", "E", "0")], ["BUS-O"])
+        self.assertEqual(values[("LABEL", "O", "E", "1")], ["BUS-I"])
+        self.assertEqual(values[("MUTE", "1", "O")], ["1"])
+        self.assertEqual(self.unit.output_channels["O"].label, "BUS-O")
+        self.assertEqual(self.unit.input_channels["O"].label, "BUS-I")
+        self.assertEqual(self.conn.reconcile(desired), [])
+        for channel in (self.unit.output_channels["O"], self.unit.input_channels["O"]):
+            channel.invalidate()
+            channel.label  # read back from the unit, per direction
+        self.assertEqual(self.conn.reconcile(desired), [])
+
+
+class ExpansionBusTest(unittest.TestCase):
+    """ExpansionBusManager usage index kept up to date by MatrixLink"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP800"})
+        self.conn = xapman.connect(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                   units={0: "XAP800", 1: "XAP800"})
+        self.addCleanup(self.conn.comms.disconnect)
+        self.bus = self.conn.expansion_bus
+
+    def index(self):
+        return (json.dumps(self.bus.usage, sort_keys=True), dict(self.bus.busUsed),
+                self.bus._inUse, set(self.bus._free), self.bus.requestExpChannel())
+
+    def test_index_matches_recount(self):
+        links = [link for unit in self.conn.units.values() for i, o, link in unit.matrix.links()
+                 if "Expansion" in (link.source.type, link.dest.type) and i != o]
+        rng = random.Random(800)
+        for step in range(200):
+            link = rng.choice(links)
+            if rng.random() < 0.5:
+                link.linkChannels()
+            elif rng.random() < 0.5:
+                link.unlinkChannels()
+            else:
+                link.change(rng.choice(["0", "1"]))[3]()
+            if step % 50 == 49:
+                index = self.index()
+                self.bus.refreshData()
+                self.assertEqual(self.index(), index)
+        self.assertTrue(self.bus._inUse)
+
+    def test_request_lowest_free_channel(self):
+        unit = self.conn.units[0]
+        self.assertEqual(self.bus.requestExpChannel(), "O")
+        unit.matrix[1]["O"].linkChannels()
+        unit.matrix["P"][2].linkChannels()
+        self.assertEqual(self.bus.requestExpChannel(), "Q")
+        self.assertEqual(self.bus.getChannelUsage("P"), {"inUse": True, "input": 0, "output": 1})
+        unit.matrix[1]["O"].unlinkChannels()
+        self.assertEqual(self.bus.requestExpChannel(), "O")
+        self.assertEqual(self.bus.statusReport(), "Available: 11 InUse: 1 Reserved: 0")
+
+
+class RoutingTest(unittest.TestCase):
+    """connect.planChannelRoutes/setChannelRoutes across two simulated units"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP800"})
+        self.lines = []
+
+        def handler(line):
+            self.lines.append(line)
+            return self.sim.handleLine(line)
+        self.conn = xapman.connect(transport=XAPX00.LoopbackTransport(handler),
+                                   units={0: "XAP800", 1: "XAP800"})
+        self.addCleanup(self.conn.comms.disconnect)
+        self.a, self.b = self.conn.units[0], self.conn.units[1]
+        del self.lines[:]
+
+    def route(self, source, dest):
+        return source[0].input_channels[source[1]], dest[0].output_channels[dest[1]]
+
+    def test_unsatisfiable_plan_sends_nothing(self):
+        self.conn.expansion_bus = xapman.ExpansionBusManager(self.conn, reserved_channels=list("PQRSTUVWXYZ"))
+        routes = [self.route((self.a, 1), (self.b, 1)), self.route((self.a, 2), (self.b, 2)),
+                  self.route((self.a, 3), (self.a, 3))]
+        self.assertRaises(xapman.NoExpansionBusAvailable, self.conn.setChannelRoutes, routes)
+        self.assertEqual(self.lines, [])
+        self.assertFalse(self.a.matrix[3][3].enabled)
+
+    def test_only_differences_are_sent(self):
+        a, b = self.a, self.b
+        routes = [self.route((a, 1), (b, 1)), self.route((a, 1), (b, 2)),
+                  self.route((a, 2), (b, 3)), self.route((a, 3), (a, 4))]
+        plan = self.conn.setChannelRoutes(routes)
+        self.assertEqual(plan['buses'], {(0, 1): "O", (0, 2): "P"})
+        self.assertEqual(len(self.lines), 6)
+        self.assertEqual(plan['unlink'], [])
+        self.assertEqual(self.sim.units[1].values[("MTRX", "O", "E", "2", "O")], ["1"])
+        self.assertTrue(b.matrix["O"][2].enabled)
+        del self.lines[:]
+        self.conn.setChannelRoutes(routes)
+        self.assertEqual(self.lines, [])
+        plan = self.conn.setChannelRoutes(routes[:1] + routes[2:])
+        self.assertEqual(plan['unlink'], [b.matrix["O"][2]])
+        self.assertEqual(plan['link'], [])
+        self.assertEqual([line.split() for line in self.lines], [["#51", "MTRX", "O", "E", "2", "O", "0"]])
+        self.assertFalse(b.matrix["O"][2].enabled)
+
+
+class LazyAttributeTest(unittest.TestCase):
+    """Channel parameters read on first access and cached"""
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"})
+        self.lines = []
+
+        def handler(line):
+            self.lines.append(line)
+            return self.sim.handleLine(line)
+        self.conn = xapman.connect(transport=XAPX00.LoopbackTransport(handler), units={0: "XAP800"})
+        self.addCleanup(self.conn.comms.disconnect)
+        self.channel = self.conn.units[0].output_channels[1]
+        del self.lines[:]
+
+    def reads(self, command):
+        return len([line for line in self.lines if line.split()[1] == command])
+
+    def test_read_on_first_access(self):
+        self.assertNotIn("label", self.channel.__dict__)
+        self.assertEqual(repr(self.channel), "Output: 0:1 | None")
+        self.assertEqual(self.lines, [])
+        self.assertEqual(self.channel.label, "LABEL")
+        self.assertEqual(self.channel.label, "LABEL")
+        self.assertEqual(self.reads("LABEL"), 1)
+        self.assertEqual(repr(self.channel), "Output: 0:1 | LABEL")
+
+    def test_stale_after_max_age(self):
+        self.conn.attribute_max_age = 0.05
+        self.channel.mute
+        self.channel.mute
+        self.assertEqual(self.reads("MUTE"), 1)
+        time.sleep(0.1)
+        self.sim.handleLine("#50 MUTE 1 O 1")
+        self.assertEqual(self.channel.mute, 1)
+        self.assertEqual(self.reads("MUTE"), 2)
+
+    def test_invalidate(self):
+        self.channel.mute
+        self.channel.label
+        self.sim.handleLine("#50 MUTE 1 O 1")
+        self.channel.invalidate("mute")
+        self.assertEqual(self.channel.mute, 1)
+        self.channel.label
+        self.assertEqual((self.reads("MUTE"), self.reads("LABEL")), (2, 1))
+        self.channel.invalidate()
+        self.channel.label
+        self.assertEqual(self.reads("LABEL"), 2)
+
+
+class MirrorTest(unittest.TestCase):
+    """Unsolicited reports mirrored into the unit objects by the listener thread"""
+    threaded = False
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800"}, baudRate=None, latency=0)
+        self.conn = xapman.connect(self.sim.startPty(), units={0: "XAP800"}, threaded=self.threaded)
+        self.addCleanup(self.sim.stop)
+        self.addCleanup(self.conn.comms.disconnect)
+        self.unit = self.conn.units[0]
+        self.conn.startMirror()
+        self.addCleanup(self.conn.stopMirror)
+
+    def wait(self, check):
+        deadline = time.time() + 2
+        while not check() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(check())
+
+    def test_gain_and_mute_reports(self):
+        channel = self.unit.input_channels[2]
+        self.sim.report(0, "GAIN", 2, "M", "-6.00", "A")
+        self.sim.report(0, "MUTE", 2, "M", 1)
+        self.wait(lambda: channel.__dict__.get("mute") == 1)
+        self.assertEqual(channel.gain, -6.0)
+        self.assertEqual(channel.gain, self.conn.comms.getGain(2, "M"))
+
+    def test_matrix_level_report(self):
+        link = self.unit.matrix[1][3]
+        self.sim.report(0, "MTRXLVL", 1, "M", 3, "O", "-12.00", "A")
+        self.wait(lambda: link.attenuation == -12.0)
+
+    def test_label_report_invalidates(self):
+        channel = self.unit.output_channels[1]
+        self.assertEqual(channel.label, "LABEL")
+        self.sim.report(0, "LABEL", 1, "O", "DESK")
+        self.wait(lambda: "label" not in channel.__dict__.get("_loaded", {}))
+        self.assertEqual(channel.label, "DESK")
+
+
+class ThreadedMirrorTest(MirrorTest):
+    """Unsolicited reports mirrored by the I/O worker between jobs"""
+    threaded = True
+
+    def test_worker_reads_the_reports(self):
+        self.assertIsNotNone(self.conn.comms._worker)
+        self.assertIsNone(self.conn.comms._listener)
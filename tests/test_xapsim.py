@@ -0,0 +1,41 @@
+import unittest
+
+import XAPX00
+import xapsim
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = xapsim.XAPSimulator({0: "XAP800", 1: "XAP400"})
+        self.xap = XAPX00.XAPX00(transport=XAPX00.LoopbackTransport(self.sim.handleLine),
+                                 units={0: "XAP800", 1: "XAP400"})
+        self.xap.connect()
+        self.addCleanup(self.xap.disconnect)
+
+    def test_errors(self):
+        self.assertEqual(self.sim.handleLine("#50 BOGUS 1"), ["ERROR 3"])
+        self.assertEqual(self.sim.handleLine("#50 MTRX 99 I 1 O"), ["ERROR 5"])
+        self.assertEqual(XAPX00.XAPX00.errorDefs["ERROR 3"], "Unknown Command")
+        self.assertEqual(XAPX00.XAPX00.errorDefs["ERROR 5"], "Invalid parameter")
+        self.assertRaises(Exception, self.xap.XAPCommand, "BOGUS", 1)
+
+    def test_mute_toggle(self):
+        self.assertEqual(self.xap.getMute(1), 0)
+        self.assertEqual(self.xap.setMute(1, 2), 1)
+        self.assertEqual(self.xap.setMute(1, 2), 0)
+        self.assertEqual(self.sim.handleLine("#50 MTRX 1 I 3 O 2"), ["#50 MTRX 1 I 3 O 1"])
+
+    def test_serial_echo(self):
+        self.assertEqual(self.sim.handleLine("#71 SERECHO 0"), [])
+        self.assertEqual(self.sim.handleLine("#71 GAIN 1 I"), [])
+        self.assertEqual(self.sim.handleLine("#71 SERECHO 1"), ["#71 SERECHO 1"])
+        self.assertEqual(self.xap.discoverUnits(0), {0: "XAP800", 1: "XAP400"})
+        self.sim.handleLine("#71 SERECHO 0")  # the probes switch it back on
+        self.assertEqual(self.xap.discoverUnits(0), {0: "XAP800", 1: "XAP400"})
+
+    def test_expansion_bus_labels(self):
+        self.xap.setLabel("O", "E", "BUS-O", inout=0)
+        self.xap.setLabel("O", "E", "BUS-I", inout=1)
+        self.assertEqual(self.xap.getLabel("O", "E", inout=0), "BUS-O")
+        self.assertEqual(self.xap.getLabel("O", "E", inout=1), "BUS-I")
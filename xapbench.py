@@ -0,0 +1,173 @@
+"""
+Benchmarks for xapman/XAPX00 against a simulated stack (see xapsim).
+
+For every operation reports the commands sent, bytes on the wire (both
+directions), wall time and CPU time of the calling thread (the simulator
+runs in its own threads and is not counted).
+
+    python xapbench.py                 # run and compare with the baseline
+    python xapbench.py --save          # run and store a new baseline
+    python xapbench.py --units 4 --baud 115200
+    python xapbench.py --loopback       # no I/O, times the Python side only
+
+The baseline file keeps the last saved figures. Compared runs fail (exit
+status 1) when an operation sends more commands or bytes than the
+baseline, or takes more than --tolerance times its wall or CPU time.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import XAPX00
+import xapman
+import xapsim
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+
+class Benchmark(object):
+    """Runs operations against a simulator and records what they cost"""
+
+    def __init__(self, units=2, baudRate=38400, latency=0.005, loopback=False):
+        """loopback - answer commands in memory (XAPX00.LoopbackTransport)
+        instead of over a paced pty"""
+        self.sim = xapsim.XAPSimulator(dict((i, "XAP800") for i in range(units)),
+                                       baudRate=baudRate, latency=latency)
+        self.loopback = loopback
+        self.port = None if loopback else self.sim.startPty()
+        self.results = {}
+
+    def _answer(self, line):
+        """LoopbackTransport handler, counting like the simulator does"""
+        self.sim.commands += 1
+        self.sim.bytesIn += len(line) + 1
+        lines = self.sim.handleLine(line)
+        self.sim.bytesOut += sum(len(response) + 2 for response in lines)
+        return lines
+
+    def measure(self, name, func, *args, **kwargs):
+        """Run func, record its cost under name and return its result"""
+        self.sim.resetCounters()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args, **kwargs)
+        cpu = time.thread_time() - cpu
+        wall = time.perf_counter() - wall
+        if not self.loopback:
+            time.sleep(0.05)  # let the simulator count the last answers
+        self.results[name] = {"commands": self.sim.commands,
+                              "bytes": self.sim.bytesIn + self.sim.bytesOut,
+                              "wall": round(wall, 4),
+                              "cpu": round(cpu, 4)}
+        return result
+
+    def run(self):
+        if self.loopback:
+            connection = self.measure("connect", xapman.connect,
+                                      transport=XAPX00.LoopbackTransport(self._answer))
+        else:
+            connection = self.measure("connect", xapman.connect, serial_path=self.port)
+        units = sorted(connection.units)
+        unit = connection.units[units[0]]
+        self.measure("scanMatrix", unit.scanMatrix)
+        connection.expansion_bus.refreshData()
+        self.measure("unit.refreshData", unit.refreshData)
+        self.measure("channels.refreshData",
+                     lambda: [channel.refreshData() for channel in
+                              list(unit.input_channels.values()) + list(unit.output_channels.values())])
+        self.measure("getMatrixRoutingReport", connection.comms.getMatrixRoutingReport, unit.device_id)
+        if len(units) > 1:
+            other = connection.units[units[1]]
+            source = unit.input_channels[1]
+            dest = other.output_channels[1]
+            self.measure("addChannelRoute", connection.addChannelRoute, source, dest)
+            self.measure("delChannelRoute", connection.delChannelRoute, source, dest)
+        if self.loopback:  # nothing to wait for, so these time the per command cost
+            comms = connection.comms
+            device_id = unit.device_id
+            self.measure("queued GAIN x1000", self._queueGains, comms, device_id, 1000)
+            self.measure("getGain x200", lambda: [comms.getGain(c % 12 + 1, unitCode=device_id)
+                                                  for c in range(200)])
+            self.measure("setMatrixLevel x200", lambda: [comms.setMatrixLevel(c % 12 + 1, c // 12 % 12 + 1, 0.5,
+                                                                              unitCode=device_id)
+                                                         for c in range(200)])
+            self.measure("getFilter x200", lambda: [comms.getFilter(c % 12 + 1, "M", c % 4 + 1, unitCode=device_id)
+                                                    for c in range(200)])
+        connection.comms.disconnect()
+        self.sim.stop()
+        return self.results
+
+    def _queueGains(self, comms, device_id, count):
+        for c in range(count):
+            comms.queueCommand("GAIN", c % 12 + 1, "I", unitCode=device_id, rtnCount=2)
+        return comms.flushCommands()
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("commands", "bytes"):
+            if result[metric] > base[metric]:
+                regressions.append("%s: %s %d > %d" % (name, metric, result[metric], base[metric]))
+        for metric in ("wall", "cpu"):
+            if result[metric] > base[metric] * tolerance and result[metric] - base[metric] > 0.05:
+                regressions.append("%s: %s %.4f > %.4f" % (name, metric, result[metric], base[metric]))
+    return regressions
+
+
+def report(results, baseline=None):
+    print("%-24s %9s %9s %9s %9s %9s" % ("operation", "commands", "bytes", "wall s", "cpu s", "cpu us/cmd"))
+    for name, result in results.items():
+        for label, row in ((name, result), ("  baseline", (baseline or {}).get(name))):
+            if row:
+                print("%-24s %9d %9d %9.3f %9.3f %9.1f" % (label, row["commands"], row["bytes"], row["wall"],
+                                                          row["cpu"], 1e6 * row["cpu"] / max(1, row["commands"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark xapman against a simulated XAP stack")
+    parser.add_argument("--units", type=int, default=2)
+    parser.add_argument("--baud", type=int, default=38400)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--loopback", action="store_true", help="no serial link, Python side only")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed wall/cpu time ratio")
+    options = parser.parse_args(argv)
+    settings = {"units": options.units, "baud": options.baud, "latency": options.latency}
+    if options.loopback:
+        settings = {"units": options.units, "loopback": True}
+    results = Benchmark(options.units, options.baud, options.latency, options.loopback).run()
+    baseline = None
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            saved = json.load(f)
+        if saved.get("settings") == settings:
+            baseline = saved["results"]
+    report(results, baseline)
+    if options.save:
+        with open(options.baseline, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=1, sort_keys=True)
+        print("Saved baseline to " + options.baseline)
+        return 0
+    if baseline is None:
+        print("No baseline for these settings, run with --save to create one")
+        return 0
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
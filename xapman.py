@@ -1,5 +1,12 @@
 import XAPX00
+import json
+import math
+import os
+import threading
+import time
+from array import array
 from copy import deepcopy
+from functools import partial
 channel_data = {"XAP800": {1: {"ig": "M", "og": "O", "itype": "Mic", "otype": "Output"},
                            2: {"ig": "M", "og": "O", "itype": "Mic", "otype": "Output"},
                            3: {"ig": "M", "og": "O", "itype": "Mic", "otype": "Output"},
@@ -95,119 +102,125 @@ filter_types = {None: "Not Configured",
                 10: "Linkwitz-Riley Crossover",
                 11: "Notch"}
 
-matrix_y = {"XAP800": {1: None,
-                       2: None,
-                       3: None,
-                       4: None,
-                       5: None,
-                       6: None,
-                       7: None,
-                       8: None,
-                       9: None,
-                       10: None,
-                       11: None,
-                       12: None,
-                       "O": None,
-                       "P": None,
-                       "Q": None,
-                       "R": None,
-                       "S": None,
-                       "T": None,
-                       "U": None,
-                       "V": None,
-                       "W": None,
-                       "X": None,
-                       "Y": None,
-                       "Z": None,
-                       "A": None,
-                       "B": None,
-                       "C": None,
-                       "D": None,
-                       "E": None,
-                       "F": None,
-                       "G": None,
-                       "H": None},
-            "XAP400": {1: None,
-                       2: None,
-                       3: None,
-                       4: None,
-                       5: None,
-                       6: None,
-                       7: None,
-                       8: None,
-                       "O": None,
-                       "P": None,
-                       "Q": None,
-                       "R": None,
-                       "S": None,
-                       "T": None,
-                       "U": None,
-                       "V": None,
-                       "W": None,
-                       "X": None,
-                       "Y": None,
-                       "Z": None,
-                       "A": None,
-                       "B": None,
-                       "C": None,
-                       "D": None}}
-
-matrix = {"XAP800": {1: deepcopy(matrix_y['XAP800']),
-                     2: deepcopy(matrix_y['XAP800']),
-                     3: deepcopy(matrix_y['XAP800']),
-                     4: deepcopy(matrix_y['XAP800']),
-                     5: deepcopy(matrix_y['XAP800']),
-                     6: deepcopy(matrix_y['XAP800']),
-                     7: deepcopy(matrix_y['XAP800']),
-                     8: deepcopy(matrix_y['XAP800']),
-                     9: deepcopy(matrix_y['XAP800']),
-                     10: deepcopy(matrix_y['XAP800']),
-                     11: deepcopy(matrix_y['XAP800']),
-                     12: deepcopy(matrix_y['XAP800']),
-                     "O": deepcopy(matrix_y['XAP800']),
-                     "P": deepcopy(matrix_y['XAP800']),
-                     "Q": deepcopy(matrix_y['XAP800']),
-                     "R": deepcopy(matrix_y['XAP800']),
-                     "S": deepcopy(matrix_y['XAP800']),
-                     "T": deepcopy(matrix_y['XAP800']),
-                     "U": deepcopy(matrix_y['XAP800']),
-                     "V": deepcopy(matrix_y['XAP800']),
-                     "W": deepcopy(matrix_y['XAP800']),
-                     "X": deepcopy(matrix_y['XAP800']),
-                     "Y": deepcopy(matrix_y['XAP800']),
-                     "Z": deepcopy(matrix_y['XAP800']),
-                     "A": deepcopy(matrix_y['XAP800']),
-                     "B": deepcopy(matrix_y['XAP800']),
-                     "C": deepcopy(matrix_y['XAP800']),
-                     "D": deepcopy(matrix_y['XAP800']),
-                     "E": deepcopy(matrix_y['XAP800']),
-                     "F": deepcopy(matrix_y['XAP800']),
-                     "G": deepcopy(matrix_y['XAP800']),
-                     "H": deepcopy(matrix_y['XAP800'])},
-          "XAP400": {1: deepcopy(matrix_y['XAP400']),
-                     2: deepcopy(matrix_y['XAP400']),
-                     3: deepcopy(matrix_y['XAP400']),
-                     4: deepcopy(matrix_y['XAP400']),
-                     5: deepcopy(matrix_y['XAP400']),
-                     6: deepcopy(matrix_y['XAP400']),
-                     7: deepcopy(matrix_y['XAP400']),
-                     8: deepcopy(matrix_y['XAP400']),
-                     "O": deepcopy(matrix_y['XAP400']),
-                     "P": deepcopy(matrix_y['XAP400']),
-                     "Q": deepcopy(matrix_y['XAP400']),
-                     "R": deepcopy(matrix_y['XAP400']),
-                     "S": deepcopy(matrix_y['XAP400']),
-                     "T": deepcopy(matrix_y['XAP400']),
-                     "U": deepcopy(matrix_y['XAP400']),
-                     "V": deepcopy(matrix_y['XAP400']),
-                     "W": deepcopy(matrix_y['XAP400']),
-                     "X": deepcopy(matrix_y['XAP400']),
-                     "Y": deepcopy(matrix_y['XAP400']),
-                     "Z": deepcopy(matrix_y['XAP400']),
-                     "A": deepcopy(matrix_y['XAP400']),
-                     "B": deepcopy(matrix_y['XAP400']),
-                     "C": deepcopy(matrix_y['XAP400']),
-                     "D": deepcopy(matrix_y['XAP400'])}}
+SNAPSHOT_VERSION = 1
+
+# channel parameters to forget when a unit reports a change of COMMAND
+event_attributes = {"GAIN": ("prop_gain",),
+                    "MAX": ("gain_max", "prop_gain"),
+                    "MIN": ("gain_min",),
+                    "LABEL": ("label",),
+                    "AGC": ("AGC",),
+                    "AGCSET": ("AGC_target", "AGC_threshold", "AGC_attack", "AGC_gain"),
+                    "PP": ("phantom_power",),
+                    "NCSEL": ("NC",),
+                    "NCD": ("NC_depth",),
+                    "AEC": ("AEC",),
+                    "REFSEL": ("AEC_PA_reference",),
+                    "NLP": ("NLP",),
+                    "AAMB": ("adaptive_ambient",),
+                    "AMBLVL": ("ambient_level",),
+                    "PAA": ("PA_adaptive",),
+                    "GMODE": ("gating",),
+                    "GHOLD": ("gate_holdtime",),
+                    "GOVER": ("gate_override",),
+                    "GRATIO": ("gate_ratio",),
+                    "GRPSEL": ("gate_group",),
+                    "CHAIRO": ("gate_chairman",),
+                    "DECAY": ("gate_decay",),
+                    "MLINE": ("gain_coarse",),
+                    "OFFA": ("gate_attenuation",),
+                    "FILTER": ("filters",)}
+
+
+# channel attribute: (command, whether the channel group is sent) used by XapUnit.planState
+reconcile_commands = {"gain": ("GAIN", True),
+                      "mute": ("MUTE", True),
+                      "gain_max": ("MAX", True),
+                      "gain_min": ("MIN", True),
+                      "label": ("LABEL", True),
+                      "AGC": ("AGC", True),
+                      "NC": ("NCSEL", True),
+                      "phantom_power": ("PP", False),
+                      "AEC": ("AEC", False),
+                      "NLP": ("NLP", False),
+                      "adaptive_ambient": ("AAMB", False),
+                      "PA_adaptive": ("PAA", False),
+                      "gating": ("GMODE", False)}
+
+
+def sameValue(current, wanted):
+    """Compare a model value with a desired one, numbers by value"""
+    if current is None or wanted is None:
+        return current is wanted
+    try:
+        return float(current) == float(wanted)
+    except (TypeError, ValueError):
+        return str(current) == str(wanted)
+
+
+def wireValue(value):
+    return (1 if value else 0) if isinstance(value, bool) else value
+
+
+def applyChanges(comms, changes):
+    """Send (unitCode, command, args, update) changes as one pipelined batch,
+    calling update() for every change the unit accepted.
+    Raises the first error after all changes have been sent.
+    """
+    for unitCode, command, args, update in changes:
+        comms.queueCommand(command, *args, unitCode=unitCode)
+    error = None
+    for change, req in zip(changes, comms.flushCommands()):
+        try:
+            result = req.result()
+        except Exception as e:
+            error = error or e
+            continue
+        if result is not None:
+            change[3]()
+    if error is not None:
+        raise error
+    return changes
+
+
+def channelKey(channel):
+    """channel_data key for a channel as it appears on the wire"""
+    return int(channel) if channel.isdigit() else channel.upper()
+
+
+class LazyAttribute(object):
+    """Channel parameter that is read from the unit on first access.
+    The value is cached until it is older than the connection's
+    attribute_max_age (None = never stale) or the channel invalidates it.
+    Assigning the attribute, as the get/set methods do, refreshes the cache.
+    """
+
+    def __init__(self, getter):
+        self.getter = getter
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        loaded = obj.__dict__.setdefault('_loaded', {})
+        stamp = loaded.get(self.name)
+        max_age = obj.connection.attribute_max_age
+        if stamp is None or (max_age is not None and time.time() - stamp > max_age):
+            loaded.pop(self.name, None)
+            try:
+                value = getattr(obj, self.getter)()
+            except NotSupported:
+                value = None
+            if self.name not in loaded:  # getter did not store it itself
+                self.__set__(obj, value)
+        return obj.__dict__.get(self.name)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        obj.__dict__.setdefault('_loaded', {})[self.name] = time.time()
 
 
 class connect(object):
@@ -221,37 +234,197 @@ class connect(object):
                  mqtt_path="home/HA/AudioMixers/",
                  device_type="XAP800",
                  ramptime=3,
-                 autoramp=True):
-
+                 autoramp=True,
+                 snapshot_file=None,
+                 eager=False,
+                 attribute_max_age=None,
+                 units=None,
+                 transport=None,
+                 threaded=False):
+        """snapshot_file - optional path of a state snapshot. Units found in
+        it (same UID and firmware version) are restored from it instead of
+        being scanned; the file is rewritten once everything has been read
+        from the units (see revalidate).
+        eager - read every channel parameter when channels are created,
+        otherwise each one is read on first access.
+        attribute_max_age - seconds before a cached channel parameter is
+        read again on access, None to keep it until it is refreshed.
+        units - known topology {unit id: "XAP800" or "XAP400"}, skips the
+        SERECHO probing at connect (see XAPX00.connect).
+        transport - XAPX00.Transport to use instead of opening serial_path.
+        threaded - run the link through the XAPX00 I/O worker so it may be
+        used from several threads. Restored units are then revalidated in
+        the background and the mirror re-reads a matrix after a preset
+        recall (see startBackground); without it call revalidate and
+        refreshStale when convenient.
+        """
         self.mqtt_path = mqtt_path
+        self.eager = eager
+        self.attribute_max_age = attribute_max_age
         self.baudrate = baudrate
         self.ramptime = ramptime
         self.autoramp = autoramp
         self.serial_path = serial_path
+        self.snapshot_file = snapshot_file
         self.units = {}
+        self.expansion_bus = None
+        self.restored_units = []
+        self.revalidation = None
+        self.threaded = threaded
+        self.stale_units = set()  # units whose matrix changed by a preset recall
+        self._snapshot = self.loadSnapshot(snapshot_file) if snapshot_file else {}
         print("Preparing XAP devices to be interrogated")
-        self.comms = XAPX00.XAPX00(comPort=serial_path, baudRate=38400, XAPType=device_type)
+        self.comms = XAPX00.XAPX00(comPort=serial_path, baudRate=38400, XAPType=device_type,
+                                    units=units, transport=transport, threaded=1 if threaded else 0)
         self.comms.convertDb = 0
         self.comms.connect()
         self.scanDevices()
         print("Scanning Expansion Bus and allocating channels...")
         self.expansion_bus = ExpansionBusManager(self)
         print("  ExBus Status: " + self.expansion_bus.statusReport())
+        if self.restored_units and threaded:
+            self.revalidation = self.startBackground(self.revalidate, "xapman revalidation")
+        elif snapshot_file:
+            self.saveSnapshot()
+
+    def startBackground(self, target, name):
+        """Run target on a thread of its own at bulk priority. Needs a
+        threaded connection, so its commands and those of the caller are
+        queued to the I/O worker instead of interleaving on the port.
+        """
+        if not self.threaded:
+            raise Exception("Background work needs connect(threaded=True)")
+
+        def run():
+            with self.comms.priority(XAPX00.PRIORITY_BULK):
+                target()
+        thread = threading.Thread(target=run, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def startMirror(self):
+        """Keep the unit objects in step with changes made on the units
+        themselves (front panel, presets, other controllers) by listening
+        for the reports they send.
+        A preset recall invalidates the unit's channels; its matrix is
+        re-read in the background on a threaded connection, otherwise the
+        unit is added to stale_units for refreshStale.
+        """
+        self.comms.addEventListener(self.applyEvent)
+        self.comms.startListener()
+
+    def stopMirror(self):
+        self.comms.stopListener()
+        self.comms.removeEventListener(self.applyEvent)
+
+    def applyEvent(self, event):
+        """Apply an unsolicited report from XAPX00 to the unit objects"""
+        unit = self.units.get(event['unitCode'])
+        if unit is None or unit.output_channels is None:
+            return
+        command = event['command']
+        args = event['args']
+        if command == "PRESET":
+            for channel in list(unit.output_channels.values()) + list(unit.input_channels.values()):
+                channel.invalidate()
+            if self.threaded:
+                self.startBackground(unit.refreshMatrix, "xapman preset refresh")
+            else:
+                self.stale_units.add(unit)
+            return
+        if command in ("MTRX", "MTRXLVL"):
+            if len(args) < 5:
+                return
+            link = unit.matrix.get(channelKey(args[0]), {}).get(channelKey(args[2]))
+            if link is None:
+                return
+            if command == "MTRX":
+                link.state = args[4]
+                link.enabled = link.state != "0"
+            else:
+                level = event['values'][0]
+                link.attenuation = XAPX00.db2linear(level) if self.comms.convertDb else level
+            return
+        if len(args) < 3:
+            return
+        channel = channelKey(args[0])
+        group = args[1].upper()
+        channels = []
+        if group in ("I", "M", "L", "P", "E"):
+            channels.append(unit.input_channels.get(channel))
+        if group in ("O", "P", "E"):
+            channels.append(unit.output_channels.get(channel))
+        for target in channels:
+            if target is None:
+                continue
+            if command == "MUTE":
+                target.mute = int(args[2])
+            elif command == "GAIN":
+                level = event['values'][0]
+                target.gain = XAPX00.db2linear(level) if self.comms.convertDb else level
+            if command in event_attributes:
+                target.invalidate(*event_attributes[command])
 
     def scanDevices(self):
         """Scan for XAP units"""
         self.units = {}
         print("Scanning for devices...")
-        delay = self.comms._maxrespdelay
-        self.comms._maxrespdelay = 0.1  # reduce timeout delay when searching for non-existant devices
-        for u in range(8):
-            uid = self.comms.getUniqueId(u)
-            if uid != None:
-                unit = {'id': str(u), 'UID':uid, 'version':self.comms.getVersion(u), "type": self.comms.getUnitType(u)}
+        for u in sorted(self.comms.units):  # the units that answered the connect probes
+            identity = self.comms.getIdentity(u)
+            if identity is not None:
+                uid = identity['UID']
+                unit = {'id': str(u), 'UID': uid, 'version': identity['version'], "type": identity['type']}
                 print("Found " + unit['type'] + " at ID " + unit['id'] + " - " + unit['UID'] + "  Ver. " + unit['version'] )
-                self.units[u] = XapUnit(self, XAP_unit=u)
+                saved = self._snapshot.get(uid)
+                if saved and saved['FW_version'] == unit['version'] and saved['device_type'] == unit['type']:
+                    print("  Restoring from snapshot")
+                    self.units[u] = XapUnit(self, XAP_unit=u, state=saved)
+                    self.restored_units.append(self.units[u])
+                else:
+                    self.units[u] = XapUnit(self, XAP_unit=u)
         print("Found " + str(len(self.units)) + " units.")
-        self.comms._maxrespdelay = delay
+        return self.units
+
+    def loadSnapshot(self, path):
+        """Read a state snapshot, returns {UID: unit state}"""
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return {}
+        return snapshot['units']
+
+    def saveSnapshot(self, path=None):
+        """Write the state of all units to a snapshot file"""
+        path = path or self.snapshot_file
+        snapshot = {'version': SNAPSHOT_VERSION,
+                    'units': dict((unit.serial_number, unit.exportState()) for unit in self.units.values())}
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(path + ".tmp", path)
+
+    def revalidate(self, units=None):
+        """Re-read units restored from a snapshot and save a fresh snapshot"""
+        for unit in units or self.restored_units:
+            unit.refreshAll()
+        self.expansion_bus.refreshData()
+        self.restored_units = []
+        if self.snapshot_file:
+            self.saveSnapshot()
+
+    def refreshStale(self):
+        """Re-read the matrices of units that recalled a preset"""
+        while self.stale_units:
+            self.stale_units.pop().refreshMatrix()
+
+    def rediscover(self):
+        """Probe the link for units again and rebuild them, for when units
+        were added, swapped or renumbered since connecting"""
+        self.comms.rediscoverUnits()
+        self.scanDevices()
+        self.expansion_bus = ExpansionBusManager(self)
         return self.units
 
     def addChannelRoute(self, source, dest):
@@ -284,7 +457,6 @@ class connect(object):
                     raise NoExpansionBusAvailable("There is no Expansion Bus Channels Available")
             source.unit.matrix[source.channel][usable_bus].linkChannels()
             dest.unit.matrix[usable_bus][dest.channel].linkChannels()
-            self.expansion_bus.getChannelUsage(usable_bus)
             return "Linked Input: " + str(source.channel) + " to Output: " + str(dest.channel) + " Via ExBus: " + str(usable_bus)
 
 
@@ -295,14 +467,103 @@ class connect(object):
             return "UnLinked Input: " + str(source.channel) + " to Output: " + str(dest.channel)
         else:
             released = ""
-            exBus = source.getExBus()
+            shared = [bus for bus in source.getExBus() if bus in dest.getExBus()]
+            if not shared:
+                return "Input: " + str(source.channel) + " is not routed to Output: " + str(dest.channel)
+            exBus = shared[0]
             if self.expansion_bus.getChannelUsage(exBus)['output'] <= 1:
                 source.unit.matrix[source.channel][exBus].unlinkChannels()
                 released = " Released ExBus: " + str(exBus)
             dest.unit.matrix[exBus][dest.channel].unlinkChannels()
-            self.expansion_bus.getChannelUsage(exBus)
             return "UnLinked Input: " + str(source.channel) + " to Output: " + str(dest.channel) + released
 
+    def planChannelRoutes(self, routes):
+        """Work out the expansion bus links for a complete set of routes.
+        routes - (InputChannel, OutputChannel) pairs. Routes across units
+        replace all current cross unit routing: every source gets one bus
+        shared by all its destinations, keeping the bus it already feeds
+        where possible. Routes within a unit are linked directly.
+        Returns:
+            dict with buses ({(unit id, source channel): bus}), link and
+            unlink (lists of MatrixLink to change)
+        Raises:
+            NoExpansionBusAvailable if there are more sources than buses
+        """
+        buses = [bus for bus in ExpansionBusManager.busChannels if bus in self.expansion_bus.busUsed]
+        wanted = {}  # (unit id, channel): set of OutputChannel
+        link = []
+        for source, dest in routes:
+            if source.unit.device_id == dest.unit.device_id:
+                direct = source.unit.matrix[source.channel][dest.channel]
+                if not direct.enabled and direct not in link:
+                    link.append(direct)
+                continue
+            wanted.setdefault((source.unit.device_id, source.channel), set()).add(dest)
+        if len(wanted) > len(buses):
+            raise NoExpansionBusAvailable("%d sources need a bus, %d Expansion Bus Channels" %
+                                          (len(wanted), len(buses)))
+        # current cross unit links: bus -> feeding links and fed links
+        feeds = dict((bus, []) for bus in buses)
+        fed = dict((bus, []) for bus in buses)
+        for unit in self.units.values():
+            for bus in buses:
+                for channel in channel_data[unit.device_type]:
+                    if channel_data[unit.device_type][channel]['itype'] == "Expansion":
+                        continue
+                    if unit.matrix[channel][bus] is not None and unit.matrix[channel][bus].enabled:
+                        feeds[bus].append(unit.matrix[channel][bus])
+                    if unit.matrix[bus][channel] is not None and unit.matrix[bus][channel].enabled:
+                        fed[bus].append(unit.matrix[bus][channel])
+        # keep a bus fed only by the same source, most destinations in common first
+        assigned = {}
+        candidates = []
+        for bus in buses:
+            sources = set((l.source.unit.device_id, l.source.channel) for l in feeds[bus])
+            if len(sources) == 1 and list(sources)[0] in wanted:
+                source = list(sources)[0]
+                common = len(set(l.dest for l in fed[bus]) & wanted[source])
+                candidates.append((-common, bus, source))
+        for common, bus, source in sorted(candidates):
+            if source not in assigned and bus not in assigned.values():
+                assigned[source] = bus
+        free = [bus for bus in buses if bus not in assigned.values()]
+        free.sort(key=lambda bus: len(feeds[bus]) + len(fed[bus]))  # idle buses first
+        for source in sorted(wanted, key=str):
+            if source not in assigned:
+                assigned[source] = free.pop(0)
+        # diff against the current links
+        keep = set()
+        for source, dests in wanted.items():
+            bus = assigned[source]
+            keep.add(self.units[source[0]].matrix[source[1]][bus])
+            for dest in dests:
+                keep.add(dest.unit.matrix[bus][dest.channel])
+        unlink = [l for bus in buses for l in feeds[bus] + fed[bus] if l not in keep]
+        link += [l for l in keep if not l.enabled]
+        return {"buses": assigned, "link": link, "unlink": unlink}
+
+    def setChannelRoutes(self, routes):
+        """Apply a complete set of routes (see planChannelRoutes) changing
+        only the links that differ, as one pipelined batch.
+        Returns:
+            the plan that was applied
+        """
+        plan = self.planChannelRoutes(routes)
+        applyChanges(self.comms, [l.change("0") for l in plan['unlink']] +
+                                 [l.change(l.linkState()) for l in plan['link']])
+        return plan
+
+    def reconcile(self, desired):
+        """Bring several units to a desired state in one pipelined batch.
+        desired - {unit id: state}, see XapUnit.planState
+        Returns:
+            the changes that were sent
+        """
+        changes = []
+        for unitId, state in desired.items():
+            changes += self.units[int(unitId)].planState(state)
+        return applyChanges(self.comms, changes)
+
 
 class XapUnit(object):
     """Xap Unit Wrapper
@@ -313,11 +574,12 @@ class XapUnit(object):
         return "Unit: " + self.device_type + " (ID " + str(self.device_id) + ")"
 
     def __init__(self, xap_connection,
-                 XAP_unit=0):
+                 XAP_unit=0, state=None):
+        """state - unit state from exportState to restore instead of scanning"""
         self.connection = xap_connection
         self.comms = xap_connection.comms
         self.device_id = XAP_unit
-        self.device_type = xap_connection.comms.getUnitType(XAP_unit)
+        self.device_type = xap_connection.comms.getIdentity(XAP_unit)['type']
         self.serial_number = None
         self.FW_version = None
         self.DSP_version = None
@@ -334,11 +596,140 @@ class XapUnit(object):
         self.processing_channels = None
         self.expansion_busses = None
         self.matrix = None
+        if state is not None:
+            self.importState(state)
+            return
         self.refreshData()
         self.scanOutputChannels()
         self.scanInputChannels()
         self.scanMatrix()
 
+    stateAttributes = ("serial_number", "FW_version", "DSP_version", "label", "modem_mode", "modem_pass",
+                       "modem_init_string", "safety_mute", "panel_timeout", "panel_lockout")
+
+    def exportState(self):
+        """Return the unit, channel and matrix state as plain data"""
+        state = dict((attr, getattr(self, attr)) for attr in self.stateAttributes)
+        state['device_type'] = self.device_type
+        state['outputs'] = dict((str(c), ch.exportState()) for c, ch in self.output_channels.items())
+        state['inputs'] = dict((str(c), ch.exportState()) for c, ch in self.input_channels.items())
+        state['matrix'] = [[str(i), str(o), link.state, link.attenuation] for i, o, link in self.matrix.links()]
+        return state
+
+    def importState(self, state):
+        """Restore the unit from exportState data without querying it"""
+        for attr in self.stateAttributes:
+            setattr(self, attr, state.get(attr))
+        channels = dict((str(c), c) for c in channel_data[self.device_type])
+        self.output_channels = {}
+        for channel in channel_data[self.device_type]:
+            self.output_channels[channel] = OutputChannel(self, channel=channel,
+                                                          state=state['outputs'].get(str(channel)))
+        self.input_channels = {}
+        for channel in channel_data[self.device_type]:
+            self.input_channels[channel] = InputChannel(self, channel=channel,
+                                                        state=state['inputs'].get(str(channel)))
+        self.matrix = UnitMatrix(self)
+        for inChannel, outChannel, status, attenuation in state['matrix']:
+            self.matrix.setLink(channels[inChannel], channels[outChannel], state=status, attenuation=attenuation)
+
+    def planState(self, desired):
+        """Work out the commands that bring the unit to a desired state.
+        desired - exportState shaped data, only what is given is checked:
+            outputs/inputs {channel: {attribute: value}}, inputs may have
+            filters {node: Filter.exportState()}, matrix is a list of
+            [input, output, state] or [input, output, state, attenuation].
+        Values already known to the model are not sent again. Mutes being
+        switched on go first and mutes being switched off go last, so the
+        room stays quiet while it is reconfigured.
+        Returns:
+            applyChanges list of (unitCode, command, args, update)
+        """
+        muting, settings, routing, unmuting = [], [], [], []
+        for direction, channels, inout in (("outputs", self.output_channels, 0),
+                                           ("inputs", self.input_channels, 1)):
+            for key, wanted in desired.get(direction, {}).items():
+                channel = channels[channelKey(str(key))]
+                loaded = channel.__dict__.get('_loaded', {})
+                for attr, value in wanted.items():
+                    if attr == "filters" or attr not in reconcile_commands:
+                        continue
+                    if attr in loaded and sameValue(channel.__dict__.get(attr), value):
+                        continue
+                    if channel.group == "E" and attr != "label":
+                        continue  # only labels apply to the expansion bus
+                    command, grouped = reconcile_commands[attr]
+                    args = [channel.channel, channel.group] if grouped else [channel.channel]
+                    if channel.group == "E":
+                        args.append(inout)  # expansion bus labels are per direction
+                    args.append(wireValue(value))
+                    if command == "GAIN":
+                        args.append("A")
+                    change = (self.device_id, command, args, partial(setattr, channel, attr, value))
+                    if attr == "mute":
+                        (muting if value else unmuting).append(change)
+                    else:
+                        settings.append(change)
+                if wanted.get("filters") and direction == "inputs":
+                    settings += self._planFilters(channel, wanted["filters"])
+        for entry in desired.get("matrix", []):
+            link = self.matrix[channelKey(str(entry[0]))][channelKey(str(entry[1]))]
+            if link is None:
+                continue
+            if str(link.state) != str(entry[2]):
+                routing.append(link.change(entry[2]))
+            if len(entry) > 3 and entry[3] is not None and not sameValue(link.attenuation, entry[3]):
+                routing.append((self.device_id, "MTRXLVL",
+                                (link.source.channel, link.source.group, link.dest.channel,
+                                 link.dest.group, entry[3], "A"),
+                                partial(setattr, link, "attenuation", entry[3])))
+        return muting + settings + routing + unmuting
+
+    def _planFilters(self, channel, filters):
+        """planState changes for the filter nodes of an input channel"""
+        current = channel.__dict__.get('filters') if 'filters' in channel.__dict__.get('_loaded', {}) else None
+        changes = []
+        for node, wanted in filters.items():
+            node = int(node)
+            filter = current.get(node) if current else None
+            if filter is not None and all(sameValue(getattr(filter, k), wanted.get(k))
+                                          for k in ("type", "frequency", "gain", "bandwidth")):
+                continue
+            args = [channel.channel, channel.group, node] + \
+                   [wanted.get(k) or 0 for k in ("type", "frequency", "gain", "bandwidth")]
+            update = (partial(filter.importState, dict(filter.exportState(), **wanted))
+                      if filter is not None else (lambda: None))
+            changes.append((self.device_id, "FILTER", args, update))
+        return changes
+
+    def reconcile(self, desired):
+        """Bring the unit to a desired state (see planState) sending only
+        what differs, as one pipelined batch.
+        Returns:
+            the changes that were sent
+        """
+        return applyChanges(self.comms, self.planState(desired))
+
+    def refreshAll(self):
+        """Re-read unit, channel and matrix state from the unit"""
+        self.refreshData()
+        for channel in self.output_channels.values():
+            channel.refreshData()
+        for channel in self.input_channels.values():
+            channel.refreshData()
+        self.refreshMatrix()
+
+    def refreshMatrix(self):
+        """Update the existing MatrixLinks from a matrix snapshot"""
+        routing, levels = self.comms.getMatrixSnapshot(unitCode=self.device_id)
+        geo = dict((x['c'], i) for i, x in enumerate(XAPX00.matrixGeo[self.device_type]))
+        for inChannel, outChannel, link in self.matrix.links():
+            y = geo[inChannel]
+            x = geo[outChannel]
+            link.state = routing[y][x]
+            link.enabled = link.state != "0"
+            link.attenuation = levels[y][x]
+
     def refreshData(self):
         """Fetch all data XAP Unit"""
         self.getID()
@@ -355,26 +746,23 @@ class XapUnit(object):
         return True
 
     def clearMatrix(self):
-        for inChannel, row in self.matrix.items():
-            for outChannel, object in row.items():
-
-                if (channel_data[self.device_type][outChannel]['otype'] == "Expansion" or channel_data[self.device_type][outChannel]['otype'] == "Processing") and inChannel == outChannel:
-                    continue
-                else:
-                    if object.state != 0:
-                        object.unlinkChannels()
+        for inChannel, outChannel, link in self.matrix.links():
+            if link.state != "0":
+                link.unlinkChannels()
         return
 
     def scanMatrix(self):
         print("  Scanning Matrix Status...")
-        self.matrix = deepcopy(matrix[self.device_type])
-        for inChannel, row in self.matrix.items():
-            for outChannel, object in row.items():
+        self.matrix = UnitMatrix(self)
+        routing, levels = self.comms.getMatrixSnapshot(unitCode=self.device_id)
+        geo = dict((x['c'], i) for i, x in enumerate(XAPX00.matrixGeo[self.device_type]))
+        for inChannel in self.matrix.channels:
+            for outChannel in self.matrix.channels:
                 if inChannel == outChannel and channel_data[self.device_type][outChannel]['otype'] != "Output":
                     continue
-                else:
-                    self.matrix[inChannel][outChannel] = MatrixLink(self.connection, self.input_channels[inChannel],
-                                                                    self.output_channels[outChannel])
+                y = geo[inChannel]
+                x = geo[outChannel]
+                self.matrix.setLink(inChannel, outChannel, state=routing[y][x], attenuation=levels[y][x])
         return
 
     def scanOutputChannels(self):
@@ -399,8 +787,8 @@ class XapUnit(object):
         return uid
         
     def getFW(self):
-        """Fetch FW Version from XAP Unit"""
-        FW = self.comms.getVersion(unitCode=self.device_id)
+        """FW Version of the XAP Unit, from the connection's identity registry"""
+        FW = self.comms.getIdentity(self.device_id)['version']
         self.FW_version = FW
         return FW
         
@@ -411,8 +799,8 @@ class XapUnit(object):
         return DSP
         
     def getSerialNumber(self):
-        """Fetch Unique ID from XAP Unit"""
-        serial = self.comms.getUniqueId(unitCode=self.device_id)
+        """Unique ID of the XAP Unit, from the connection's identity registry"""
+        serial = self.comms.getIdentity(self.device_id)['UID']
         self.serial_number = serial
         return serial
         
@@ -502,29 +890,52 @@ class XapUnit(object):
 
 
 class OutputChannel(object):
-    """XAP Output Channel Wrapper"""
+    """XAP Output Channel Wrapper
+    Channel parameters are read from the unit when first used, see LazyAttribute
+    """
+    gain = LazyAttribute("getGain")
+    prop_gain = LazyAttribute("getProportionalGain")
+    gain_min = LazyAttribute("getMinGain")
+    gain_max = LazyAttribute("getMaxGain")
+    mute = LazyAttribute("getMute")
+    label = LazyAttribute("getLabel")
 
     def __repr__(self):
-        return "Output: " + str(self.unit.device_id) + ":" + str(self.channel) + " | " + self.label
+        return "Output: " + str(self.unit.device_id) + ":" + str(self.channel) + " | " + str(self.__dict__.get("label"))
 
-    def __init__(self, unit, channel):
+    def __init__(self, unit, channel, state=None):
         self.unit = unit
         self.connection = unit.connection
         self.comms = unit.comms
         self.channel = channel
         self.group = channel_data[unit.device_type][channel]['og']
         self.type = channel_data[unit.device_type][channel]['otype']
-        self.gain = None  #
-        self.prop_gain = None  #
-        self.gain_min = None  #
-        self.gain_max = None  #
-        self.mute = None  #
-        self.label = None  #
         self.sources = None
         self.filters = None
         self.exBus = None
         self.constant_gain = None # Also known as Number of Mics (NOM)
-        self.refreshData()
+        if state is not None:
+            self.importState(state)
+        elif self.connection.eager:
+            self.refreshData()
+
+    stateAttributes = ("gain", "prop_gain", "gain_min", "gain_max", "mute", "label", "constant_gain")
+
+    def exportState(self):
+        """Return the channel state read so far as plain data"""
+        return dict((attr, self.__dict__.get(attr)) for attr in self.stateAttributes)
+
+    def importState(self, state):
+        """Restore the channel from exportState data without querying it"""
+        for attr in self.stateAttributes:
+            if state.get(attr) is not None:
+                setattr(self, attr, state[attr])
+
+    def invalidate(self, *attributes):
+        """Forget cached parameters (all if none given) so they are read again"""
+        loaded = self.__dict__.get('_loaded', {})
+        for attr in attributes or list(loaded):
+            loaded.pop(attr, None)
 
     def refreshData(self):
         """Fetch all data Channel Data"""
@@ -631,64 +1042,106 @@ class OutputChannel(object):
         return gain
 
     def getExBus(self):
-        exBus = []
-        for channel, data in channel_data[self.unit.device_type].items():
-            if data['otype'] == "Expansion":
-                if self.unit.matrix[channel][self.channel] is not None:
-                    if self.unit.matrix[channel][self.channel].enabled:
-                        exBus.append(channel)
+        exBus = [channel for channel in self.unit.matrix.routesInto(self.channel)
+                 if channel_data[self.unit.device_type][channel]['otype'] == "Expansion"]
         self.exBus = exBus
         return exBus
 
 
 class InputChannel(object):
-    """XAP Input Channel Wrapper"""
+    """XAP Input Channel Wrapper
+    Channel parameters are read from the unit when first used, see LazyAttribute
+    """
+    gain = LazyAttribute("getGain")
+    prop_gain = LazyAttribute("getProportionalGain")
+    gain_min = LazyAttribute("getMinGain")
+    gain_max = LazyAttribute("getMaxGain")
+    mute = LazyAttribute("getMute")
+    label = LazyAttribute("getLabel")
+    AGC = LazyAttribute("getAGC")  # True or False - Automatic Gain Control
+    AGC_target = LazyAttribute("getAGCLevels")  # -30 to 20dB
+    AGC_threshold = LazyAttribute("getAGCLevels")  # -50 to 0dB
+    AGC_attack = LazyAttribute("getAGCLevels")  # 0.1 to 10.0s in .1 increments
+    AGC_gain = LazyAttribute("getAGCLevels")  # 0.0 to 18.0dB
+    filters = LazyAttribute("getFilters")
+
+    # Microphone Input Only
+    phantom_power = LazyAttribute("getPhantomPower")
+    NC = LazyAttribute("getNoiseCancellation")  # True or False - Noise Cancellation
+    NC_depth = LazyAttribute("getNoiseCancellationDepth")  # 6 to 15dB
+    AEC = LazyAttribute("getAutoEchoCanceller")  # True or False - Acoutstic Echo Canceller
+    AEC_PA_reference = LazyAttribute("getReferenceChannel")  # None or OutputChannel
+    NLP = LazyAttribute("getNLP")  # False = Off, Soft, Medium, Aggresive - Non-Linear Processing
+    adaptive_ambient = LazyAttribute("getAdaptiveAmbient")  # True or False
+    ambient_level = LazyAttribute("getAmbientLevel")  # -80.0 to 0.0dB
+    PA_adaptive = LazyAttribute("getPAAdaptive")  # True or False
+    gating = LazyAttribute("getGateMode")  # False, Manual On, Manual Off
+    gate_holdtime = LazyAttribute("getGateHoldTime")  # 0.10 - 8.00s
+    gate_override = LazyAttribute("getGateOverride")  # True or False
+    gate_ratio = LazyAttribute("getGateRatio")  # 0-50dB
+    gate_group = LazyAttribute("getGateGroup")  # 1-4 and A-D (gate group)
+    gate_chairman = LazyAttribute("getChairmanOverride")  # True or False
+    gate_decay = LazyAttribute("getGateDecay")  # Slow, Medium, Fast
+    gain_coarse = LazyAttribute("getCoarseGain")
+    gate_attenuation = LazyAttribute("getGateAttenuation")  # 0-60dB
 
     def __repr__(self):
-        return "Input: " + str(self.unit.device_id) + ":" + str(self.channel) + " | " + self.label
+        return "Input: " + str(self.unit.device_id) + ":" + str(self.channel) + " | " + str(self.__dict__.get("label"))
 
-    def __init__(self, unit, channel):
+    def __init__(self, unit, channel, state=None):
         self.unit = unit
         self.connection = unit.connection
         self.comms = unit.comms
         self.channel = channel
         self.group = channel_data[unit.device_type][channel]['ig']
         self.type = channel_data[unit.device_type][channel]['itype']
-        self.gain = None
-        self.gain_min = None
-        self.gain_max = None
-        self.mute = None
-        self.label = None
         self.mic = None
         self.exBus = None
-        self.AGC = None  # True or False - Automatic Gain Control
-        self.AGC_target = None  # -30 to 20dB
-        self.AGC_threshold = None  # -50 to 0dB
-        self.AGC_attack = None  # 0.1 to 10.0s in .1 increments
-        self.AGC_gain = None  # 0.0 to 18.0dB
-        self.filters = deepcopy(filter_data[self.type])
 
-    # Microphone Input Only
-        self.phantom_power = None
-        self.NC = None  # True or False - Noise Cancellation
-        self.NC_depth = None  # 6 to 15dB
-        self.AEC = None  # True or False - Acoutstic Echo Canceller
-        self.AEC_PA_reference = None  # None or OutputChannel
-        self.NLP = None  # False = Off, Soft, Medium, Aggresive - Non-Linear Processing
-        self.adaptive_ambient = None  # True or False
-        self.ambient_level = None  # -80.0 to 0.0dB
-        self.PA_adaptive = None  # True or False
-        self.gating = None  # False, Manual On, Manual Off
-        self.gate_holdtime = None  # 0.10 - 8.00s
-        self.gate_override = None  # True or False
-        self.gate_ratio = None  # 0-50dB
-        self.gate_group = None  # 1-4 and A-D (gate group)
-        self.gate_chairman = None  # True or False
-        self.gate_decay = None  # Slow, Medium, Fast
-        self.gain_coarse = None
-        self.gate_attenuation = None  # 0-60dB
+        if state is not None:
+            self.importState(state)
+        elif self.connection.eager:
+            self.refreshData()
+
+    stateAttributes = ("gain", "prop_gain", "gain_min", "gain_max", "mute", "label", "AGC", "AGC_target",
+                       "AGC_threshold", "AGC_attack", "AGC_gain", "phantom_power", "NC", "NC_depth", "AEC",
+                       "NLP", "adaptive_ambient", "ambient_level", "PA_adaptive", "gating", "gate_holdtime",
+                       "gate_override", "gate_ratio", "gate_group", "gate_chairman", "gate_decay",
+                       "gain_coarse", "gate_attenuation")
+
+    def exportState(self):
+        """Return the channel and filter state read so far as plain data"""
+        state = dict((attr, self.__dict__.get(attr)) for attr in self.stateAttributes)
+        reference = self.__dict__.get('AEC_PA_reference')
+        if reference is not None:
+            state['AEC_PA_reference'] = str(reference.channel)
+        filters = self.__dict__.get('filters')
+        if filters:
+            state['filters'] = dict((str(node), filter.exportState()) for node, filter in filters.items()
+                                    if filter is not None)
+        return state
 
-        self.refreshData()
+    def importState(self, state):
+        """Restore the channel from exportState data without querying it"""
+        for attr in self.stateAttributes:
+            if state.get(attr) is not None:
+                setattr(self, attr, state[attr])
+        reference = state.get('AEC_PA_reference')
+        if reference is not None:
+            for channel, output in self.unit.output_channels.items():
+                if str(channel) == reference:
+                    self.AEC_PA_reference = output
+        if state.get('filters') and filter_data[self.type]:
+            filters = deepcopy(filter_data[self.type])
+            for node in filters:
+                filters[node] = Filter(self.unit, self, node, state=state['filters'].get(str(node)))
+            self.filters = filters
+
+    def invalidate(self, *attributes):
+        """Forget cached parameters (all if none given) so they are read again"""
+        loaded = self.__dict__.get('_loaded', {})
+        for attr in attributes or list(loaded):
+            loaded.pop(attr, None)
 
     def refreshData(self):
         """Fetch all data Channel Data"""
@@ -700,10 +1153,7 @@ class InputChannel(object):
         self.getGain()
         self.getAGC()
         self.getAGCLevels()
-        if self.filters:
-            for node, filter in self.filters.items():
-                self.filters[node] = Filter(self.unit, self, node)
-                self.filters[node].refreshData()
+        self.getFilters()
         if self.type == "Mic":
             self.getPhantomPower()
             self.getNoiseCancellation()
@@ -856,6 +1306,15 @@ class InputChannel(object):
         self.AGC_gain = AGC['gain']
         return AGC
 
+    def getFilters(self):
+        """Fetch all filter nodes for Channel"""
+        filters = deepcopy(filter_data[self.type])
+        if filters:
+            for node in filters:
+                filters[node] = Filter(self.unit, self, node)
+        self.filters = filters
+        return filters
+
     def getPhantomPower(self):
         """Fetch Phantom Power for Channel"""
         if channel_data[self.unit.device_type][self.channel]['itype'] != "Mic":  # Only Mics are Compatible with this function
@@ -1176,18 +1635,130 @@ class InputChannel(object):
         return gate_attenuation
 
     def getExBus(self):
-        exBus = []
-        for channel, data in channel_data[self.unit.device_type].items():
-            if data['itype'] == "Expansion":
-                if self.unit.matrix[self.channel][channel] is not None:
-                    if self.unit.matrix[self.channel][channel].enabled:
-                        exBus.append(channel)
+        exBus = [channel for channel in self.unit.matrix.routesFrom(self.channel)
+                 if channel_data[self.unit.device_type][channel]['itype'] == "Expansion"]
         self.exBus = exBus
         return exBus
 
 
+class UnitMatrix(object):
+    """Routing matrix of a unit stored in flat arrays.
+    Crosspoints are indexed by channel ordinal (channel_data order), input
+    major. states holds the MTRX state (NO_LINK where there is no
+    crosspoint, UNKNOWN until read), enabled whether the crosspoint routes
+    audio and levels the MTRXLVL attenuation in dB (nan until read).
+    matrix[input][output] gives a MatrixLink view of a crosspoint, or None.
+    """
+    NO_LINK = -2
+    UNKNOWN = -1
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.channels = list(channel_data[unit.device_type])
+        self.ordinal = dict((channel, i) for i, channel in enumerate(self.channels))
+        self.size = len(self.channels)
+        cells = self.size * self.size
+        self.states = array('b', [UnitMatrix.NO_LINK]) * cells
+        self.enabled = array('b', [0]) * cells
+        self.levels = array('d', [float('nan')]) * cells
+        self.gated = set()  # crosspoints linked in gate mode, see MatrixLink.gatemode
+
+    def index(self, inChannel, outChannel):
+        return self.ordinal[inChannel] * self.size + self.ordinal[outChannel]
+
+    def setLink(self, inChannel, outChannel, state=None, attenuation=None):
+        """Create (or overwrite) a crosspoint, reading what is not given"""
+        i = self.index(inChannel, outChannel)
+        self.states[i] = UnitMatrix.UNKNOWN
+        link = self.link(inChannel, outChannel)
+        if state is None:
+            link.getStatus()
+        else:
+            link.state = state
+            link.enabled = link.state != "0"
+        if attenuation is None:
+            link.getAttenuation()
+        else:
+            link.attenuation = attenuation
+        return link
+
+    def link(self, inChannel, outChannel):
+        """MatrixLink view of a crosspoint, None if there is none"""
+        i = self.index(inChannel, outChannel)
+        if self.states[i] == UnitMatrix.NO_LINK:
+            return None
+        return MatrixLink(self, inChannel, outChannel)
+
+    def links(self):
+        """All (input, output, MatrixLink) crosspoints"""
+        for i, state in enumerate(self.states):
+            if state != UnitMatrix.NO_LINK:
+                inChannel = self.channels[i // self.size]
+                outChannel = self.channels[i % self.size]
+                yield inChannel, outChannel, MatrixLink(self, inChannel, outChannel)
+
+    def routesInto(self, outChannel):
+        """Input channels with an enabled crosspoint to outChannel"""
+        column = self.enabled[self.ordinal[outChannel]::self.size]
+        return [self.channels[i] for i, on in enumerate(column) if on]
+
+    def routesFrom(self, inChannel):
+        """Output channels inChannel has an enabled crosspoint to"""
+        start = self.ordinal[inChannel] * self.size
+        row = self.enabled[start:start + self.size]
+        return [self.channels[i] for i, on in enumerate(row) if on]
+
+    def __getitem__(self, inChannel):
+        if inChannel not in self.ordinal:
+            raise KeyError(inChannel)
+        return MatrixRow(self, inChannel)
+
+    def get(self, inChannel, default=None):
+        return MatrixRow(self, inChannel) if inChannel in self.ordinal else default
+
+    def keys(self):
+        return list(self.channels)
+
+    def values(self):
+        return [MatrixRow(self, channel) for channel in self.channels]
+
+    def items(self):
+        return [(channel, MatrixRow(self, channel)) for channel in self.channels]
+
+
+class MatrixRow(object):
+    """The crosspoints of one input channel, see UnitMatrix"""
+    __slots__ = ("matrix", "inChannel")
+
+    def __init__(self, matrix, inChannel):
+        self.matrix = matrix
+        self.inChannel = inChannel
+
+    def __getitem__(self, outChannel):
+        if outChannel not in self.matrix.ordinal:
+            raise KeyError(outChannel)
+        return self.matrix.link(self.inChannel, outChannel)
+
+    def get(self, outChannel, default=None):
+        if outChannel not in self.matrix.ordinal:
+            return default
+        return self.matrix.link(self.inChannel, outChannel)
+
+    def keys(self):
+        return list(self.matrix.channels)
+
+    def values(self):
+        return [self.matrix.link(self.inChannel, channel) for channel in self.matrix.channels]
+
+    def items(self):
+        return [(channel, self.matrix.link(self.inChannel, channel)) for channel in self.matrix.channels]
+
+
 class MatrixLink(object):
-    """XAP Matrix Link Manager"""
+    """XAP Matrix Link Manager
+    A view of one crosspoint of a UnitMatrix, the state lives in the matrix.
+    """
+    __slots__ = ("matrix", "cell", "source", "dest")
 
     def __repr__(self):
         if self.state == "0":
@@ -1199,17 +1770,74 @@ class MatrixLink(object):
         elif self.state == "4":
             return "Matrix: GATED-ON"
 
-    def __init__(self, connection, source, dest, gatemode=False):
-        self.connection = connection
-        self.comms = connection.comms
-        self.source = source
-        self.dest = dest
-        self.gatemode = gatemode
-        self.state = None
-        self.attenuation = None
-        self.enabled = False
-        self.getStatus()
-        self.getAttenuation()
+    def __init__(self, matrix, inChannel, outChannel):
+        self.matrix = matrix
+        self.cell = matrix.index(inChannel, outChannel)
+        self.source = matrix.unit.input_channels[inChannel]
+        self.dest = matrix.unit.output_channels[outChannel]
+
+    def __eq__(self, other):
+        return isinstance(other, MatrixLink) and other.matrix is self.matrix and other.cell == self.cell
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.matrix), self.cell))
+
+    @property
+    def connection(self):
+        return self.matrix.unit.connection
+
+    @property
+    def comms(self):
+        return self.matrix.unit.comms
+
+    @property
+    def state(self):
+        state = self.matrix.states[self.cell]
+        return None if state < 0 else str(state)
+
+    @state.setter
+    def state(self, state):
+        self.matrix.states[self.cell] = UnitMatrix.UNKNOWN if state is None else int(state)
+
+    @property
+    def attenuation(self):
+        level = self.matrix.levels[self.cell]
+        return None if math.isnan(level) else level
+
+    @attenuation.setter
+    def attenuation(self, level):
+        try:
+            self.matrix.levels[self.cell] = float(level)
+        except (TypeError, ValueError):
+            self.matrix.levels[self.cell] = float('nan')
+
+    @property
+    def gatemode(self):
+        return self.cell in self.matrix.gated
+
+    @gatemode.setter
+    def gatemode(self, gatemode):
+        if gatemode:
+            self.matrix.gated.add(self.cell)
+        else:
+            self.matrix.gated.discard(self.cell)
+
+    @property
+    def enabled(self):
+        return bool(self.matrix.enabled[self.cell])
+
+    @enabled.setter
+    def enabled(self, enabled):
+        """Keeps the ExpansionBusManager usage index up to date"""
+        enabled = bool(enabled)
+        if enabled == self.enabled:
+            return
+        self.matrix.enabled[self.cell] = enabled
+        if self.connection.expansion_bus is not None:
+            self.connection.expansion_bus.linkChanged(self)
 
     def getStatus(self):
         state = self.comms.getMatrixRouting(inChannel=self.source.channel, inGroup=self.source.group,
@@ -1230,7 +1858,7 @@ class MatrixLink(object):
         return
 
     def setAttenuation(self, level):
-        attn = self.comms.getMatrixLevel(inChannel=self.source.channel, inGroup=self.source.group,
+        attn = self.comms.setMatrixLevel(inChannel=self.source.channel, inGroup=self.source.group,
                                          outChannel=self.dest.channel, outGroup=self.dest.group,
                                          unitCode=self.dest.unit.device_id, level=level)
         self.attenuation = attn
@@ -1241,46 +1869,49 @@ class MatrixLink(object):
             print("Cannot directly link channels across different units. Use another method.")
             return None
         else:
-            if self.gatemode == False:
-                if self.source.type == "Mic":
-                    self.state = "3"  # Gate Off
-                else:
-                    self.state = "1"
-            else:
-                if self.source.type == "Mic":
-                    self.state = "4"  # Gate On
-                else:
-                    self.state = "1"
+            self.state = self.linkState()
             route = self.comms.setMatrixRouting(inChannel=self.source.channel, inGroup=self.source.group,
                                                 outChannel=self.dest.channel, outGroup=self.dest.group,
                                                 state=self.state, unitCode=self.dest.unit.device_id)
             self.enabled = True
-        self.recalcuateExBusUsage()
         return route
 
+    def change(self, state):
+        """applyChanges entry setting the link to state"""
+        def update():
+            self.state = str(state)
+            self.enabled = self.state != "0"
+        return (self.dest.unit.device_id, "MTRX",
+                (self.source.channel, self.source.group, self.dest.channel, self.dest.group, state), update)
+
+    def linkState(self):
+        """MTRX state that links the channels"""
+        if self.source.type == "Mic":
+            if self.gatemode == False:
+                return "3"  # Gate Off
+            return "4"  # Gate On
+        return "1"
+
     def unlinkChannels(self):
         self.state = self.comms.setMatrixRouting(inChannel=self.source.channel, inGroup=self.source.group,
                                             outChannel=self.dest.channel, outGroup=self.dest.group,
                                             state="0", unitCode=self.dest.unit.device_id)
         self.enabled = False
-        if channel_data[self.source.unit.device_type][self.source.channel]['itype'] == "Expansion":
-            self.connection.expansion_bus.getChannelUsage(self.source.channel)
-        if channel_data[self.dest.unit.device_type][self.dest.channel]['otype'] == "Expansion":
-            self.connection.expansion_bus.getChannelUsage(self.dest.channel)
-        self.enabled = False
-        self.recalcuateExBusUsage()
         return self.state
 
     def recalcuateExBusUsage(self):
-        if self.source.type == "Expansion":
-            self.connection.expansion_bus.getChannelUsage(self.source.channel)
-        if self.dest.type == "Expansion":
-            self.connection.expansion_bus.getChannelUsage(self.dest.channel)
+        """Kept for compatibility, the usage index follows enabled changes"""
         return
 
 
 class ExpansionBusManager(object):
-        """XAP Bus Wide Expansion Channel Manager"""
+        """XAP Bus Wide Expansion Channel Manager
+        Keeps an index of how many enabled matrix links feed each bus
+        (input) and are fed by it (output) across all units. MatrixLink
+        reports every change of its enabled state, so lookups and updates
+        do not rescan the matrices.
+        """
+        busChannels = ("O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y", "Z")
 
         def __repr__(self):
             return "ExpansionBusAllocator: " + self.statusReport()
@@ -1295,51 +1926,63 @@ class ExpansionBusManager(object):
                 self.reserved_channels = reserved_channels
                 for channel in self.reserved_channels:
                     self.busUsed.pop(channel, None)
-            for channel, status in self.busUsed.items():
-                if channel not in self.reserved_channels:
-                    if self.getChannelUsage(channel)['inUse']:
-                        self.busUsed[channel] = True
-                    else:
-                        self.busUsed[channel] = False
+            self.refreshData()
 
         def statusReport(self):
-            inUse = 0
-            available = 0
+            inUse = self._inUse
+            available = len(self.busUsed) - inUse
             reserved = len(self.reserved_channels)
-            for channel, status in self.busUsed.items():
-                if status == False:
-                    available += 1
-                elif status == True:
-                    inUse += 1
             return "Available: " + str(available) + " InUse: " + str(inUse) + " Reserved: " + str(reserved)
 
         def refreshData(self):
-            for channel, status in self.busUsed.items():
-                self.getChannelUsage(channel)
+            """Rebuild the usage index from the matrices of all units"""
+            self.usage = dict((channel, {"input": 0, "output": 0}) for channel in ExpansionBusManager.busChannels)
+            for channel in self.busUsed:
+                self.busUsed[channel] = False
+            self._inUse = 0
+            self._free = set(self.busUsed)
+            for id, unit in self.units.items():
+                for bus in ExpansionBusManager.busChannels:
+                    for channel in unit.matrix.routesInto(bus):
+                        self.linkChanged(unit.matrix[channel][bus])
+                    for channel in unit.matrix.routesFrom(bus):
+                        if channel_data[unit.device_type][channel]['itype'] != "Expansion":
+                            self.linkChanged(unit.matrix[bus][channel])
+
+        def linkChanged(self, link):
+            """Count a MatrixLink that was enabled or disabled"""
+            delta = 1 if link.enabled else -1
+            if link.source.channel == link.dest.channel:
+                return
+            if link.dest.type == "Expansion":
+                self._count(link.dest.channel, "input", delta)
+            if link.source.type == "Expansion":
+                self._count(link.source.channel, "output", delta)
+
+        def _count(self, channel, direction, delta):
+            usage = self.usage[channel]
+            wasUsed = usage["input"] + usage["output"] > 0
+            usage[direction] += delta
+            inUse = usage["input"] + usage["output"] > 0
+            if channel in self.busUsed and inUse != wasUsed:
+                self.busUsed[channel] = inUse
+                if inUse:
+                    self._inUse += 1
+                    self._free.discard(channel)
+                else:
+                    self._inUse -= 1
+                    self._free.add(channel)
 
         def getChannelUsage(self, channel, OutputOnly=False):
-            inUse = False
-            output = 0
-            input = 0
-            for id, unit in self.units.items():
-                for y_channel, data in channel_data[unit.device_type].items():
-                    if y_channel == channel:
-                        continue
-                    if not OutputOnly:
-                        if unit.matrix[y_channel][channel].enabled:
-                            inUse = True
-                            input += 1
-                    if unit.matrix[channel][y_channel].enabled:
-                        inUse = True
-                        output  += 1
-            self.busUsed[channel] = inUse
-            return {'inUse':inUse, "input": input, "output": output}
+            usage = self.usage[channel]
+            input = 0 if OutputOnly else usage["input"]
+            output = usage["output"]
+            return {'inUse': input + output > 0, "input": input, "output": output}
 
         def requestExpChannel(self):
-            for channel, status in self.busUsed.items():
-                if status == False:
-                    return channel
-            return False
+            if not self._free:
+                return False
+            return min(self._free)  # lowest free bus, at most 12 to compare
 
 
 
@@ -1381,7 +2024,7 @@ class Filter(object):
     def __repr__(self):
         return "Filter: " + self.type_string + " | Node " + str(self.node)
 
-    def __init__(self, unit, channel, node):
+    def __init__(self, unit, channel, node, state=None):
         self.unit = unit
         self.connection = unit.connection
         self.comms = unit.comms
@@ -1393,11 +2036,31 @@ class Filter(object):
         self.gain = None
         self.bandwidth = None
         self.enabled = None
-        self.getFilter()
+        if state is not None:
+            self.importState(state)
+        else:
+            self.getFilter()
 
         self.Q = None
         self.phase = None
 
+    def refreshData(self):
+        """Fetch all data Filter Data"""
+        self.getFilter()
+        return True
+
+    def exportState(self):
+        """Return the filter settings as plain data"""
+        return {"type": self.type, "frequency": self.frequency, "gain": self.gain, "bandwidth": self.bandwidth}
+
+    def importState(self, state):
+        """Restore the filter from exportState data without querying it"""
+        self.type = state["type"]
+        self.type_string = filter_types[state["type"]]
+        self.frequency = state["frequency"]
+        self.gain = state["gain"]
+        self.bandwidth = state["bandwidth"]
+
     def getFilter(self):
         filter = self.comms.getFilter(self.channel.channel, self.channel.group, self.node, unitCode=self.unit.device_id)
         self.type = filter["type"]
@@ -0,0 +1,327 @@
+"""
+Software stand-in for a stack of ClearOne XAP800/XAP400 units.
+
+Speaks the serial protocol XAPX00 uses (#5<id> for XAP800, #7<id> for
+XAP400) over a pseudo terminal that serial.Serial can open, or over a TCP
+socket (open it with serial.serial_for_url("socket://host:port")).
+Received and sent bytes are paced to the configured baud rate and every
+command waits latency seconds before it is answered, so pipelining and
+scan speedups can be measured without hardware.
+
+    sim = XAPSimulator({0: "XAP800", 1: "XAP400"})
+    port = sim.startPty()
+    xap = XAPX00.XAPX00(comPort=port)
+
+or from a shell: python xapsim.py --units 0:XAP800,1:XAP800
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+import tty
+import queue
+
+import XAPX00
+
+# ERROR codes answered by the simulator, see XAPX00.errorDefs
+ERROR_UNKNOWN_COMMAND = 3
+ERROR_BAD_ADDRESS = 5
+
+unit_prefixes = {"XAP800": "5", "XAP400": "7"}
+
+# values reported for parameters that were never set
+default_values = {"GAIN": ["0.00", "A"],
+                  "MTRXLVL": ["0.00", "A"],
+                  "MAX": ["12.00"],
+                  "MIN": ["-65.00"],
+                  "LABEL": ["LABEL"],
+                  "FILTER": ["0", "0", "0", "0"],
+                  "AGCSET": ["-20.00", "0.00", "1.00", "6.00"],
+                  "VER": ["4.1.0"],
+                  "DSPVER": ["1.0"],
+                  "SERECHO": ["1"],
+                  "MDMODE": ["0"],
+                  "MINIT": ["ATZ"],
+                  "MPASS": ["NONE"],
+                  "TOUT": ["0"],
+                  "REFSEL": ["1"]}
+# commands the simulator does not know answer ERROR_UNKNOWN_COMMAND
+known_commands = set(XAPX00.addressArgs) | set(default_values) | {
+    "UID", "DID", "SFTYMUTE", "LFP", "GATE", "MUTE", "BAUD", "DFLTM", "FLOW", "FMP", "FPP",
+    "LMO", "MASTER", "MMAX"}
+# commands whose value may be a relative change (ending in R)
+relative_commands = ("GAIN", "MTRXLVL")
+
+
+class XAPUnitSim(object):
+    """State of one simulated unit"""
+
+    def __repr__(self):
+        return "XAPUnitSim: " + self.device_type + " (ID " + str(self.device_id) + ")"
+
+    def __init__(self, device_id, device_type="XAP800"):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.prefix = unit_prefixes[device_type]
+        self.geo = XAPX00.matrixGeo[device_type]
+        self.channels = set(str(x['c']) for x in self.geo)
+        self.values = {}  # (command, address args...): value items
+        self.values[("UID",)] = ["#0x%s%07X" % (self.prefix, 0x1000 + device_id)]
+        self.values[("DID",)] = [str(device_id)]
+        self.echo = True  # SERECHO, a unit with echo off answers nothing
+
+    def level(self, channel, group, stage):
+        """LVL reading of a channel, replace to simulate signal"""
+        return -80.0
+
+    def handle(self, command, args):
+        """Answer one command.
+        Returns:
+            list of response lines without line endings
+        """
+        if command == "SERECHO" and args:
+            self.echo = args[0] != "0"
+        lines = self._answer(command, args)
+        return lines if self.echo else []
+
+    def _answer(self, command, args):
+        header = "#" + self.prefix + str(self.device_id)
+        if command not in known_commands:
+            return ["ERROR %d" % ERROR_UNKNOWN_COMMAND]
+        nAddress = XAPX00.addressCount(command, args)
+        address = [a.upper() for a in args[:nAddress]]
+        values = args[nAddress:]
+        if command in ("MTRX", "MTRXLVL"):
+            if len(address) < 4 or address[0] not in self.channels:
+                return ["ERROR %d" % ERROR_BAD_ADDRESS]
+            if address[2] == "*":
+                lines = []
+                for x in self.geo:
+                    if x['og'] != address[3] or (str(x['c']) == address[0] and x['og'] in ("E", "P")):
+                        continue
+                    cell = [address[0], address[1], str(x['c']), address[3]]
+                    lines += self._answer(command, cell + values)
+                return lines
+            if address[2] not in self.channels:
+                return ["ERROR %d" % ERROR_BAD_ADDRESS]
+        if command == "LVL":
+            level = self.level(*(address + [None] * 3)[:3])
+            return ["%s LVL %s %.2f" % (header, " ".join(address), level)]
+        if command == "PRESET" and address:  # recalling a preset, back to defaults
+            self.values = dict((k, v) for k, v in self.values.items() if k[0] in ("UID", "DID"))
+            return [" ".join([header, command] + address)]
+        key = tuple([command] + address)
+        if values:
+            if command in relative_commands and values[-1].upper() == "R":
+                current = float(self.values.get(key, default_values[command])[0])
+                values = ["%.2f" % (current + float(values[0])), "A"]
+            elif command in relative_commands:
+                values = ["%.2f" % float(values[0]), "A"]
+            elif command in XAPX00.toggleCommands and values[-1] == "2":
+                current = self.values.get(key, default_values.get(command, ["0"]))[0]
+                values = ["0" if current != "0" else "1"]
+            self.values[key] = list(values)
+        value = self.values.get(key, default_values.get(command, ["0"]))
+        return [" ".join([header, command] + address + list(value))]
+
+
+class XAPSimulator(object):
+    """A stack of simulated units behind one serial link.
+    units - {unit id: "XAP800" or "XAP400"}
+    baudRate - bytes are paced at 10 bits each (8N1), None for no pacing
+    latency - seconds each command takes before its answer starts
+    """
+
+    def __init__(self, units=None, baudRate=38400, latency=0.005):
+        self.units = {}
+        for device_id, device_type in (units or {0: "XAP800"}).items():
+            self.units[int(device_id)] = XAPUnitSim(int(device_id), device_type)
+        self.baudRate = baudRate
+        self.latency = latency
+        self.commands = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.log = []  # commands received, kept when keepLog is set
+        self.keepLog = False
+        self.path = None
+        self.address = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._outgoing = queue.Queue()
+        self._write = None
+        self._master = None
+        self._slave = None
+        self._server = None
+
+    def __repr__(self):
+        return "XAPSimulator: " + str(self.path or self.address)
+
+    @property
+    def byteTime(self):
+        return 10.0 / self.baudRate if self.baudRate else 0
+
+    def resetCounters(self):
+        self.commands = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.log = []
+
+    def startPty(self):
+        """Serve the stack on a new pseudo terminal.
+        Returns:
+            the path to open with serial.Serial
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        master = self._master
+
+        def read():
+            ready = select.select([master], [], [], 0.1)[0]
+            return os.read(master, 4096) if ready else b''
+
+        def write(data):
+            os.write(master, data)
+        self._start(read, write)
+        return self.path
+
+    def startSocket(self, host="127.0.0.1", port=0):
+        """Serve the stack to one TCP client at a time.
+        Returns:
+            the socket:// url to open with serial.serial_for_url
+        """
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        client = {}
+
+        def read():
+            if 'conn' not in client:
+                if not select.select([self._server], [], [], 0.1)[0]:
+                    return b''
+                client['conn'] = self._server.accept()[0]
+            if not select.select([client['conn']], [], [], 0.1)[0]:
+                return b''
+            data = client['conn'].recv(4096)
+            if not data:  # client went away, wait for the next one
+                client.pop('conn').close()
+            return data
+
+        def write(data):
+            if 'conn' in client:
+                client['conn'].sendall(data)
+        self._start(read, write)
+        return "socket://%s:%d" % self.address
+
+    def stop(self):
+        self._stop.set()
+        self._outgoing.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def report(self, device_id, command, *args):
+        """Change a parameter as if from the front panel and send the
+        unsolicited report a unit would"""
+        unit = self.units[device_id]
+        self._send(unit.handle(command.upper(), [str(a) for a in args]))
+
+    def handleLine(self, line):
+        """Answer one command line.
+        Returns:
+            list of response lines without line endings
+        """
+        items = line.split()
+        if not items:
+            return []
+        header = items[0]
+        if len(header) < 3 or header[0] != "#" or not header[2:].isdigit():
+            return []
+        unit = self.units.get(int(header[2:]))
+        if unit is None or unit.prefix != header[1]:
+            return []  # nobody at that address, the line times out
+        if len(items) < 2:
+            return ["ERROR %d" % ERROR_UNKNOWN_COMMAND]
+        return unit.handle(items[1].upper(), items[2:])
+
+    def _start(self, read, write):
+        self._stop.clear()
+        self._write = write
+        self._threads = [threading.Thread(target=self._receive, args=(read,), name="xapsim rx"),
+                         threading.Thread(target=self._transmit, name="xapsim tx")]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _receive(self, read):
+        """Split incoming bytes into commands and answer them in order"""
+        buffer = b''
+        clock = time.time()  # when the last received byte finished arriving
+        while not self._stop.is_set():
+            data = read()
+            if not data:
+                continue
+            self.bytesIn += len(data)
+            clock = max(clock, time.time()) + len(data) * self.byteTime
+            buffer += data
+            while b'\r' in buffer:
+                raw, buffer = buffer.split(b'\r', 1)
+                line = raw.decode(errors="replace").strip()
+                if not line:
+                    continue
+                self.commands += 1
+                if self.keepLog:
+                    self.log.append(line)
+                wait = clock + self.latency - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self._send(self.handleLine(line))
+
+    def _send(self, lines):
+        for line in lines:
+            self._outgoing.put((line + "\r\n").encode())
+
+    def _transmit(self):
+        """Write responses, paced to the baud rate"""
+        while 1:
+            data = self._outgoing.get()
+            if data is None:
+                return
+            started = time.time()
+            self._write(data)
+            self.bytesOut += len(data)
+            wait = started + len(data) * self.byteTime - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulate a stack of XAP units")
+    parser.add_argument("--units", default="0:XAP800", help="id:type,... e.g. 0:XAP800,1:XAP400")
+    parser.add_argument("--baud", type=int, default=38400)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--socket", type=int, default=None, help="serve on this TCP port instead of a pty")
+    options = parser.parse_args()
+    units = dict(unit.split(":") for unit in options.units.split(","))
+    sim = XAPSimulator(units, baudRate=options.baud, latency=options.latency)
+    if options.socket is not None:
+        print("Serving on " + sim.startSocket("0.0.0.0", options.socket))
+    else:
+        print("Serving on " + sim.startPty())
+    try:
+        while 1:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()